@@ -6,6 +6,7 @@ Desc:
 """
 
 from time import *
+from collections import namedtuple
 import sys
 
 """
@@ -21,6 +22,87 @@ bestiary = {"01": "Baby",
             "06": "Geriatric",
             "07": "Ascended"}
 
+# A fiend evolves into its next form every this many levels
+EVOLVE_LEVEL = 5
+
+# 4 * k**3 % 5 repeats every 5 levels (k = 1, 2, 3, 4, 5 -> 4, 2, 3, 1, 0). These are the running
+#   sums of one period, which add up to 10
+CAP_REMAINDERS = (0, 4, 6, 9, 10)
+
+# The outcome of an xp grant: the new level, leftover xp and cap, plus how many levels and
+#   evolution stages were gained
+XPGrant = namedtuple("XPGrant", ["level", "xp", "xpCap", "levelsGained", "evolutions"])
+
+
+def capFor(level):
+    """
+    Params:
+        level (int) -- a level
+    Desc: The xp needed to go from level to level + 1 (fast-leveling pokemon curve). A new Level starts with a cap
+          of 3 instead, see Level.
+    """
+    return (4 * level ** 3) // 5
+
+
+def totalCap(n):
+    """
+    Params:
+        n (int) -- the last level to count
+    Desc: Closed form sum of capFor(1) + ... + capFor(n). Sum of 4k^3 is (n(n+1))^2, and each floor drops
+          4k^3 % 5, which repeats every 5 levels.
+    """
+    if n <= 0:
+        return 0
+    remainders = 10 * (n // 5) + CAP_REMAINDERS[n % 5]
+    return ((n * (n + 1)) ** 2 - remainders) // 5
+
+
+def evolutionStage(level):
+    """
+    Params:
+        level (int) -- a level
+    Desc: How many times a fiend at this level has evolved
+    """
+    return level // EVOLVE_LEVEL
+
+
+def grantXP(level, xp, xpCap, value):
+    """
+    Params:
+        level (int) -- the current level
+        xp (int) -- the current xp
+        xpCap (int) -- the xp needed for the next level
+        value (int) -- the amount of experience being added
+    Desc: Works out where an xp grant lands without looping level by level: O(log n) in the levels gained, no
+          sleeping or printing. Pays the current cap first (which may be the starting cap of 3), then binary
+          searches the cumulative curve for the highest level the rest of the xp pays for.
+          Returns an XPGrant.
+    """
+    xp += value
+    if xp < xpCap:
+        return XPGrant(level, xp, xpCap, 0, 0)
+
+    xp -= xpCap
+    newLevel = level + 1
+
+    # Highest last such that capFor(newLevel) + ... + capFor(last) <= xp
+    spent = totalCap(newLevel - 1)
+    budget = xp + spent
+    low, high = newLevel - 1, max(newLevel, 1)
+    while totalCap(high) <= budget:
+        low, high = high, high * 2
+    while high - low > 1:
+        middle = (low + high) // 2
+        if totalCap(middle) <= budget:
+            low = middle
+        else:
+            high = middle
+
+    xp -= totalCap(low) - spent
+    newLevel = low + 1
+    return XPGrant(newLevel, xp, capFor(newLevel), newLevel - level,
+                   evolutionStage(newLevel) - evolutionStage(level))
+
 
 def delay_print(s, delay):
     """
@@ -46,7 +128,7 @@ def testFiend():
     for i in range(5):
         sleep(0.5)
         print(f"\nStep: {i+1}")
-        myFiend.updateXP(50)
+        myFiend.updateXP(50, animate=True)
     myFiend.printinfo()
     # myFiend.seppuku()
 
@@ -70,34 +152,26 @@ class Level:
         """
         return str(self.value)
 
-    def incrementXP(self, value):
+    def incrementXP(self, value, animate=False):
         """
         Params:
             value (int) -- the amount of experience you want to be added to the fiend
+            animate (bool) -- print the xp and each level-up, pausing between them (for the console)
         Desc: (NOTE: only for positive increases, currently does not handle negative numbers).
-              First adds all the experience. Loops while level-up can still occur. If the xpCap is reached,
-              it calls levelUp() to increase the level, and the xpCap is then reset. Returns how much the monster's
-              level increase by.
+              Adds the experience and levels up as far as it reaches in one step with grantXP(), so it is safe
+              to call while handling a request. Returns how much the monster's level increased by.
         """
-        done = False
         oldLevel = self.value
+        grant = grantXP(self.value, self.xp, self.xpCap, value)
+        self.value, self.xp, self.xpCap = grant.level, grant.xp, grant.xpCap
 
-        print(f"EXP increased by {value} points!")
-        self.xp += value
-
-        while not done:
-            prevLevel = self.value
-
-            if self.xp >= self.xpCap:  # levelup
-                self.levelUp()
-                print(f"LEVELED UP TO LEVEL {str(self.value)}!!!")
+        if animate:
+            print(f"EXP increased by {value} points!")
+            for level in range(oldLevel + 1, self.value + 1):
+                print(f"LEVELED UP TO LEVEL {str(level)}!!!")
+                sleep(0.25)
 
-            if self.value == prevLevel:
-                done = True
-
-            sleep(0.25)
-
-        return self.value - oldLevel  # how much you leveled up
+        return grant.levelsGained  # how much you leveled up
 
     def levelUp(self):
         """
@@ -143,34 +217,45 @@ class Fiend:
         """
         return self.level.value
 
-    def updateXP(self, value):
+    def updateXP(self, value, animate=False):
         """
         Params:
             value (int) -- the amount of experience you want to be added to the fiend
+            animate (bool) -- print the level-ups and evolutions, pausing between them (for the console)
         Desc: method wrapper for incrementXP from level class. incrementXP() handles adding xp, leveling up, and
-        resetting the cap. Then handles the evolution of the monster. On level-up, checks if monster is ready to
-        evolve (currently set to every 5th level). If it is, updates the monster's form with transform()
+        resetting the cap. Then handles the evolution of the monster: it evolves once for every evolution level
+        (currently every 5th level) it passed, up to its last form, updating the monster's form with transform().
+        Returns how many levels were gained.
         """
-        leveled = self.level.incrementXP(value)
-        evolveLevel = 5
-        toEvolve = self.level.value % evolveLevel
-        if toEvolve == 0 and leveled > 0:
-            self.transform()
+        oldLevel = self.level.value
+        leveled = self.level.incrementXP(value, animate)
+        formsLeft = len(bestiary) - int(self.id[2:4])
+        for _ in range(max(min(evolutionStage(self.level.value) - evolutionStage(oldLevel), formsLeft), 0)):
+            self.transform(animate)
+        return leveled
 
-    def transform(self):
+    def transform(self, animate=False):
         """
+        Params:
+            animate (bool) -- print the evolution, pausing between the dots (for the console)
         Desc: generic handler for changing a monsters form. Currently only associated with evolution, but can be
         adapted to change species as well. First updates the form portion (second half) of the species_id by
-        incrementing by 1. Then it returns the new species ID. The species here does not change, only the form.
+        incrementing by 1, unless it is already in its last form. Then it returns the new species ID. The species
+        here does not change, only the form.
         """
-        print(f"{self.nickname} is evolving!!!")
-        for _ in range(3):
-            sleep(0.5)
-            print("  .  ")
+        newForm = f"{int(self.id[2:4]) + 1:02d}"
+        if newForm not in bestiary:
+            return self.species
+
+        if animate:
+            print(f"{self.nickname} is evolving!!!")
+            for _ in range(3):
+                sleep(0.5)
+                print("  .  ")
 
-        newFormInt = int(self.id[3]) + 1
-        self.id = self.id[0:3] + str(newFormInt) + self.id[4:]  # dont ask me
-        print(f"{self.species} grew into it's {bestiary[self.id[2:]]} form!!!")
+        self.id = self.id[0:2] + newForm + self.id[4:]
+        if animate:
+            print(f"{self.species} grew into it's {bestiary[self.id[2:]]} form!!!")
 
         return self.species
 
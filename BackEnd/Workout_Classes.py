@@ -5,7 +5,79 @@ author(s): Thomas Joyce
 last modified: 17 Nov 2021
 '''
 from db_manager import *
-from collections import defaultdict
+from workout_catalog import workout_catalog
+from collections import defaultdict, OrderedDict
+import threading
+import time
+
+# prescription given for each exercise in a plan
+DEFAULT_SETS = 3
+DEFAULT_REPS = 8
+
+# how many goals' plan templates are kept in memory
+PLAN_TEMPLATE_CACHE_SIZE = 128
+
+# how many users' plans are written per transaction by make_all_plans
+PLAN_BATCH_SIZE = 500
+
+# the user data a plan is built from: the user's goal name
+PLAN_INPUTS_SQL = "SELECT u.user_id, g.name FROM users u\
+                   LEFT JOIN fitnessGoal g ON g.fitness_id = u.fitness_goal_id"
+
+
+class PlanNotSaved(Exception):
+    '''
+    raised inside a save_plan transaction so a half written plan is rolled back
+    '''
+    pass
+
+
+class PlanTemplateCache:
+    '''
+    LRU cache of built plans keyed by goal. users with the same goal get the
+    same exercises, so a plan is only built once per goal. entries remember the workout catalog version they were built
+    from and are rebuilt once the catalog reloads.
+    '''
+    def __init__(self, catalog, size=PLAN_TEMPLATE_CACHE_SIZE):
+        self.catalog = catalog
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._templates = OrderedDict()
+
+    def get(self, key, build):
+        '''
+        pass the template key and a function that builds the template.
+        returns the cached template, building (and caching) it if it is
+        missing or was built from an older catalog.
+        '''
+        with self._lock:
+            version = self.catalog.version
+            entry = self._templates.get(key)
+            if entry is not None and entry[0] == version:
+                self._templates.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        # tagged with the version from before the build, so a template built
+        # while the catalog reloads is built again on its next use
+        template = build()
+        with self._lock:
+            self._templates[key] = (version, template)
+            self._templates.move_to_end(key)
+            while len(self._templates) > self.size:
+                self._templates.popitem(last=False)
+        return template
+
+    def stats(self):
+        '''
+        returns a dictionary of the cache's size, entries, hits and misses
+        '''
+        with self._lock:
+            return {"size": self.size, "templates": len(self._templates),\
+                    "hits": self.hits, "misses": self.misses}
 
 
 class Workout:
@@ -21,9 +93,10 @@ class Workout:
         pass category as string of workout type (ie, chest)
         will call for a workout from the database of that type
         prioritizes workouts set as primary
+        served from the in-memory workout catalog, so no query is run
         '''
-        exercise = db_mgr.get_all_rows("workouts",["workout_id"],\
-                                      {"type": category,"is_priority":1},["and"])
+        exercise = [(workout.workout_id,) for workout in \
+                    workout_catalog.find(category, is_priority=True)]
         return exercise
     
     def populate_plan(self):
@@ -95,7 +168,7 @@ class Strength:
     parent class for strength workouts
     reps, sets, and days per week set to default
     '''
-    def __init__(self, reps=8, sets=3, name=None, days=3, goal="general",\
+    def __init__(self, reps=DEFAULT_REPS, sets=DEFAULT_SETS, name=None, days=3, goal="general",\
                  intensity="medium"):
         self.reps = reps
         self.sets = sets
@@ -140,7 +213,7 @@ class Weights(Strength):
         by default plan is set to full body
         '''
         self.plan = fullBody()
-        super().__init__(self)
+        super().__init__()
 
     def __repr__(self):
         return "{}".format(self.plan.exercises)
@@ -179,43 +252,180 @@ class Calisthenics(Strength):
         return "test"
 
 
-def make_plan(user_id):
+# the plan templates used by build_plan
+plan_templates = PlanTemplateCache(workout_catalog)
+
+
+def save_plan(user_id, workout_ids, sets=DEFAULT_SETS, reps=DEFAULT_REPS):
     '''
-    pass user_id as a string. 
-    Will get all user data from database and then build a workout based off the
-    user data. 
-    the workout plan is stored in workout logs under the user id. 
+    pass user_id as a string and the plan's workout ids as a list, in order.
+    stores the plan as a workout log plus one workoutLogExercises row per
+    exercise and makes it the user's latest log, in one transaction.
+    returns the new log_id, or False if the plan could not be stored.
+    '''
+    try:
+        with db_mgr.transaction():
+            if not db_mgr.add_one_row("workoutLogs", {"user_id": user_id,\
+                                      "workout_ids": "", "details": "",\
+                                      "user_has_completed": False,\
+                                      "user_enjoyment": 0}):
+                raise PlanNotSaved()
+            log_id = db_mgr.get_last_inserted_id()
+            exercises = [{"log_id": log_id, "position": position,\
+                          "workout_id": workout_id, "sets": sets, "reps": reps,\
+                          "weight": None}\
+                         for position, workout_id in enumerate(workout_ids)]
+            if exercises and not db_mgr.add_many_rows("workoutLogExercises", exercises):
+                raise PlanNotSaved()
+            # move the user's latest log pointer in the same transaction
+            if not db_mgr.upsert_rows("latestWorkoutLogs", [{"user_id": user_id,\
+                                      "log_id": log_id}], ["user_id"]):
+                raise PlanNotSaved()
+    except PlanNotSaved:
+        return False
+    return log_id
+
+
+def build_plan(goal=None):
+    '''
+    pass the user's goal name (or None).
+    the exercises come from the plan template for the user's goal, so no
+    queries are run and most calls are a dictionary lookup.
+    returns the plan's workout ids (in order), sets and reps.
+    '''
+    workout_ids, sets, reps = plan_templates.get(goal, lambda: generate_plan(goal))
+    return list(workout_ids), sets, reps
+
+
+def generate_plan(goal):
+    '''
+    builds a plan template from the workout catalog.
+    returns the plan's workout ids as a tuple, sets and reps.
     '''
-    goal_id = db_mgr.get_one_row("users",["fitness_goal_id"],\
-                                 {"user_id": user_id})
-    goal = db_mgr.get_one_row("fitnessGoal",["name"], {"name": goal_id})
     w = Weights()
     w.goal = goal
     w.generate_Workout()
     exercises = []
     for exercise in w.plan.exercises:
         exercises.append(w.plan.exercises[exercise][0][0])
-    x = ''
-    for i in range(len(exercises)):
-        x += str(exercises[i])
-        if i < (len(exercises) - 1):
-            x += ','
-    db_mgr.add_one_row("workoutLogs", {"user_id":user_id,\
-                       "details": x, "user_has_completed": False,\
-                       "user_enjoyment": 0})
+    return tuple(exercises), w.sets, w.reps
+
+
+def make_plan(user_id):
+    '''
+    pass user_id as a string. 
+    Will get all user data from database and then build a workout based off the
+    user data. 
+    the workout plan is stored in workout logs under the user id. 
+    returns the new log_id, or False if the plan could not be stored.
+    '''
+    user = db_mgr.submit_query(PLAN_INPUTS_SQL + " WHERE u.user_id=%s", (user_id,))
+    if not user:
+        return False
+    _, goal = user[0]
+    exercises, sets, reps = build_plan(goal)
+    return save_plan(user_id, exercises, sets, reps)
+
+
+def make_all_plans(batch_size=PLAN_BATCH_SIZE, skip_made_today=False):
+    '''
+    generates a fresh plan for every user (ie, before the morning email, see
+    email_scheduler). with skip_made_today, users that already got a plan
+    today are left alone, so running it again the same day changes nothing.
+    the user data is read in one scan, the plans are built in memory from the
+    workout catalog and written with multi-row inserts, one transaction per
+    batch of users.
+    returns a dictionary with the number of plans made, users that failed,
+    seconds taken and plans per second.
+    '''
+    start = time.perf_counter()
+    made = 0
+    failed = 0
+
+    sql = PLAN_INPUTS_SQL
+    if skip_made_today:
+        sql += " WHERE NOT EXISTS (SELECT 1 FROM workoutLogs l\
+                WHERE l.user_id = u.user_id AND l.time_created >= CURRENT_DATE)"
+    users = db_mgr.submit_query(sql) or []
+    for first in range(0, len(users), batch_size):
+        plans = {}
+        for user_id, goal in users[first:first + batch_size]:
+            try:
+                plans[user_id] = build_plan(goal)
+            except IndexError:
+                # a muscle group of the plan has no priority workout
+                failed += 1
+        if not plans:
+            continue
+        if save_plans(plans):
+            made += len(plans)
+        else:
+            failed += len(plans)
+
+    seconds = time.perf_counter() - start
+    plans_per_second = made / seconds if seconds > 0 else float(made)
+    print("Made {} plans ({} failed) in {:.2f}s ({:.0f} plans/s)".format(\
+          made, failed, seconds, plans_per_second))
+    return {"plans": made, "failed": failed, "seconds": seconds,\
+            "plans_per_second": plans_per_second}
+
+
+def save_plans(plans):
+    '''
+    pass a dictionary of user_id to (workout ids, sets, reps).
+    stores every plan like save_plan does, but with one multi-row insert for
+    the logs, one for their exercises and one update of the users' latest log
+    pointers, all in one transaction.
+    returns True, or False if the plans could not be stored (none are kept).
+    '''
+    logs = [{"user_id": user_id, "workout_ids": "", "details": "",\
+             "user_has_completed": False, "user_enjoyment": 0}\
+            for user_id in plans]
+    try:
+        with db_mgr.transaction():
+            # the new logs are this batch's users' logs after the current newest
+            # log, matched back to the plans by user_id
+            newest = db_mgr.submit_query("SELECT MAX(log_id) FROM workoutLogs")
+            if newest is False:
+                raise PlanNotSaved()
+            newest = newest[0][0] or 0
+            if db_mgr.bulk_insert("workoutLogs", logs, len(logs)) is False:
+                raise PlanNotSaved()
+            new_logs = db_mgr.submit_query("SELECT log_id, user_id FROM workoutLogs\
+                                           WHERE log_id > %s AND user_id IN ({})".format(\
+                                           ",".join(["%s"] * len(plans))), (newest, *plans))
+            if new_logs is False:
+                raise PlanNotSaved()
+            # another connection saving a plan for one of these users at the
+            # same time (seen under READ COMMITTED) makes the match ambiguous,
+            # so the batch is rolled back instead of guessing
+            if len(new_logs) != len(plans) or len(set(user_id for _, user_id in new_logs)) != len(plans):
+                raise PlanNotSaved()
+            exercises = []
+            for log_id, user_id in new_logs:
+                workout_ids, sets, reps = plans[user_id]
+                for position, workout_id in enumerate(workout_ids):
+                    exercises.append({"log_id": log_id, "position": position,\
+                                      "workout_id": workout_id, "sets": sets,\
+                                      "reps": reps, "weight": None})
+            if exercises and db_mgr.bulk_insert("workoutLogExercises", exercises) is False:
+                raise PlanNotSaved()
+            # move every user's latest log pointer
+            pointers = [{"user_id": user_id, "log_id": log_id} for log_id, user_id in new_logs]
+            if not db_mgr.upsert_rows("latestWorkoutLogs", pointers, ["user_id"]):
+                raise PlanNotSaved()
+    except PlanNotSaved:
+        return False
+    return True
     
 
 if __name__ == "__main__":
     # make_plan("1")
-    test = db_mgr.get_one_row("workoutLogs",["details"],\
+    test = db_mgr.get_all_rows("latestWorkoutLogs", ["log_id"],\
                                  {"user_id": "1"})
     print(test)
-    w = Weights()
-    w.generate_Workout()
-    exercises = []
-    for exercise in w.plan.exercises:
-        exercises.append(w.plan.exercises[exercise][0][0])
+    exercises, sets, reps = build_plan()
     print(exercises)
 
-    test = db_mgr.get_all_rows("workoutLogs", ["user_id", "details"])
+    test = db_mgr.get_all_rows("workoutLogExercises", ["log_id", "workout_id"])
     print(test)
\ No newline at end of file
@@ -7,9 +7,12 @@ Last modified: 11/19/21
 """
 import flask
 from flask_restful import reqparse, abort, Api, Resource
-from login import login_page
+from werkzeug.exceptions import HTTPException
+from login import login_page, ensure_unique_emails
 from monster_endpoints import monster_page
+from auth import init_auth, user_route, admin_route
 from db_manager import db_mgr
+from write_buffer import write_buffer
 import json
 import datetime
 
@@ -18,16 +21,102 @@ app = flask.Flask(__name__)
 app.register_blueprint(login_page)
 app.register_blueprint(monster_page)
 
+# Every route marked with @user_route needs a valid token (see auth.py)
+init_auth(app)
+
 # Generate the Api instance
 api = Api(app)
 
-# List of table names for abort errors
-db_tables = db_mgr.get_tables()
+# Load the schema catalog once at startup so requests don't need any metadata queries
+db_mgr.load_schema()
+
+# Account creation relies on the unique email key, add it if the database predates it
+ensure_unique_emails()
+
+# Date formats used when sending dates (and days, for date columns) back to the client
+DATE_FORMAT = "%d/%m/%Y, %H:%M:%S"
+DAY_FORMAT = "%d/%m/%Y"
 
 ###
 #   Helper API functions
 ###
-def get_results(table, arg_columns, where_specifiers, id_name=None, id_value=None):
+
+# Converts a date value into a string the client can read
+def format_date(val):
+    return val.strftime(DATE_FORMAT) if val is not None else None
+
+# Converts a day (date column) value into a string the client can read
+def format_day(val):
+    return val.strftime(DAY_FORMAT) if val is not None else None
+
+# Fallback for columns we don't know the type of, check the value itself
+def format_unknown(val):
+    if isinstance(val, datetime.datetime):
+        return format_date(val)
+    if isinstance(val, datetime.date):
+        return format_day(val)
+    return val
+
+# Column types (from the schema catalog) that need converting before being sent as json
+type_serializers = {
+    'datetime': format_date,
+    'timestamp': format_date,
+    'date': format_day
+}
+
+# Gets the function each column's values need to go through (None if the value can be sent as is)
+def column_serializers(table, columns):
+    column_types = db_mgr.get_table_column_types(table)
+    return [type_serializers.get(column_types[col]) if col in column_types else format_unknown for col in columns]
+
+# Aborts the request if the table does not exist
+def abort_if_no_table(table):
+    if not db_mgr.has_table(table):
+        abort(404, message=f"Error: Table {table} does not exist")
+
+# Turns a row from the database into a json dictionary
+# Dates need to be converted to strings, which columns need it comes from the column types
+def row_to_json(row, arg_columns, serializers):
+    curr_row = {}
+    for col_count, column in enumerate(arg_columns):
+        val = row[col_count]
+        serialize = serializers[col_count]
+        curr_row[column] = val if serialize is None else serialize(val)
+    return curr_row
+
+# Gets the paging options (limit, after) from the request, checking they make sense for the table
+# Returns the limit, the after value, the key column to page by and the columns to select
+def get_page_options(table, args, arg_columns):
+    limit = args.get('limit')
+    after = args.get('after')
+    if limit is None and after is None:
+        return None, None, None, arg_columns
+
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            abort(400, message="Error: limit must be a number")
+        if limit < 1:
+            abort(400, message="Error: limit must be at least 1")
+
+    # Pages are keyed on the primary key, which has to be selected to know where the page ended
+    key = db_mgr.get_table_primary_key(table) or None
+    if key is None and after is not None:
+        abort(400, message=f"Error: Table {table} has no primary key to page by")
+
+    query_columns = arg_columns
+    if key is not None and key not in arg_columns:
+        query_columns = arg_columns + [key]
+
+    return limit, after, key, query_columns
+
+def get_results(table, arg_columns, where_specifiers, id_name=None, id_value=None, page_args={}):
+    limit, after, key, query_columns = get_page_options(table, page_args, arg_columns)
+
+    # Buffered changes to the table are written first, so the rows read include them
+    write_buffer.flush(table)
+
     try:
         # The id_name and the id_value are optional
         where_options_local = where_specifiers
@@ -37,27 +126,68 @@ def get_results(table, arg_columns, where_specifiers, id_name=None, id_value=Non
         # Specify the AND connections
         and_connections = ["AND" for _ in range(len(where_options_local) - 1)]
 
-        value_results = db_mgr.get_all_rows(table, arg_columns, where_options=where_options_local, where_connectors=and_connections)
+        value_results = db_mgr.get_all_rows(table, query_columns, where_options=where_options_local, where_connectors=and_connections,
+                                            key=key, after=after, limit=limit)
     except TypeError:
         abort(500, message="Error: Failure parsing arguments")
 
     # Store the results in a json format
+    serializers = column_serializers(table, arg_columns)
     json_result = {}
     for row_count, row in enumerate(value_results):
-        curr_row = {}
-        for col_count, column in enumerate(arg_columns):
-            val = row[col_count]
-
-            # If the value returned is a date, we need to convert it to a string 
-            if (isinstance(val, datetime.datetime)):
-                curr_row[column] = val.strftime("%d/%m/%Y, %H:%M:%S")
-            else:
-                curr_row[column] = val
-
         # Append the current json dictionary to the overall dict
-        json_result[row_count] = curr_row
-    
-    return json_result
+        json_result[row_count] = row_to_json(row, arg_columns, serializers)
+
+    # Let the client know where the next page starts
+    headers = {}
+    if key is not None and value_results:
+        headers['X-Next-After'] = str(value_results[-1][query_columns.index(key)])
+
+    return json_result, 201, headers
+
+# Same as get_results, but writes the json out as rows are read instead of building it in memory
+def stream_results(table, arg_columns, where_specifiers, page_args={}):
+    limit, after, key, query_columns = get_page_options(table, page_args, arg_columns)
+    write_buffer.flush(table)
+
+    and_connections = ["AND" for _ in range(len(where_specifiers) - 1)]
+    # Nothing is read until the response starts, so errors are handled inside generate()
+    rows = db_mgr.iter_rows(table, query_columns, where_options=where_specifiers, where_connectors=and_connections,
+                            key=key, after=after, limit=limit)
+
+    serializers = column_serializers(table, arg_columns)
+    key_index = query_columns.index(key) if key is not None else None
+
+    # Same shape as get_results: {"0": {row}, "1": {row}, ...}
+    # When paging, the object ends with a "next_after" entry holding the last row's key (the
+    #   X-Next-After header of get_results, which can't be known before the rows are sent).
+    # If the read fails part way the status has already been sent, so the object ends with an
+    #   "error" entry instead, letting the client know the rows before it are incomplete
+    def generate():
+        yield "{"
+        row_count = 0
+        last_key = None
+        error = None
+        try:
+            for row in rows:
+                separator = ", " if row_count != 0 else ""
+                yield f'{separator}"{row_count}": {json.dumps(row_to_json(row, arg_columns, serializers), default=str)}'
+                row_count += 1
+                if key_index is not None:
+                    last_key = row[key_index]
+        except TypeError:
+            error = "Error: Failure parsing arguments"
+        except db_mgr.Error:
+            error = "Rows could not be streamed, the result is incomplete"
+
+        separator = ", " if row_count != 0 else ""
+        if error is not None:
+            yield f'{separator}"error": {json.dumps(error)}'
+        elif last_key is not None:
+            yield f'{separator}"next_after": {json.dumps(str(last_key))}'
+        yield "}"
+
+    return flask.Response(flask.stream_with_context(generate()), status=201, mimetype="application/json")
 
 def post_results(table, data, where_specifiers, id_name=None, id_value=None):
     # Make sure the data is a dictionary
@@ -71,6 +201,8 @@ def post_results(table, data, where_specifiers, id_name=None, id_value=None):
     # Specify the AND connections
     and_connections = ["AND" for _ in range(len(where_options_local) - 1)]
 
+    # Write any buffered changes to the table first, or they would overwrite this update later
+    write_buffer.flush(table)
     update_results = db_mgr.update_rows(table, data, where_options=where_options_local, where_connectors=and_connections)
 
     if (update_results):
@@ -87,9 +219,14 @@ def post_results(table, data, where_specifiers, id_name=None, id_value=None):
 #       get     -> Used to retrieve data (takes in an id from the uri and wants list data for columns)
 #       post    -> Used to update data   (takes in an id from the uri and wants dict data for new data)
 #       put     -> Used to create data   (wants data to store) (TODO)
+#
+#   These read and write any table (password hashes included), so they are admin routes (see auth.py)
 ###
+@admin_route
 class ApiInfoPointSpec(Resource):
     def get(self, table_name, id):
+        abort_if_no_table(table_name)
+
         # Try to get the arguments to the user
         try: 
             args = json.loads(flask.request.data)
@@ -106,9 +243,10 @@ class ApiInfoPointSpec(Resource):
 
         primary_key = db_mgr.get_table_primary_key(table_name)
 
-        return get_results(table_name, args['columns'], args['where'], primary_key, id), 201
+        return get_results(table_name, args['columns'], args['where'], primary_key, id)
 
     def post(self, table_name, id):
+        abort_if_no_table(table_name)
         args = json.loads(flask.request.data)
 
         # Throw a fit if data is not sent
@@ -124,8 +262,11 @@ class ApiInfoPointSpec(Resource):
         return post_results(table_name, args['data'], args['where'], primary_key, id), 201
 
 
+@admin_route
 class ApiInfoPoint(Resource):
     def get(self, table_name):
+        abort_if_no_table(table_name)
+
         # Try to get the arguments to the user
         try: 
             args = json.loads(flask.request.data)
@@ -140,9 +281,16 @@ class ApiInfoPoint(Resource):
         if "columns" not in args:
             args['columns'] = [col[0] for col in db_mgr.get_table_columns(table_name)]
 
-        return get_results(table_name, args['columns'], args['where']), 201
+        # Paging and streaming options can be sent in the data or in the url (eg. ?limit=100&after=250)
+        page_args = {**flask.request.args, **args}
+
+        if str(page_args.get('stream', '')).lower() in ("1", "true"):
+            return stream_results(table_name, args['columns'], args['where'], page_args)
+
+        return get_results(table_name, args['columns'], args['where'], page_args=page_args)
 
     def post(self, table_name):
+        abort_if_no_table(table_name)
         args = json.loads(flask.request.data)
 
         # Throw a fit if data is not sent
@@ -155,7 +303,82 @@ class ApiInfoPoint(Resource):
 
         return post_results(table_name, args['data'], args['where']), 201
 
+###
+#   Batch endpoint
+#   Runs a list of get/post operations (same data as the endpoints above, plus the table and optional id)
+#   on one database connection, and returns each operation's result in order.
+#
+#   request_data = {
+#       "transaction": true,        (optional, all operations are rolled back if any fail)
+#       "operations": [
+#           {"method": "get", "table": "users", "id": 3, "columns": ["username"]},
+#           {"method": "post", "table": "monsters", "where": {"user_id": 3}, "data": {"exp": 10}}
+#       ]
+#   }
+###
+class BatchFailed(Exception):
+    pass
+
+def run_batch_operation(operation):
+    if type(operation) is not dict:
+        abort(400, message="Error: Each operation must be a dictionary")
+
+    method = str(operation.get('method', '')).lower()
+    table_name = operation.get('table')
+    abort_if_no_table(table_name)
+
+    where = operation.get('where', {})
+    primary_key, id = None, operation.get('id')
+    if id is not None:
+        primary_key = db_mgr.get_table_primary_key(table_name)
+
+    if method == 'get':
+        columns = operation.get('columns', [col[0] for col in db_mgr.get_table_columns(table_name)])
+        return get_results(table_name, columns, where, primary_key, id, page_args=operation)
+    elif method == 'post':
+        if "data" not in operation:
+            abort(405, message="Data is required for POST method")
+        return post_results(table_name, operation['data'], where, primary_key, id)
+
+    abort(405, message=f"Error: Unknown method {method}")
+
+@admin_route
+class ApiBatch(Resource):
+    def post(self):
+        args = json.loads(flask.request.data)
+
+        operations = args.get('operations')
+        if type(operations) is not list:
+            abort(400, message="Error: operations must be a list")
+
+        use_transaction = bool(args.get('transaction', False))
+        results = []
+
+        # Write out any buffered changes first, so the batch's operations don't have to (a flush
+        #   inside the transaction would be undone with it on a rollback)
+        write_buffer.flush()
+
+        # Hold one connection for the whole batch (and one transaction if asked for)
+        try:
+            with (db_mgr.transaction() if use_transaction else db_mgr.connection()):
+                for operation in operations:
+                    try:
+                        body, status = run_batch_operation(operation)[:2]
+                    except HTTPException as err:
+                        body = getattr(err, 'data', None) or {"message": err.description}
+                        status = err.code
+                    results.append({"status": status, "result": body})
+
+                    # A failed operation undoes the whole transaction
+                    if use_transaction and status >= 400:
+                        raise BatchFailed()
+        except BatchFailed:
+            return {"message": "Batch rolled back", "results": results}, 409
+
+        return {"message": "success", "results": results}, 201
+
 # Add the api endpoints to the api and connect them to their class
+api.add_resource(ApiBatch, '/api/batch')
 api.add_resource(ApiInfoPoint, '/api/<table_name>')
 api.add_resource(ApiInfoPointSpec, '/api/<table_name>/<int:id>')
 
@@ -167,15 +390,36 @@ api.add_resource(ApiInfoPointSpec, '/api/<table_name>/<int:id>')
 def test():
     return "Hello World"
 
+"""
+Endpoint to get the database metrics as json:
+    pool    -> connection pool size, usage and checkout waits
+    write_buffer -> buffered rows, coalesced updates and flushes of the write-behind buffer
+    queries -> per statement shape counts, rows and latency percentiles (worst total time first)
+    dropped_shapes -> shapes evicted because too many distinct statements were seen
+    slow_queries -> the most recent queries over the slow-query threshold, with the code that ran them
+Admin only (needs the ADMIN_TOKEN in the admin_token header). A POST also clears the query
+statistics after reading them.
+"""
+@app.route("/db_stats", methods=["GET", "POST"])
+@admin_route
+def db_stats():
+    stats = {"pool": db_mgr.pool_stats(), "write_buffer": write_buffer.stats(), **db_mgr.query_stats()}
+
+    if flask.request.method == "POST":
+        db_mgr.metrics.reset()
+
+    return stats, 200
+
 """
 Endpoint to reset a user's quiz status (FOR TESTING)
     Returns 201 on success, 500 on failure
 """
 @app.route("/reset_user_quiz")
+@user_route
 def reset_quiz():
-    user_id = flask.request.headers.get("user_token")
+    user_id = flask.g.user_id
 
-    res = db_mgr.update_rows("users", {"has_finished_quiz": False}, where_options={"user_id": user_id})
+    res = write_buffer.set("users", "user_id", user_id, {"has_finished_quiz": False})
 
     if res:
         return {'message': 'success'}, 201
@@ -186,11 +430,12 @@ def reset_quiz():
 Endpoint to get and store the data from a user's quiz
 """
 @app.route("/submit_user_quiz", methods=["PUT", "POST"])
+@user_route
 def submit_user_quiz():
     request_data = json.loads(flask.request.data)
 
     # Load the results from the quiz
-    user_id = request_data['user_id']
+    user_id = flask.g.user_id
     quiz_results = request_data['quiz_results']
 
     # Split the data into what needs to be stored into the monsters table and what needs to be stored in the users table
@@ -202,9 +447,8 @@ def submit_user_quiz():
     monster_data = filterByKeys(monster_keys)
     user_data = filterByKeys(user_keys)
 
-    # Add the user id to the monster data and set the user's quiz status to completed
+    # Add the user id to the monster data
     monster_data['user_id'] = user_id
-    user_data['has_finished_quiz'] = True
 
     # Store the data in the database
     user_update_res = db_mgr.update_rows("users", user_data, where_options={"user_id": user_id}) 
@@ -213,14 +457,13 @@ def submit_user_quiz():
     if not user_update_res or not monster_insert_res:
         return {'message': 'Error inserting data'}, 500
 
-    return {'message': 'success'}, 201
-
-# Gets the most recent workoutlog 
-def most_recent_workoutlog(user_id, columns=["*"]):
-    sql = f"SELECT {','.join(columns)} FROM workoutLogs WHERE user_id={user_id} ORDER BY time_created LIMIT 1"
+    # Set the user's quiz status to completed. It goes through the write buffer like the
+    #   quiz reset does, so a buffered reset can't overwrite it later
+    write_buffer.set("users", "user_id", user_id, {"has_finished_quiz": True})
 
-    return db_mgr.submit_query(sql)
+    return {'message': 'success'}, 201
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port="5000", debug=True)
+    # Each request runs on its own thread and checks out its own pooled connection
+    app.run(host='0.0.0.0', port="5000", debug=True, threaded=True)
 
@@ -0,0 +1,172 @@
+"""
+Filename: auth.py
+
+Purpose: One authentication layer for every user route. A before_request hook reads the
+         user's token, verifies it through a small cache of recently decoded tokens (so a
+         token is only HS256-decoded once until it expires) and puts the user_id, and a
+         lazily loaded user row, into the request context.
+
+Authors: Jordan Smith
+Group: Wholesome as Heck Programmers
+Last modified: 10/18/26
+"""
+import hmac
+import threading
+import time
+from collections import OrderedDict
+from os import getenv
+import flask
+from db_manager import db_mgr
+from login import decode_token
+from write_buffer import write_buffer
+
+###
+#   Globals
+###
+
+# How many verified tokens are kept, and the most seconds one is trusted without decoding it
+#   again (never past the token's own expiry)
+TOKEN_CACHE_SIZE = int(getenv("TOKEN_CACHE_SIZE", 4096))
+TOKEN_CACHE_TTL = float(getenv("TOKEN_CACHE_TTL", 300))
+
+# Header the frontend sends the token in (an "Authorization: Bearer <token>" header works too)
+TOKEN_HEADER = "user_token"
+
+# Secret for the admin routes (metrics and such), sent in the admin_token header. The admin
+#   routes are turned off if it isn't set.
+ADMIN_TOKEN = getenv("ADMIN_TOKEN")
+ADMIN_TOKEN_HEADER = "admin_token"
+
+
+"""
+TokenCache:
+Thread-safe LRU of token -> (user_id, expiry time)
+"""
+class TokenCache:
+    """
+    Initialization function
+
+    @params: size (int) - The most tokens kept
+             ttl (float) - The most seconds a token is trusted before it is decoded again
+    """
+    def __init__(self, size=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._tokens = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    """
+    Function to verify a token, decoding it only if it isn't cached
+
+    @params: token (str) - The JWT sent by the client
+    @returns: The token's user_id if it is valid and has not expired, False otherwise
+    """
+    def verify(self, token):
+        now = time.time()
+        with self._lock:
+            entry = self._tokens.get(token)
+            if entry is not None:
+                if entry[1] > now:
+                    self._tokens.move_to_end(token)
+                    self.hits += 1
+                    return entry[0]
+                del self._tokens[token]
+            self.misses += 1
+
+        payload = decode_token(token)
+        if not payload or payload.get('user_id') is None:
+            return False
+
+        # Trust the token until it expires, or until the TTL runs out if that is sooner
+        expires = min(payload.get('exp', now), now + self.ttl)
+        with self._lock:
+            self._tokens[token] = (payload['user_id'], expires)
+            self._tokens.move_to_end(token)
+            while len(self._tokens) > self.size:
+                self._tokens.popitem(last=False)
+
+        return payload['user_id']
+
+    """
+    Function to get the cache's size and hit counts
+
+    @params: None
+    @returns: A dictionary of the cache's size, number of tokens, hits and misses
+    """
+    def stats(self):
+        with self._lock:
+            return {"size": self.size, "tokens": len(self._tokens), "hits": self.hits, "misses": self.misses}
+
+token_cache = TokenCache()
+
+###
+#   Helper functions
+###
+
+# Marks a route as a user route: it is only run with a valid token, and flask.g.user_id is set
+def user_route(view):
+    view.requires_user = True
+    return view
+
+# Marks a route (or a flask_restful Resource) as an admin route: it is only run with the ADMIN_TOKEN,
+#   and doesn't exist without one
+def admin_route(view):
+    view.requires_admin = True
+    return view
+
+# Gets the token from the request headers (or None)
+def request_token():
+    token = flask.request.headers.get(TOKEN_HEADER)
+    if token:
+        return token
+
+    authorization = flask.request.headers.get("Authorization", "")
+    if authorization.startswith("Bearer "):
+        return authorization[len("Bearer "):]
+    return None
+
+# Gets the current request's user row as a dictionary, loading it the first time it is asked for
+# A valid token for a user that no longer exists ends the request with a 401
+def current_user():
+    if "user" not in flask.g:
+        columns = [column[0] for column in db_mgr.get_table_columns('users') if column[0] != 'password']
+        row = db_mgr.get_one_row('users', columns, {'user_id': flask.g.user_id})
+        if not row:
+            flask.abort(flask.make_response({'message': 'User does not exist'}, 401))
+        flask.g.user = write_buffer.overlay('users', 'user_id', flask.g.user_id, dict(zip(columns, row)))
+    return flask.g.user
+
+# The before_request hook: verifies the token of every request to a user route
+def authenticate():
+    view = flask.current_app.view_functions.get(flask.request.endpoint)
+    # Resource views carry the marks on their class
+    view = getattr(view, 'view_class', view)
+    if getattr(view, 'requires_admin', False):
+        return authenticate_admin()
+    if not getattr(view, 'requires_user', False):
+        return None
+
+    token = request_token()
+    user_id = token_cache.verify(token) if token else False
+    if user_id is False:
+        return {'message': 'Missing or invalid token'}, 401
+
+    flask.g.user_id = user_id
+    return None
+
+# Checks the admin token of a request to an admin route
+def authenticate_admin():
+    if not ADMIN_TOKEN:
+        return {'message': 'Not found'}, 404
+
+    token = flask.request.headers.get(ADMIN_TOKEN_HEADER, "")
+    if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        return {'message': 'Missing or invalid admin token'}, 401
+    return None
+
+# Adds the authentication layer to the app
+def init_auth(app):
+    app.before_request(authenticate)
@@ -0,0 +1,503 @@
+"""
+Filename: db_backends.py
+
+Purpose: The storage engines the DB_Manager can run on. Each backend knows how to open
+         connections, run the few statements that differ between engines (listing tables,
+         reading the schema, creating tables) and what its errors look like.
+         MySQL is the production engine, SQLite is an embedded engine for local runs and benchmarks.
+
+Authors: Jordan Smith
+Group: Wholesome as Heck Programmers (WaHP)
+Last modified: 10/18/26
+"""
+import re
+import sqlite3
+from functools import lru_cache
+from os import getenv
+
+
+"""
+Function to get the backend for a given name
+
+@params: name (str) - The name of the backend ('mysql' or 'sqlite')
+@returns: A backend instance
+"""
+def get_backend(name):
+    name = (name or "mysql").lower()
+    if name == "mysql":
+        return MySQLBackend()
+    elif name == "sqlite":
+        return SQLiteBackend()
+
+    raise ValueError(f"Unknown database backend '{name}'")
+
+
+"""
+Function to read the constraints entry of a table_manager table description
+
+@params: constraints (dict) - The table's 'constraints' dictionary (see DB_Manager.create_table)
+@returns: A dictionary with the table's
+            'primary_key'  -> column name (or None)
+            'foreign_keys' -> list of (column, 'table(column)') pairs
+            'unique'       -> list of (key name or None, [columns]) pairs
+            'indexes'      -> list of (index name, [columns]) pairs
+"""
+def parse_constraints(constraints):
+    parsed = {"primary_key": None, "foreign_keys": [], "unique": [], "indexes": []}
+
+    for constraint, value in constraints.items():
+        if constraint == 'PRIMARY KEY':
+            parsed["primary_key"] = value
+        elif constraint == 'FOREIGN KEY':
+            # Either one [column, reference] pair or a list of them
+            pairs = value if type(value[0]) is list else [value]
+            parsed["foreign_keys"] += [tuple(pair) for pair in pairs]
+        elif constraint == 'UNIQUE':
+            parsed["unique"].append((None, value if type(value) is list else [value]))
+        elif constraint == 'UNIQUE KEY':
+            parsed["unique"] += [(name, columns) for name, columns in value.items()]
+        elif constraint == 'INDEX':
+            parsed["indexes"] += list(value.items())
+        else:
+            raise ValueError(f"Unknown constraint '{constraint}'")
+
+    return parsed
+
+# Quotes the columns of an index: ['user_id', 'time_created DESC'] -> "`user_id`,`time_created` DESC"
+def index_columns(columns):
+    quoted = []
+    for column in columns:
+        name, _, order = column.partition(" ")
+        quoted.append(f"`{name}`" + (f" {order}" if order else ""))
+    return ",".join(quoted)
+
+
+"""
+MySQLBackend:
+Talks to a MySQL server through mysql.connector, using the DB_HOST/DB_USER/DB_PSWD environment variables
+"""
+class MySQLBackend:
+    name = "mysql"
+
+    def __init__(self):
+        # Only needed when MySQL is actually used
+        import mysql.connector
+        from mysql.connector import errorcode
+
+        self._connector = mysql.connector
+        self._errorcode = errorcode
+        self.Error = mysql.connector.Error
+
+    """
+    Function to open a new connection to the MySQL server
+
+    @params: database_name (str, optional) - The database the connection should use
+    @returns: A MySQL connection
+    """
+    def connect(self, database_name=None):
+        options = {
+            "host": getenv("DB_HOST"),
+            "user": getenv("DB_USER"),
+            "password": getenv("DB_PSWD"),
+            # Every statement commits on its own unless it is run inside a transaction
+            "autocommit": True
+        }
+        if database_name is not None:
+            options["database"] = database_name
+
+        return self._connector.connect(**options)
+
+    """
+    Function to make sure a database exists, creating it if it does not
+
+    @params: database_name (str) - Name of the database to use
+    @returns: None
+    """
+    def ensure_database(self, database_name):
+        cnx = self.connect()
+        try:
+            cnx.cursor().execute(f"USE {database_name}")
+        except self.Error as err:
+            print(f"Database {database_name} does not exist.")
+            self.create_database(database_name)
+        finally:
+            cnx.close()
+
+    """
+    Function to create a given database
+    If the creation fails, then the program exits
+
+    @params: database_name (str) - Name of the database to create
+    @returns: None
+    """
+    def create_database(self, database_name):
+        cnx = self.connect()
+        try:
+            cnx.cursor().execute(f"CREATE DATABASE {database_name} DEFAULT CHARACTER SET 'utf8'")
+        except self.Error as err:
+            print(f"Failed creating database: {err}")
+            exit(1)
+        finally:
+            cnx.close()
+
+    """
+    Function to check if a connection is still usable
+    Doesn't reconnect in place, a new session would not have the connection's prepared statements
+
+    @params: cnx - A MySQL connection
+    @returns: True if the connection is alive, False otherwise
+    """
+    def ping(self, cnx):
+        try:
+            cnx.ping(reconnect=False)
+            return True
+        except self.Error:
+            return False
+
+    # A regular cursor, results are read into memory right away
+    def cursor(self, cnx):
+        return cnx.cursor(buffered=True)
+
+    # A cursor whose statement is prepared on the server (results are read as they are fetched)
+    def prepared_cursor(self, cnx):
+        return cnx.cursor(prepared=True)
+
+    def begin(self, cnx):
+        cnx.start_transaction()
+
+    tables_query = "SHOW TABLES"
+
+    def describe_query(self, table_name):
+        return f"DESC {table_name}"
+
+    # SQL for the time `seconds` ago on the database's clock
+    def time_ago(self, seconds):
+        return f"(CURRENT_TIMESTAMP - INTERVAL {int(seconds)} SECOND)"
+
+    # An UPDATE that also hands back the key of the row it changed in the same round trip.
+    #   LAST_INSERT_ID(expr) makes the key the statement's insert id, read from the cursor's lastrowid
+    def update_returning_statement(self, table_name, assignments, where, key):
+        return f"UPDATE {table_name} SET {assignments}, `{key}` = LAST_INSERT_ID(`{key}`){where};"
+
+    def returned_key(self, cursor):
+        return cursor.lastrowid if cursor.rowcount > 0 else None
+
+    # An INSERT that updates the row instead when its unique key already exists
+    def upsert_statement(self, table_name, columns, key_columns):
+        placeholders = ",".join(["%s"] * len(columns))
+        updates = ", ".join(f"`{col}` = VALUES(`{col}`)" for col in columns if col not in key_columns)
+        return f"INSERT INTO {table_name} ({index_columns(columns)}) VALUES ({placeholders}) ON DUPLICATE KEY UPDATE {updates};"
+
+    """
+    Function to read the columns of every table in a database with one query
+
+    @params: execute - Runs a query and returns its rows, execute(sql, params=None)
+             database_name (str) - The database to read
+    @returns: A list of (table name, column name, lowercase data type, is primary key) tuples, in column order
+    """
+    def load_columns(self, execute, database_name):
+        rows = execute("SELECT TABLE_NAME, COLUMN_NAME, DATA_TYPE, COLUMN_KEY FROM INFORMATION_SCHEMA.COLUMNS "
+                       "WHERE TABLE_SCHEMA = %s ORDER BY TABLE_NAME, ORDINAL_POSITION;", (database_name,))
+        return [(table, column, data_type.lower(), key == "PRI") for table, column, data_type, key in rows]
+
+    """
+    Function to read the unique keys (including the primary key) of a table
+
+    @params: execute - Runs a query and returns its rows, execute(sql, params=None)
+             database_name (str) - The database the table is in
+             table_name (str) - The table to read
+    @returns: A list of column name tuples, one per unique key
+    """
+    def load_unique_keys(self, execute, database_name, table_name):
+        rows = execute("SELECT INDEX_NAME, COLUMN_NAME FROM INFORMATION_SCHEMA.STATISTICS "
+                       "WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s AND NON_UNIQUE = 0 "
+                       "ORDER BY INDEX_NAME, SEQ_IN_INDEX;", (database_name, table_name))
+        keys = {}
+        for index_name, column in rows:
+            keys.setdefault(index_name, []).append(column)
+        return [tuple(columns) for columns in keys.values()]
+
+    def add_unique_key_statement(self, table_name, key_name, columns):
+        return f"ALTER TABLE `{table_name}` ADD UNIQUE KEY `{key_name}` ({index_columns(columns)})"
+
+    """
+    Function to build the statements that create a table from a table_manager description
+    (see DB_Manager.create_table for the format)
+
+    @params: table_name (str) - Name of the table to be created
+             table_description (dict str) - The table's columns and constraints
+    @returns: A list of SQL statements
+    """
+    def create_table_statements(self, table_name, table_description):
+        constraints = parse_constraints(table_description.get('constraints', {}))
+
+        definitions = [f"`{table_key}` {desc}" for table_key, desc in table_description.items() if table_key != 'constraints']
+
+        if constraints["primary_key"] is not None:
+            definitions.append(f"PRIMARY KEY (`{constraints['primary_key']}`)")
+        for name, columns in constraints["unique"]:
+            definitions.append(f"UNIQUE KEY `{name}` ({index_columns(columns)})" if name else f"UNIQUE ({index_columns(columns)})")
+        for name, columns in constraints["indexes"]:
+            definitions.append(f"INDEX `{name}` ({index_columns(columns)})")
+        for column, reference in constraints["foreign_keys"]:
+            definitions.append(f"FOREIGN KEY (`{column}`) REFERENCES {reference}")
+
+        return [f"CREATE TABLE `{table_name}` (" + ",".join(definitions) + ") ENGINE=InnoDB"]
+
+    def is_table_exists_error(self, err):
+        return getattr(err, 'errno', None) == self._errorcode.ER_TABLE_EXISTS_ERROR
+
+    def is_duplicate_key_error(self, err):
+        return getattr(err, 'errno', None) == self._errorcode.ER_DUP_ENTRY
+
+    def is_schema_error(self, err):
+        return getattr(err, 'errno', None) in (self._errorcode.ER_BAD_FIELD_ERROR, self._errorcode.ER_NO_SUCH_TABLE)
+
+
+"""
+SQLiteBackend:
+Runs the database in an embedded SQLite file, no server needed. DB_NAME is used as the file name
+(a '.sqlite3' extension is added if it has none), and ':memory:' keeps the database in memory,
+shared by every pooled connection.
+Understands the same table_manager table descriptions as MySQL, so the app runs unchanged on it.
+"""
+class SQLiteBackend:
+    name = "sqlite"
+    Error = sqlite3.Error
+
+    # MySQL column options SQLite doesn't have
+    ON_UPDATE_TIMESTAMP = re.compile(r"\s+ON UPDATE CURRENT_TIMESTAMP", re.I)
+
+    """
+    Function to open a new connection to the database file
+
+    @params: database_name (str, optional) - The database (file) the connection should use
+    @returns: An SQLite connection in autocommit mode
+    """
+    def connect(self, database_name=None):
+        path, uri = self._path(database_name)
+        cnx = sqlite3.connect(path, uri=uri, timeout=30, factory=SQLiteConnection,
+                              # Connections are handed between threads by the pool (one thread at a time)
+                              check_same_thread=False,
+                              # Autocommit, transactions are started explicitly with begin()
+                              isolation_level=None,
+                              # Give back timestamp columns as datetimes like MySQL does
+                              detect_types=sqlite3.PARSE_DECLTYPES)
+        cnx.execute("PRAGMA foreign_keys = ON")
+        if not uri:
+            cnx.execute("PRAGMA journal_mode = WAL")
+            cnx.execute("PRAGMA synchronous = NORMAL")
+        return cnx
+
+    # The database file is created when it is first connected to
+    def ensure_database(self, database_name):
+        self.create_database(database_name)
+
+    def create_database(self, database_name):
+        self.connect(database_name).close()
+
+    def ping(self, cnx):
+        try:
+            cnx.execute("SELECT 1")
+            return True
+        except self.Error:
+            return False
+
+    def cursor(self, cnx):
+        return SQLiteCursor(cnx.cursor())
+
+    # sqlite3 keeps its own per-connection cache of prepared statements
+    def prepared_cursor(self, cnx):
+        return SQLiteCursor(cnx.cursor())
+
+    def begin(self, cnx):
+        cnx.execute("BEGIN")
+
+    tables_query = "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+
+    def describe_query(self, table_name):
+        return f"PRAGMA table_info(`{table_name}`)"
+
+    def time_ago(self, seconds):
+        return f"datetime('now', '-{int(seconds)} seconds')"
+
+    # UPDATE ... RETURNING hands back the key of the changed row in the same statement
+    def update_returning_statement(self, table_name, assignments, where, key):
+        return f"UPDATE {table_name} SET {assignments}{where} RETURNING `{key}`;"
+
+    def returned_key(self, cursor):
+        rows = cursor.fetchall()
+        return rows[0][0] if rows else None
+
+    def upsert_statement(self, table_name, columns, key_columns):
+        placeholders = ",".join(["%s"] * len(columns))
+        updates = ", ".join(f"`{col}` = excluded.`{col}`" for col in columns if col not in key_columns)
+        return (f"INSERT INTO {table_name} ({index_columns(columns)}) VALUES ({placeholders}) "
+                f"ON CONFLICT ({index_columns(key_columns)}) DO UPDATE SET {updates};")
+
+    """
+    Function to read the columns of every table in the database
+
+    @params: execute - Runs a query and returns its rows, execute(sql, params=None)
+             database_name (str) - Unused, a connection only sees its own database
+    @returns: A list of (table name, column name, lowercase data type, is primary key) tuples, in column order
+    """
+    def load_columns(self, execute, database_name):
+        tables = [row[0] for row in execute(self.tables_query)]
+
+        columns = []
+        for table in tables:
+            for _, column, declared_type, _, _, primary_key in execute(self.describe_query(table)):
+                # 'varchar(64)' -> 'varchar', 'int' -> 'int'
+                data_type = declared_type.split("(")[0].strip().lower()
+                columns.append((table, column, data_type, primary_key > 0))
+        return columns
+
+    """
+    Function to read the unique keys (including unique constraints) of a table
+
+    @params: execute - Runs a query and returns its rows, execute(sql, params=None)
+             database_name (str) - Unused, a connection only sees its own database
+             table_name (str) - The table to read
+    @returns: A list of column name tuples, one per unique key
+    """
+    def load_unique_keys(self, execute, database_name, table_name):
+        index_names = [row[1] for row in execute(f"PRAGMA index_list(`{table_name}`)") if row[2]]
+
+        keys = []
+        for index_name in index_names:
+            keys.append(tuple(row[2] for row in sorted(execute(f"PRAGMA index_info(`{index_name}`)"))))
+        return keys
+
+    # SQLite can't add constraints to a table, a unique index does the same job
+    def add_unique_key_statement(self, table_name, key_name, columns):
+        return f"CREATE UNIQUE INDEX `{key_name}` ON `{table_name}` ({index_columns(columns)})"
+
+    """
+    Function to build the statements that create a table from a table_manager description
+    MySQL-only column options are translated:
+        AUTO_INCREMENT primary keys -> INTEGER PRIMARY KEY AUTOINCREMENT
+        ON UPDATE CURRENT_TIMESTAMP -> a trigger that sets the column when the row is updated
+
+    @params: table_name (str) - Name of the table to be created
+             table_description (dict str) - The table's columns and constraints
+    @returns: A list of SQL statements
+    """
+    def create_table_statements(self, table_name, table_description):
+        constraints = parse_constraints(table_description.get('constraints', {}))
+        primary_key = constraints["primary_key"]
+
+        definitions = []
+        on_update_columns = []
+        for table_key, desc in table_description.items():
+            if table_key == 'constraints':
+                continue
+
+            if "AUTO_INCREMENT" in desc.upper():
+                definitions.append(f"`{table_key}` INTEGER PRIMARY KEY AUTOINCREMENT")
+                if primary_key == table_key:
+                    primary_key = None
+                continue
+
+            if self.ON_UPDATE_TIMESTAMP.search(desc):
+                desc = self.ON_UPDATE_TIMESTAMP.sub("", desc)
+                on_update_columns.append(table_key)
+
+            definitions.append(f"`{table_key}` {desc}")
+
+        if primary_key is not None:
+            definitions.append(f"PRIMARY KEY (`{primary_key}`)")
+        for name, columns in constraints["unique"]:
+            prefix = f"CONSTRAINT `{name}` " if name else ""
+            definitions.append(f"{prefix}UNIQUE ({index_columns(columns)})")
+        for column, reference in constraints["foreign_keys"]:
+            definitions.append(f"FOREIGN KEY (`{column}`) REFERENCES {reference}")
+
+        statements = [f"CREATE TABLE `{table_name}` (" + ",".join(definitions) + ")"]
+
+        # SQLite only creates secondary indexes with their own statements
+        for name, columns in constraints["indexes"]:
+            statements.append(f"CREATE INDEX `{name}` ON `{table_name}` ({index_columns(columns)})")
+
+        # Recursive triggers are off, so the trigger's own update doesn't fire it again
+        for column in on_update_columns:
+            statements.append(f"CREATE TRIGGER `{table_name}_{column}_on_update` AFTER UPDATE ON `{table_name}` "
+                              f"FOR EACH ROW WHEN NEW.`{column}` IS OLD.`{column}` BEGIN "
+                              f"UPDATE `{table_name}` SET `{column}` = CURRENT_TIMESTAMP WHERE rowid = NEW.rowid; END")
+        return statements
+
+    def is_table_exists_error(self, err):
+        return "already exists" in str(err)
+
+    def is_duplicate_key_error(self, err):
+        return isinstance(err, sqlite3.IntegrityError) and "UNIQUE constraint failed" in str(err)
+
+    def is_schema_error(self, err):
+        return isinstance(err, sqlite3.OperationalError) and \
+            any(message in str(err) for message in ("no such column", "no such table", "has no column named"))
+
+    """
+    Private function to get the file (or in-memory uri) for a database name
+
+    @params: database_name (str) - The name of the database
+    @returns: A tuple of the path (str) and whether the path is a uri (bool)
+    """
+    def _path(self, database_name):
+        if database_name is None or database_name == ":memory:":
+            return "file:fitness_fiends?mode=memory&cache=shared", True
+        if database_name.endswith((".db", ".sqlite", ".sqlite3")):
+            return database_name, False
+        return database_name + ".sqlite3", False
+
+
+"""
+SQLiteConnection:
+sqlite3 connection that can be weakly referenced (the DB_Manager tracks prepared statements per connection)
+"""
+class SQLiteConnection(sqlite3.Connection):
+    pass
+
+
+"""
+SQLiteCursor:
+Wraps an sqlite3 cursor so the DB_Manager's %s placeholders (MySQL style) work as SQLite's ? placeholders
+"""
+class SQLiteCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, params=()):
+        return self._cursor.execute(_qmark(sql), params)
+
+    def executemany(self, sql, seq_of_params):
+        return self._cursor.executemany(_qmark(sql), seq_of_params)
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchmany(self, size):
+        return self._cursor.fetchmany(size)
+
+    def close(self):
+        self._cursor.close()
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+
+# Turns MySQL style %s placeholders into SQLite's ? placeholders
+@lru_cache(maxsize=512)
+def _qmark(sql):
+    return sql.replace("%s", "?")
@@ -8,50 +8,172 @@ Authors: Jordan Smith
 Group: Wholesome as Heck Programmers (WaHP)
 Last modified: 11/19/21
 """
-import mysql.connector
-from mysql.connector import errorcode
+import sys
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
 from os import getenv
 from dotenv import load_dotenv
+from db_pool import ConnectionPool, PoolTimeoutError
+from db_backends import get_backend
+from db_metrics import QueryMetrics
 
 # Load the environment variables from the .env file
 load_dotenv()
 
+# Which storage engine to use ('mysql' or 'sqlite')
+DB_BACKEND = getenv("DB_BACKEND", "mysql")
+
+# Connection pool configuration (number of connections, seconds to wait for one)
+DB_POOL_SIZE = int(getenv("DB_POOL_SIZE", 5))
+DB_POOL_TIMEOUT = float(getenv("DB_POOL_TIMEOUT", 30))
+
+# Queries taking at least this many milliseconds are written to the slow-query log
+DB_SLOW_QUERY_MS = float(getenv("DB_SLOW_QUERY_MS", 200))
+
+# How many statement templates are kept in-process, and how many server-side
+#   prepared statements each pooled connection keeps open
+STATEMENT_CACHE_SIZE = 256
+PREPARED_PER_CONNECTION = int(getenv("DB_PREPARED_PER_CONNECTION", 64))
+
+# The most seconds the schema catalog is trusted before it is read again, so columns and tables
+#   changed by another process (a migration, another server) are picked up
+DB_SCHEMA_TTL = float(getenv("DB_SCHEMA_TTL", 300))
+
+# How many rows are read from the server at a time when streaming a result
+DB_STREAM_BATCH_SIZE = int(getenv("DB_STREAM_BATCH_SIZE", 500))
+
+# How many rows a bulk insert sends per statement (and commits per transaction)
+DB_BULK_CHUNK_SIZE = int(getenv("DB_BULK_CHUNK_SIZE", 1000))
+
+###
+#   Statement templates
+#   Each builder is keyed by the shape of the statement (table, columns, where columns, connectors)
+#   and returns SQL with %s placeholders, so the values are always sent separately as parameters
+#   and the same shape always maps to the exact same SQL string.
+###
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _where_template(where_columns, where_connectors):
+    if not where_columns:
+        return ""
+
+    assert (len(where_columns) - 1) == len(where_connectors), "Error: There must be 1 less connector between where options"
+    sql = " WHERE "
+    for count, column_name in enumerate(where_columns):
+        if (count != 0):
+            connector = where_connectors[count - 1].upper()
+            assert connector in ("AND", "OR"), "Error: Where connectors must be AND or OR"
+            sql += f" {connector} "
+        sql += f"`{column_name}` = %s"
+    return sql
+
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _select_template(table_name, columns, where_columns, where_connectors):
+    sql = "SELECT "
+    sql += ", ".join(columns) if type(columns) is tuple else columns
+    sql += " FROM " + table_name
+    return sql + _where_template(where_columns, where_connectors) + ";"
+
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _page_template(table_name, columns, where_columns, where_connectors, key, has_after, has_limit):
+    sql = _select_template(table_name, columns, where_columns, where_connectors)[:-1]
+
+    # Keyset pagination: only rows past the last key the client saw, in key order
+    if has_after:
+        if where_columns:
+            where = _where_template(where_columns, where_connectors)
+            sql = sql[:-len(where)] + " WHERE (" + where[len(" WHERE "):] + f") AND `{key}` > %s"
+        else:
+            sql += f" WHERE `{key}` > %s"
+    if key is not None:
+        sql += f" ORDER BY `{key}`"
+    if has_limit:
+        sql += " LIMIT %s"
+    return sql + ";"
+
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _insert_template(table_name, columns):
+    query_cols = ",".join(["`" + col + "`" for col in columns])
+    placeholders = ",".join(["%s" for _ in columns])
+    return f"INSERT INTO {table_name} ({query_cols}) VALUES ({placeholders});"
+
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _update_template(table_name, columns, where_columns, where_connectors):
+    assignments = ",".join([f" `{col}` = %s" for col in columns])
+    return f"UPDATE {table_name} SET{assignments}" + _where_template(where_columns, where_connectors) + ";"
+
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _delete_template(table_name, where_columns, where_connectors):
+    return f"DELETE FROM {table_name}" + _where_template(where_columns, where_connectors) + ";"
+
 """
 DB_Manager:
-Class to directly talk and interact with the MySQL server.
+Class to directly talk and interact with the database server.
 Handles operations such as creating/using databases, table creations/insertions, etc.
+The engine specific parts are handled by a backend (see db_backends.py), MySQL by default.
 """
 class DB_Manager:
     """
-    Initialization function. Connects to the MySQL server and uses the provided database
+    Initialization function. Makes sure the provided database exists and opens a pool of
+    connections to it. Connections are opened lazily as requests need them.
 
     @params: database_name (str) - The name of the database you want to use. If it does not exist, then one will be created with that name
+             pool_size (int, optional) - The maximum number of open connections (defaults to DB_POOL_SIZE)
+             pool_timeout (float, optional) - Seconds to wait for a free connection (defaults to DB_POOL_TIMEOUT)
+             backend (optional) - The storage backend to use (defaults to the DB_BACKEND engine)
     """
-    def __init__(self, database_name):
-        self.cnx = mysql.connector.connect(
-            host=getenv("DB_HOST"),
-            user=getenv("DB_USER"),
-            password=getenv("DB_PSWD")
-        )
+    def __init__(self, database_name, pool_size=DB_POOL_SIZE, pool_timeout=DB_POOL_TIMEOUT, backend=None):
+        self.backend = backend if backend is not None else get_backend(DB_BACKEND)
+        # Errors the methods catch (and report as a False result). A checkout that timed out
+        #   is reported the same way as a failed query.
+        self.Error = (self.backend.Error, PoolTimeoutError)
+
+        self.pool_size = pool_size
+        self.pool_timeout = pool_timeout
+        self.pool = None
+
+        # Per-thread state (the id of the last row the thread inserted)
+        self._local = threading.local()
+
+        # Prepared statements that are open on each pooled connection (connection -> {sql: cursor})
+        self._statements = weakref.WeakKeyDictionary()
+        self._statements_lock = threading.Lock()
+
+        # Timing statistics for every statement that is run
+        self.metrics = QueryMetrics(slow_threshold_ms=DB_SLOW_QUERY_MS)
 
-        self.cursor = self.cnx.cursor()
+        # Schema catalog (table name -> columns, column types and primary key), loaded on first use
+        #   and again once it is DB_SCHEMA_TTL seconds old
+        self._schema = None
+        self._schema_expires = 0
+        self._schema_lock = threading.Lock()
 
         self.db = database_name
         self.use_database(self.db)
 
     """
     Function to use a given database
-    Tries to use the database, if the database does not exist, we try to create it
+    Tries to use the database, if the database does not exist, we try to create it.
+    Any connections to the previously used database are closed.
 
     @params: database_name (str) - Name of the database to use 
     @returns None
     """
     def use_database(self, database_name):
-        try:
-            self.cursor.execute(f"USE {database_name}")
-        except mysql.connector.Error as err:
-            print(f"Database {database_name} does not exist.")
-            self.create_database(database_name)
+        self.backend.ensure_database(database_name)
+
+        if self.pool is not None:
+            self.pool.close()
+
+        self.db = database_name
+        self.pool = ConnectionPool(lambda: self.backend.connect(self.db),
+                                   size=self.pool_size,
+                                   timeout=self.pool_timeout,
+                                   ping=self.backend.ping)
+        self.invalidate_schema()
 
     """
     Function to create a given database
@@ -61,11 +183,166 @@ class DB_Manager:
     @returns: None
     """
     def create_database(self, database_name):
+        self.backend.create_database(database_name)
+
+    """
+    Context manager to hold one pooled connection for several DB_Manager calls
+    (eg. for the length of a request). Calls made inside the block reuse the connection.
+
+    @params: None
+    @returns: The checked out connection
+    """
+    def connection(self):
+        return self.pool.connection()
+
+    """
+    Context manager to run several DB_Manager calls as one transaction on one pooled connection.
+    Commits when the block finishes and rolls back if it raises. Nested blocks join the outer transaction.
+
+    @params: None
+    @returns: The connection the transaction is running on
+    """
+    @contextmanager
+    def transaction(self):
+        with self.pool.connection() as cnx:
+            if getattr(self._local, "in_transaction", False):
+                yield cnx
+                return
+
+            self.backend.begin(cnx)
+            self._local.in_transaction = True
+            try:
+                yield cnx
+            except Exception:
+                cnx.rollback()
+                raise
+            else:
+                cnx.commit()
+            finally:
+                self._local.in_transaction = False
+
+    """
+    Function to get the connection pool's checkout metrics
+
+    @params: None
+    @returns: A dictionary containing the pool's size, usage and checkout wait times
+    """
+    def pool_stats(self):
+        return self.pool.stats()
+
+    """
+    Function to get the query metrics: per statement shape counts, rows and latency percentiles
+    (p50/p95/p99), plus the slow-query log
+
+    @params: None
+    @returns: A dictionary of the query statistics
+    """
+    def query_stats(self):
+        return self.metrics.stats()
+
+    """
+    Private function to run a statement on a cursor, timing it for the query metrics
+
+    @params: cursor - The cursor to run the statement on
+             sql (str) - The statement
+             params (tuple, optional) - The values for the statement's placeholders
+             fetch (bool, optional) - If True, the rows are read and returned
+    @returns: A list of the resulting rows if fetch is True, None otherwise
+    """
+    def _execute(self, cursor, sql, params=None, fetch=True):
+        start = time.perf_counter()
         try:
-            self.cursor.execute(f"CREATE DATABASE {database_name} DEFAULT CHARACTER SET 'utf8'")
-        except mysql.connector.Error as err:
-            print(f"Failed creating database: {err}")
-            exit(1)
+            if params is None:
+                cursor.execute(sql)
+            else:
+                cursor.execute(sql, params)
+            rows = cursor.fetchall() if fetch else None
+        except self.Error as err:
+            self.metrics.record(sql, time.perf_counter() - start, error=True)
+            self._check_schema_error(err)
+            raise
+
+        self.metrics.record(sql, time.perf_counter() - start, len(rows) if fetch else cursor.rowcount)
+        return rows
+
+    """
+    Private function to get a function that runs queries on a cursor through _execute, so queries
+    built elsewhere (the backends' catalog reads) are timed for the query metrics too
+
+    @params: cursor - The cursor to run the queries on
+    @returns: A function taking (sql, params=None) and returning the resulting rows
+    """
+    def _executor(self, cursor):
+        return lambda sql, params=None: self._execute(cursor, sql, params)
+
+    """
+    Private function to run a statement once for each set of values, timing it for the query metrics
+
+    @params: cursor - The cursor to run the statement on
+             sql (str) - The statement
+             seq_of_params (list of tuple) - The values for each run of the statement
+    @returns: None
+    """
+    def _execute_many(self, cursor, sql, seq_of_params):
+        start = time.perf_counter()
+        try:
+            cursor.executemany(sql, seq_of_params)
+        except self.Error as err:
+            self.metrics.record(sql, time.perf_counter() - start, error=True)
+            self._check_schema_error(err)
+            raise
+
+        self.metrics.record(sql, time.perf_counter() - start, len(seq_of_params))
+
+    """
+    Private context manager that checks a connection out of the pool and yields a cursor on it
+
+    @params: None
+    @returns: A buffered cursor, closed (and its connection returned) when the block exits
+    """
+    @contextmanager
+    def _cursor(self):
+        with self.pool.connection() as cnx:
+            cursor = self.backend.cursor(cnx)
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+
+    """
+    Private context manager that yields a prepared cursor for the given SQL on a pooled connection.
+    Each connection keeps its most recently used statements prepared on the server, so a statement
+    is only parsed once per connection no matter how many requests run it.
+
+    @params: sql (str) - A statement template using %s placeholders
+    @returns: A prepared cursor for the statement
+    """
+    @contextmanager
+    def _statement(self, sql):
+        with self.pool.connection() as cnx:
+            with self._statements_lock:
+                statements = self._statements.get(cnx)
+                if statements is None:
+                    statements = self._statements[cnx] = OrderedDict()
+
+            # Only the thread holding the connection touches its statements
+            cursor = statements.get(sql)
+            if cursor is None:
+                cursor = self.backend.prepared_cursor(cnx)
+                statements[sql] = cursor
+                if len(statements) > PREPARED_PER_CONNECTION:
+                    _, oldest = statements.popitem(last=False)
+                    oldest.close()
+            else:
+                statements.move_to_end(sql)
+
+            try:
+                yield cursor
+            except Exception:
+                # Don't keep a statement around that may be in a bad state
+                statements.pop(sql, None)
+                cursor.close()
+                raise
 
     """
     Function to get all tables for the current database
@@ -75,26 +352,117 @@ class DB_Manager:
     """
     def get_tables(self):
         try:
-            self.cursor.execute("SHOW TABLES")
-            return [table[0] for table in self.cursor.fetchall()]
-        except mysql.connector.Error as err:
+            with self._cursor() as cursor:
+                return [table[0] for table in self._execute(cursor, self.backend.tables_query)]
+        except self.Error as err:
             print(f"Something went wrong! {err}")
             return False
 
     """
-    Function to get all of the column names for a given table
+    Function to load the schema catalog for the current database.
+    Reads every table's columns, column types and primary key in a single query, so the
+    rest of the app can look them up without any metadata round trips.
 
-    @params: table_name (str) - The name of the desired table
-    @returns: A list of strings containing the names of the columns for the table
+    @params: None
+    @returns: A dictionary of table name -> {"columns": [str], "types": {column: type}, "primary_key": str}
+              if succeeds, false otherwise
     """
-    def get_table_columns(self, table_name):
+    def load_schema(self):
+        tables = self.get_tables()
+        if tables is False:
+            return False
+
+        catalog = {table: {"columns": [], "types": {}, "primary_key": None} for table in tables}
+
         try:
-            self.cursor.execute(f"SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_NAME='{table_name}'")
-            return self.cursor.fetchall()
-        except mysql.connector.Error as err:
-            print(f"Something went wrong! {err}")
+            with self._cursor() as cursor:
+                columns = self.backend.load_columns(self._executor(cursor), self.db)
+        except self.Error as err:
+            print(f"Schema could not be loaded: {err}")
             return False
 
+        for table_name, column_name, data_type, is_primary_key in columns:
+            if table_name not in catalog:
+                continue
+            table = catalog[table_name]
+            table["columns"].append(column_name)
+            table["types"][column_name] = data_type
+            if is_primary_key and table["primary_key"] is None:
+                table["primary_key"] = column_name
+
+        with self._schema_lock:
+            self._schema = catalog
+            self._schema_expires = time.monotonic() + DB_SCHEMA_TTL
+        return catalog
+
+    """
+    Function to throw away the schema catalog so it is reloaded on next use.
+    Called whenever tables are created, dropped or altered, and when a statement names a
+    column or table the database doesn't have (the catalog is out of date).
+
+    @params: None
+    @returns: None
+    """
+    def invalidate_schema(self):
+        with self._schema_lock:
+            self._schema = None
+
+    """
+    Function to check if a table exists in the schema catalog
+
+    @params: table_name (str) - The name of the table
+    @returns: True if the table exists, False otherwise
+    """
+    def has_table(self, table_name):
+        return self._table_schema(table_name) is not None
+
+    """
+    Function to get all of the column names for a given table (from the schema catalog)
+
+    @params: table_name (str) - The name of the desired table
+    @returns: A list of tuples, each containing the name of one of the table's columns
+    """
+    def get_table_columns(self, table_name):
+        table = self._table_schema(table_name)
+        if table is None:
+            return []
+        return [(column,) for column in table["columns"]]
+
+    """
+    Function to get the data types of a table's columns (from the schema catalog)
+
+    @params: table_name (str) - The name of the desired table
+    @returns: A dictionary of column name -> lowercase data type (eg. 'int', 'timestamp')
+    """
+    def get_table_column_types(self, table_name):
+        table = self._table_schema(table_name)
+        if table is None:
+            return {}
+        return table["types"]
+
+    """
+    Private function to get a table's entry in the schema catalog, loading the catalog if needed
+
+    @params: table_name (str) - The name of the desired table
+    @returns: The table's catalog entry, or None if the table does not exist
+    """
+    def _table_schema(self, table_name):
+        schema = self._schema
+        if schema is None or time.monotonic() >= self._schema_expires:
+            # Keep using the old catalog if it can't be read again
+            schema = self.load_schema() or schema or {}
+        return schema.get(table_name)
+
+    """
+    Private function to throw away the schema catalog if a statement failed because of it
+
+    @params: err - The error the statement raised
+    @returns: None
+    """
+    def _check_schema_error(self, err):
+        if self.backend.is_schema_error(err):
+            self.invalidate_schema()
+
     """
     Function to get the description for a given table
 
@@ -103,25 +471,23 @@ class DB_Manager:
     """
     def get_table_desciption(self, table_name):
         try:
-            self.cursor.execute(f"DESC {table_name}")
-            return self.cursor.fetchall()
-        except mysql.connector.Error as err:
+            with self._cursor() as cursor:
+                return self._execute(cursor, self.backend.describe_query(table_name))
+        except self.Error as err:
             print(f"Something went wrong! {err}")
             return False
 
     """
-    Function to get a table's primary column's name
+    Function to get a table's primary column's name (from the schema catalog)
 
     @params: table_name (str) - The name of the desired table
-    @returns: A string containing the name of the primary column of the table
+    @returns: A string containing the name of the primary column of the table, false if it has none
     """
     def get_table_primary_key(self, table_name):
-        try:
-            self.cursor.execute(f"SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_NAME='{table_name}' AND COLUMN_KEY='PRI';")
-            return self.cursor.fetchone()[0]
-        except mysql.connector.Error as err:
-            print(f"Something went wrong! {err}")
+        table = self._table_schema(table_name)
+        if table is None or table["primary_key"] is None:
             return False
+        return table["primary_key"]
 
     """
     Given a list of table names (str), will try to drop each table in the list. 
@@ -132,18 +498,29 @@ class DB_Manager:
     def drop_tables(self, tables):
         for table in tables:
             try:
-                self.cursor.execute(f"DROP TABLE {table}")
+                with self._cursor() as cursor:
+                    self._execute(cursor, f"DROP TABLE {table}", fetch=False)
                 print(f"Table '{table}' has been dropped")
-            except mysql.connector.Error as err:
+            except self.Error as err:
                 print(f"Table {table} could not be dropped: {err}")
 
+        self.invalidate_schema()
+
     """
     Function to create a table
     Takes a table name as a string and a description of the new table's columns as a dictionary
         -> table_description = {
-            col_1: column information [varchar(11) etc]
+            col_1: column information [varchar(11) etc],
+            'constraints': {
+                'PRIMARY KEY': col_1,
+                'FOREIGN KEY': [col_2, 'other_table(other_col)']     (or a list of these pairs),
+                'UNIQUE': col_3                                       (or a list of columns for one composite key),
+                'UNIQUE KEY': {'key_name': [col_3, col_4]},           (named, possibly composite, unique keys)
+                'INDEX': {'index_name': [col_2, 'col_5 DESC']}        (named secondary indexes)
+            }
         }
     NOTE: table_description's last entry must be the table's constraints
+          Index names should be unique across the whole database (SQLite requires it)
 
     @params: table_name (str) - Name of the table to be created
              table_description (dict str) - A dictionary containing the column names as the keys
@@ -151,32 +528,59 @@ class DB_Manager:
     @returns: None
     """
     def create_table(self, table_name, table_description):
-        # Create the SQL query to create the given table
-        sql = f"CREATE TABLE `{table_name}` ("
-        for table_key, desc in table_description.items():
-            if table_key != 'constraints':
-                sql += f"`{table_key}` {desc},"
-            else:
-                for constraint, column in desc.items():
-                    if (constraint == 'FOREIGN KEY'):
-                        sql += f"{constraint} (`{column[0]}`) REFERENCES {column[1]},"
-                    else:
-                        sql += f"{constraint} (`{column}`),"
-
-        sql = sql[:-1]  # Chop off the last comma to avoid MySQL errors
-        sql += ") ENGINE=InnoDB"
+        # Create the SQL statements to create the given table (the backend handles engine differences)
+        statements = self.backend.create_table_statements(table_name, table_description)
 
         # Try to create the table (unless it already exists or for some other error)
         try:
             print(f"Creating table '{table_name}': ", end="")
-            self.cursor.execute(sql)
-        except mysql.connector.Error as err:
-            if err.errno == errorcode.ER_TABLE_EXISTS_ERROR:
+            with self.transaction():
+                with self._cursor() as cursor:
+                    for sql in statements:
+                        self._execute(cursor, sql, fetch=False)
+        except self.Error as err:
+            if self.backend.is_table_exists_error(err):
                 print("already exists.")
             else:
-                print(err.msg)
+                print(err)
         else:
             print("OK")
+            self.invalidate_schema()
+
+    """
+    Function to make sure a table has a unique key on the given columns, adding it if it doesn't
+    (for databases created before the key was part of the table's description)
+    The key is only added if the existing rows don't already break it.
+
+    @params: table_name (str) - The table that needs the key
+             key_name (str) - What to name the key if it has to be added
+             columns (str list) - The key's columns
+    @returns: True if the table has the key, false if it couldn't be added
+    """
+    def ensure_unique_key(self, table_name, key_name, columns):
+        columns = tuple(columns)
+        quoted = ", ".join(f"`{column}`" for column in columns)
+
+        try:
+            with self._cursor() as cursor:
+                if columns in self.backend.load_unique_keys(self._executor(cursor), self.db, table_name):
+                    return True
+
+                # Rows that already share a value would make adding the key fail
+                duplicates = self._execute(cursor, f"SELECT {quoted}, COUNT(*) FROM `{table_name}` GROUP BY {quoted} "
+                                                   f"HAVING COUNT(*) > 1 LIMIT 10")
+                if duplicates:
+                    print(f"Unique key '{key_name}' could not be added, {table_name} has duplicate "
+                          f"values for {', '.join(columns)}: {[row[:-1] for row in duplicates]}")
+                    return False
+
+                self._execute(cursor, self.backend.add_unique_key_statement(table_name, key_name, columns), fetch=False)
+        except self.Error as err:
+            print(f"Unique key '{key_name}' could not be added: {err}")
+            return False
+
+        print(f"Added unique key '{key_name}' to {table_name}")
+        return True
 
 
     """
@@ -189,45 +593,139 @@ class DB_Manager:
     @returns: True or False depending on the success of the insertion
     """
     def add_one_row(self, table_name, row_data):
-        # Get a comma separated list of the row names
-        # then, reformat so each char is surrounded by ` (ex. name => `name`)
-        # and turn that reformatted list into a comma separated string 
-        list_of_cols = list(row_data.keys())
-        formatted_cols = ["`" + col + "`" for col in list_of_cols]
-        query_cols = ",".join(formatted_cols)
-
-        sql = f"INSERT INTO {table_name} (" + query_cols + ") VALUES ("
-        for val in list(row_data.values()):
-            if type(val) is str:
-                sql += f"'{val}',"
-            else:
-                sql += f"{val},"
-
-        sql = sql[:-1] + ");"
+        sql = _insert_template(table_name, tuple(row_data.keys()))
 
         # Try to run the query
         try:
-            self.cursor.execute(sql)
-            self.cnx.commit() 
+            with self._statement(sql) as cursor:
+                self._execute(cursor, sql, tuple(row_data.values()), fetch=False)
+                self._local.last_insert_id = cursor.lastrowid
             return True
-        except mysql.connector.Error as err:
+        except self.Error as err:
             print(f"Row could not be inserted: {err}")
             return False
 
     """
-    Function to add a single row to a table
+    Function to add a single row and get its generated id back from the same statement
+    A unique key violation isn't an error here, it means the row already exists, so callers
+    can rely on the table's unique keys instead of checking for the row first.
+
+    @params: table_name (str) - The name of the table you want to add the data into
+             row_data (dict) - The data to be inserted into the table
+    @returns: The new row's id, None if the row would duplicate a unique key, or False if the insertion failed
+    """
+    def add_unique_row(self, table_name, row_data):
+        sql = _insert_template(table_name, tuple(row_data.keys()))
+
+        try:
+            with self._statement(sql) as cursor:
+                self._execute(cursor, sql, tuple(row_data.values()), fetch=False)
+                self._local.last_insert_id = cursor.lastrowid
+                return cursor.lastrowid
+        except self.Error as err:
+            if self.backend.is_duplicate_key_error(err):
+                return None
+            print(f"Row could not be inserted: {err}")
+            return False
+
+    """
+    Function to add many rows to a table
     The provided data is assumed to be JSON formatted (python dictionary)
 
     @params: table_name (str) - The name of the table you want to add the data into
              row_data (list of dict) - The data to be inserted into the table
+             chunk_size (int, optional) - How many rows are inserted per statement
     @returns: True or false depending on the success of the insertions
     """
-    def add_many_rows(self, table_name, row_data):
+    def add_many_rows(self, table_name, row_data, chunk_size=DB_BULK_CHUNK_SIZE):
+        return self.bulk_insert(table_name, row_data, chunk_size) is not False
+
+    """
+    Function to insert many rows with as few statements as possible
+    Rows are sent in chunks of multi-row INSERTs, with one transaction (and one commit) per chunk.
+    Consecutive rows with the same columns share a statement, so rows may have different columns.
+
+    @params: table_name (str) - The name of the table you want to add the data into
+             row_data (list of dict) - The data to be inserted into the table
+             chunk_size (int, optional) - How many rows are inserted per statement
+    @returns: A dictionary with the number of rows inserted, chunks committed, seconds taken and
+              rows per second if succeeds, false otherwise (chunks before the failure stay committed)
+    """
+    def bulk_insert(self, table_name, row_data, chunk_size=DB_BULK_CHUNK_SIZE):
+        assert chunk_size > 0, "Error: Chunk size must be at least 1"
+
+        start = time.perf_counter()
+        inserted = 0
+        chunks = 0
+
+        try:
+            for columns, rows in self._chunk_rows(row_data, chunk_size):
+                sql = _insert_template(table_name, columns)
+                with self.transaction():
+                    with self._cursor() as cursor:
+                        # The connector turns this into a single multi-row INSERT
+                        self._execute_many(cursor, sql, [tuple(row[col] for col in columns) for row in rows])
+                inserted += len(rows)
+                chunks += 1
+        except self.Error as err:
+            print(f"Rows could not be inserted ({inserted} rows were inserted before the failure): {err}")
+            return False
+
+        seconds = time.perf_counter() - start
+        rows_per_second = inserted / seconds if seconds > 0 else float(inserted)
+
+        return {
+            "rows": inserted,
+            "chunks": chunks,
+            "seconds": seconds,
+            "rows_per_second": rows_per_second
+        }
+
+    """
+    Function to insert rows, or update them where a row with the same key already exists
+    (all rows need the same columns, and the key columns need a unique key)
+
+    @params: table_name (str) - The name of the table you want to add the data into
+             row_data (list of dict) - The data to be inserted into the table
+             key_columns (str list) - The columns of the unique key that decides if a row already exists
+    @returns: True or False depending on the success of the insertions
+    """
+    def upsert_rows(self, table_name, row_data, key_columns):
+        if not row_data:
+            return True
+        columns = tuple(row_data[0].keys())
+        sql = sys.intern(self.backend.upsert_statement(table_name, columns, tuple(key_columns)))
+
+        try:
+            with self.transaction():
+                with self._cursor() as cursor:
+                    self._execute_many(cursor, sql, [tuple(row[col] for col in columns) for row in row_data])
+            return True
+        except self.Error as err:
+            print(f"Rows could not be inserted: {err}")
+            return False
+
+    """
+    Private function to split rows into chunks that can each be sent as one INSERT.
+    A chunk ends when it is full or when the next row has different columns.
+
+    @params: row_data (list of dict) - The rows to split up
+             chunk_size (int) - The most rows allowed in one chunk
+    @returns: A generator of (column name tuple, list of rows) pairs
+    """
+    def _chunk_rows(self, row_data, chunk_size):
+        columns = None
+        chunk = []
         for row in row_data:
-            result = self.add_one_row(table_name, row)
-            if not result:
-                return False
-        return True
+            row_columns = tuple(row.keys())
+            if chunk and (row_columns != columns or len(chunk) >= chunk_size):
+                yield columns, chunk
+                chunk = []
+            columns = row_columns
+            chunk.append(row)
+
+        if chunk:
+            yield columns, chunk
 
     """
     Function to update rows in a table
@@ -241,41 +739,45 @@ class DB_Manager:
     @returns: True or false depending on the success of the update.
     """
     def update_rows(self, table_name, new_data, where_options={}, where_connectors=[]):
-        sql = f"UPDATE {table_name} SET"
-
-        for column_name, column_value in new_data.items():
-            sql += f" `{column_name}` = "
-            if (type(column_value) is str):
-                sql += f"'{column_value}',"
-            else:
-                sql += f"{column_value},"
-
-        sql = sql[:-1] + " "
-
-        if (where_options != {}):
-            assert (len(where_options) - 1) == len(where_connectors), "Error: There must be 1 less connector between where options"
-            sql += " WHERE "
-            for count, column_name in enumerate(where_options):
-                if (count != 0):
-                    sql += f" {where_connectors[count - 1].upper()} "
-                sql += f"`{column_name}` = "
-                curr_option = where_options[column_name]
-                if (type(curr_option) is str):
-                    sql += f"'{curr_option}'"
-                else:
-                    sql += f"{curr_option}"
-        
-        sql += ";"
+        sql = _update_template(table_name, tuple(new_data.keys()),
+                               tuple(where_options.keys()), tuple(where_connectors))
+        params = tuple(new_data.values()) + tuple(where_options.values())
 
         try:
-            self.cursor.execute(sql)
-            self.cnx.commit()
+            with self._statement(sql) as cursor:
+                self._execute(cursor, sql, params, fetch=False)
             return True
-        except mysql.connector.Error as err:
+        except self.Error as err:
             print(f"Something went wrong: {err}")
             return False
             
 
+    """
+    Function to update a single row and get its key back in the same round trip
+    (used where a read-modify-write would otherwise need a SELECT before the UPDATE)
+    IMPORTANT! The assignments are raw SQL, only their %s placeholders are parameterized.
+
+    @params: table_name (str) - The name of the table to update the data in
+             assignments (str) - The SET clause, ie "`streak` = `streak` + 1, `seen` = CURRENT_TIMESTAMP"
+             params (tuple) - The values for the assignments' %s placeholders
+             where_options (dict) - The options to specify which row is updated
+             where_connectors (list, optional) - A list of 'AND' and 'OR' to connect the where options
+             key (str, optional) - The column to hand back (normally the primary key)
+    @returns: The key of the updated row, None if no row matched, or false if the update failed
+    """
+    def update_returning_key(self, table_name, assignments, params, where_options, where_connectors=[], key="id"):
+        where = _where_template(tuple(where_options.keys()), tuple(where_connectors))
+        sql = sys.intern(self.backend.update_returning_statement(table_name, assignments, where, key))
+        params = tuple(params) + tuple(where_options.values())
+
+        try:
+            with self._statement(sql) as cursor:
+                self._execute(cursor, sql, params, fetch=False)
+                return self.backend.returned_key(cursor)
+        except self.Error as err:
+            print(f"Something went wrong: {err}")
+            return False
+
     """
     Function to delete data from a table
 
@@ -286,35 +788,60 @@ class DB_Manager:
     @returns: True or False depending on the success of the deletion
     """
     def delete_rows(self, table_name, where_options={}, where_connectors=[]):
-        sql = f"DELETE FROM {table_name}"
-
-        if (where_options != {}):
-            assert (len(where_options) - 1) == len(where_connectors), "Error: There must be 1 less connector between where options"
-            sql += " WHERE "
-            # Add in the where clauses
-            for count, column_name in enumerate(where_options):
-                if (count != 0):
-                    query += f" {where_connectors[count - 1].upper()} "
-                query += f"`{column_name}` = '{where_options[column_name]}'"
+        sql = _delete_template(table_name, tuple(where_options.keys()), tuple(where_connectors))
 
         try:
-            self.cursor.execute(sql)
+            with self._statement(sql) as cursor:
+                self._execute(cursor, sql, tuple(where_options.values()), fetch=False)
             return True
-        except mysql.connector.Error as err:
+        except self.Error as err:
             print(f"Rows could not be deleted: {err}")
             return False
 
     """
     Function to take a query and submit it directly to the database
+    If params are given, the query is run as a prepared statement with the params
+    filling in its %s placeholders
 
     @params: query (str) - An SQL query
+             params (tuple, optional) - The values for the query's placeholders
     @returns: The result of the query if succeeds, false otherwise
     """ 
-    def submit_query(self, query):
+    def submit_query(self, query, params=None):
         try:
-            self.cursor.execute(query)
-            return self.cursor.fetchall()
-        except mysql.connector.Error as err:
+            if params is None:
+                with self._cursor() as cursor:
+                    return self._execute(cursor, query)
+
+            # Equal queries share one string object, so the connection's prepared statement is reused
+            query = sys.intern(query)
+            with self._statement(query) as cursor:
+                return self._execute(cursor, query, tuple(params))
+        except self.Error as err:
+            print(f"Something went wrong: {err}")
+            return False
+
+    """
+    Function to run a statement that does not return rows (UPDATE, DELETE, ...) directly on the database
+    If params are given, the statement is run as a prepared statement with the params
+    filling in its %s placeholders
+
+    @params: statement (str) - An SQL statement
+             params (tuple, optional) - The values for the statement's placeholders
+    @returns: The number of rows the statement changed if succeeds, false otherwise
+    """
+    def submit_statement(self, statement, params=None):
+        try:
+            if params is None:
+                with self._cursor() as cursor:
+                    self._execute(cursor, statement, fetch=False)
+                    return cursor.rowcount
+
+            statement = sys.intern(statement)
+            with self._statement(statement) as cursor:
+                self._execute(cursor, statement, tuple(params), fetch=False)
+                return cursor.rowcount
+        except self.Error as err:
             print(f"Something went wrong: {err}")
             return False
 
@@ -330,28 +857,29 @@ class DB_Manager:
                                               specified value.
              where_connectors (str list, optional) - A list of strings (specifically AND and OR)
                                                      that connect the `where_options` options
-    @return: An SQL query in a string
+             key (str, optional) - A column to order the rows by (used for keyset pagination)
+             after (optional) - Only rows where `key` is greater than this value are returned
+             limit (int, optional) - The most rows to return
+    @return: A tuple of the SQL query template (str) and the values for its placeholders (tuple)
     """
-    def _generate_query(self, table_name, columns, where_options={}, where_connectors=[]):
-        query = "SELECT "
-        query += ", ".join(columns) if type(columns) is list else columns
-        query += " FROM " + table_name
+    def _generate_query(self, table_name, columns, where_options={}, where_connectors=[], key=None, after=None, limit=None):
+        columns = tuple(columns) if type(columns) is list else columns
+        where_columns = tuple(where_options.keys())
+        params = tuple(where_options.values())
 
-        if (where_options != {}):
-            assert (len(where_options) - 1) == len(where_connectors), "Error: There must be 1 less connector between where options"
-            query += " WHERE "
-            # Add in the where clauses
-            for count, column_name in enumerate(where_options):
-                if (count != 0):
-                    query += f" {where_connectors[count - 1].upper()} "
-                query += f"`{column_name}` = "
-                curr_option = where_options[column_name]
-                if (type(curr_option) is str):
-                    query += f"'{curr_option}'"
-                else:
-                    query += f"{curr_option}"
+        if key is None and after is None and limit is None:
+            query = _select_template(table_name, columns, where_columns, tuple(where_connectors))
+            return query, params
 
-        return query + ";"
+        assert after is None or key is not None, "Error: A key column is needed to get rows after a value"
+        query = _page_template(table_name, columns, where_columns, tuple(where_connectors),
+                               key, after is not None, limit is not None)
+
+        if after is not None:
+            params += (after,)
+        if limit is not None:
+            params += (int(limit),)
+        return query, params
 
 
     """
@@ -365,18 +893,58 @@ class DB_Manager:
                                               specified value.
              where_connectors (str list, optional) - A list of strings (specifically AND and OR)
                                                      that connect the `where_options` options
+             key (str, optional) - A column to order the rows by (usually the primary key)
+             after (optional) - Only get rows where `key` is greater than this value (needs `key`)
+             limit (int, optional) - The most rows to get
     @returns: A list of tuples, where each tuple is a row in the table if succeeds, false otherwise
     """
-    def get_all_rows(self, table_name, columns, where_options={}, where_connectors=[]):
-        query = self._generate_query(table_name, columns, where_options, where_connectors)    
+    def get_all_rows(self, table_name, columns, where_options={}, where_connectors=[], key=None, after=None, limit=None):
+        query, params = self._generate_query(table_name, columns, where_options, where_connectors, key, after, limit)
 
         try:
-            self.cursor.execute(query)
-            return self.cursor.fetchall()
-        except mysql.connector.Error as err:
+            with self._statement(query) as cursor:
+                return self._execute(cursor, query, params)
+        except self.Error as err:
             print(f"Rows could not be retrieved: {err}")
             return False
 
+    """
+    Function to stream the rows from given parameters without holding the whole result in memory
+    Rows are read from the server a batch at a time through an unbuffered cursor. The pooled
+    connection stays checked out until the generator is finished or closed.
+
+    @params: Same as get_all_rows, plus
+             batch_size (int, optional) - How many rows are read from the server at a time
+    @returns: A generator of tuples, where each tuple is a row in the table. If reading fails part way, the
+              generator raises the error (after the rows read so far) rather than just stopping early
+    """
+    def iter_rows(self, table_name, columns, where_options={}, where_connectors=[], key=None, after=None, limit=None,
+                  batch_size=DB_STREAM_BATCH_SIZE):
+        query, params = self._generate_query(table_name, columns, where_options, where_connectors, key, after, limit)
+
+        start = time.perf_counter()
+        row_count = 0
+        try:
+            with self._statement(query) as cursor:
+                cursor.execute(query, params)
+                try:
+                    rows = cursor.fetchmany(batch_size)
+                    while rows:
+                        row_count += len(rows)
+                        yield from rows
+                        rows = cursor.fetchmany(batch_size)
+                finally:
+                    # If the reader stopped early, read out the rest so the connection can be reused
+                    while cursor.fetchmany(batch_size):
+                        pass
+        except self.Error as err:
+            self.metrics.record(query, time.perf_counter() - start, row_count, error=True)
+            print(f"Rows could not be streamed: {err}")
+            raise
+
+        # The time includes however long the reader took between batches
+        self.metrics.record(query, time.perf_counter() - start, row_count)
+
     """
     Function to get the first row from given parameters
     
@@ -391,29 +959,29 @@ class DB_Manager:
     @returns: A tuple containing the resulting row data if succeeds, false otherwise
     """
     def get_one_row(self, table_name, columns, where_options={}, where_connectors=[]):
-        query = self._generate_query(table_name, columns, where_options, where_connectors)        
+        query, params = self._generate_query(table_name, columns, where_options, where_connectors)
 
         try:
-            self.cursor.execute(query)
-            return list(self.cursor.fetchone())
-        except mysql.connector.Error as err:
+            with self._statement(query) as cursor:
+                # Read the whole result so the prepared statement can be run again
+                rows = self._execute(cursor, query, params)
+                return list(rows[0]) if rows else False
+        except self.Error as err:
             print(f"Row could not be retrieved: {err}")
             return False
 
     """
     Function to get the ID of the last inserted value
+    The id is tracked per thread, since each insert may run on a different pooled connection
 
     @params: None
-    @returns: Int of the id of the last inserted row
+    @returns: Int of the id of the last row inserted by the calling thread
     """
     def get_last_inserted_id(self):
-        self.cursor.execute("SELECT LAST_INSERT_ID();")
-
-        # We just want to return the number from the result, don't care about list/tuple
-        return self.cursor.fetchone()[0]
+        return getattr(self._local, "last_insert_id", None)
                  
 
         
 # Initialize the db_mgr
 print(getenv("DB_NAME"))
-db_mgr = DB_Manager(getenv("DB_NAME"))
\ No newline at end of file
+db_mgr = DB_Manager(getenv("DB_NAME"), backend=get_backend(DB_BACKEND))
\ No newline at end of file
@@ -0,0 +1,174 @@
+"""
+Filename: db_metrics.py
+
+Purpose: Keeps timing statistics for every statement the DB_Manager runs. Statements are grouped
+         by shape (the SQL with its values taken out), each shape gets a latency histogram
+         (p50/p95/p99 over its most recent runs), and statements slower than a threshold are
+         kept in a slow-query log along with the code that ran them.
+
+Authors: Jordan Smith
+Group: Wholesome as Heck Programmers (WaHP)
+Last modified: 10/18/26
+"""
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from functools import lru_cache
+
+# Files whose frames are skipped when looking for the code that ran a query
+INTERNAL_FILES = ("db_manager.py", "db_metrics.py", "db_pool.py", "db_backends.py", "contextlib.py")
+
+# Literal values in raw SQL, replaced with ? so queries that only differ by value share a shape
+LITERALS = re.compile(r"'(?:[^'\\]|\\.)*'|\b\d+(?:\.\d+)?\b|%s")
+WHITESPACE = re.compile(r"\s+")
+
+# Runs of placeholders whose length depends on the data (IN (?, ?, ?), multi-row VALUES and
+#   CASE ... WHEN ? THEN ? ... lists), collapsed so each statement keeps one shape
+PLACEHOLDER_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+REPEATED_GROUP = re.compile(r"(\([^()]*\))(?:\s*,\s*\1)+")
+REPEATED_WHEN = re.compile(r"(WHEN \? THEN \?)(?:\s+\1)+")
+
+
+"""
+QueryMetrics:
+Thread-safe collection of per-shape query statistics and a bounded slow-query log
+"""
+class QueryMetrics:
+    """
+    Initialization function
+
+    @params: slow_threshold_ms (float) - Queries taking at least this long are logged as slow
+             samples_per_shape (int) - How many recent latencies are kept per shape for percentiles
+             slow_log_size (int) - How many slow queries are kept
+             max_shapes (int) - How many shapes are kept, the least recently run is dropped past it
+    """
+    def __init__(self, slow_threshold_ms=200, samples_per_shape=1024, slow_log_size=100, max_shapes=512):
+        self.slow_threshold_ms = slow_threshold_ms
+        self.samples_per_shape = samples_per_shape
+        self.max_shapes = max_shapes
+
+        self._lock = threading.Lock()
+        self._shapes = OrderedDict()
+        self._dropped_shapes = 0
+        self._slow = deque(maxlen=slow_log_size)
+
+    """
+    Function to record one run of a statement
+
+    @params: sql (str) - The statement that was run
+             seconds (float) - How long it took
+             rows (int) - How many rows it returned or changed
+             error (bool, optional) - True if the statement failed
+    @returns: None
+    """
+    def record(self, sql, seconds, rows=0, error=False):
+        shape = statement_shape(sql)
+        ms = seconds * 1000
+
+        with self._lock:
+            stats = self._shapes.get(shape)
+            if stats is None:
+                stats = self._shapes[shape] = {
+                    "count": 0,
+                    "errors": 0,
+                    "rows": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "samples": deque(maxlen=self.samples_per_shape)
+                }
+                if len(self._shapes) > self.max_shapes:
+                    self._shapes.popitem(last=False)
+                    self._dropped_shapes += 1
+            else:
+                self._shapes.move_to_end(shape)
+            stats["count"] += 1
+            stats["rows"] += rows if rows and rows > 0 else 0
+            stats["total_ms"] += ms
+            stats["max_ms"] = max(stats["max_ms"], ms)
+            stats["samples"].append(ms)
+            if error:
+                stats["errors"] += 1
+
+        if ms >= self.slow_threshold_ms:
+            caller = find_caller()
+            with self._lock:
+                self._slow.append({
+                    "time": time.time(),
+                    "ms": ms,
+                    "rows": rows,
+                    "sql": sql,
+                    "caller": caller
+                })
+            print(f"Slow query ({ms:.1f}ms, {rows} rows) from {caller}: {shape}")
+
+    """
+    Function to get the statistics in a json friendly format
+
+    @params: None
+    @returns: A dictionary with the per-shape statistics (slowest total time first) and the slow-query log
+    """
+    def stats(self):
+        with self._lock:
+            shapes = [(shape, dict(stats, samples=sorted(stats["samples"]))) for shape, stats in self._shapes.items()]
+            slow = list(self._slow)
+            dropped_shapes = self._dropped_shapes
+
+        queries = []
+        for shape, stats in shapes:
+            samples = stats.pop("samples")
+            stats["shape"] = shape
+            stats["avg_ms"] = stats["total_ms"] / stats["count"]
+            stats["p50_ms"] = percentile(samples, 50)
+            stats["p95_ms"] = percentile(samples, 95)
+            stats["p99_ms"] = percentile(samples, 99)
+            queries.append(stats)
+
+        queries.sort(key=lambda stats: stats["total_ms"], reverse=True)
+        return {
+            "slow_threshold_ms": self.slow_threshold_ms,
+            "dropped_shapes": dropped_shapes,
+            "queries": queries,
+            "slow_queries": slow
+        }
+
+    """
+    Function to clear all of the statistics
+
+    @params: None
+    @returns: None
+    """
+    def reset(self):
+        with self._lock:
+            self._shapes.clear()
+            self._slow.clear()
+            self._dropped_shapes = 0
+
+
+# Gets the value at the given percentile (0-100) of a sorted list
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+# Gets the shape of a statement: its SQL with literal values and placeholders replaced by ?, lists
+#   of them collapsed to "?, ..." and whitespace collapsed
+@lru_cache(maxsize=1024)
+def statement_shape(sql):
+    shape = WHITESPACE.sub(" ", LITERALS.sub("?", sql)).strip()
+    shape = PLACEHOLDER_LIST.sub("?, ...", shape)
+    shape = REPEATED_GROUP.sub(r"\1, ...", shape)
+    return REPEATED_WHEN.sub(r"\1 ...", shape)
+
+# Gets "file:line in function" for the first frame outside of the database code
+def find_caller():
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = os.path.basename(frame.f_code.co_filename)
+        if filename not in INTERNAL_FILES:
+            return f"{filename}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return "unknown"
@@ -0,0 +1,244 @@
+"""
+Filename: db_pool.py
+
+Purpose: A bounded, thread-safe pool of database connections. The DB_Manager checks a
+         connection out of the pool for each unit of work and returns it afterwards, so
+         concurrent requests no longer share (and fight over) a single cursor.
+
+Authors: Jordan Smith
+Group: Wholesome as Heck Programmers (WaHP)
+Last modified: 10/18/26
+"""
+import threading
+import time
+from contextlib import contextmanager
+from queue import LifoQueue, Empty
+
+# Idle connections older than this (in seconds) are pinged before being handed out
+STALE_AFTER_SECONDS = 60
+
+
+"""
+PoolTimeoutError:
+Raised when no connection could be checked out of the pool before the timeout ran out
+"""
+class PoolTimeoutError(Exception):
+    pass
+
+
+"""
+ConnectionPool:
+Keeps at most `size` open connections. Connections are created lazily, handed out one
+thread at a time and returned when the caller is done with them. A thread that already
+holds a connection gets the same one back, so nested calls (and transactions) stay on
+a single connection.
+"""
+class ConnectionPool:
+    """
+    Initialization function
+
+    @params: connect (callable) - Function that opens and returns a new connection
+             size (int) - The maximum number of connections the pool will open
+             timeout (float) - How many seconds a checkout waits for a free connection
+             ping (callable, optional) - Function that takes a connection and returns True if
+                                         it is still usable. Used on connections that sat idle
+    """
+    def __init__(self, connect, size=5, timeout=30, ping=None):
+        assert size > 0, "Error: The pool needs room for at least one connection"
+
+        self._connect = connect
+        self._ping = ping
+        self.size = size
+        self.timeout = timeout
+
+        # LIFO so the most recently used (warm) connections are handed out first
+        self._idle = LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        # Notified whenever a connection is returned or a slot frees up
+        self._available = threading.Condition(self._lock)
+        self._local = threading.local()
+        self._created = 0
+        self._closed = False
+
+        # Checkout metrics
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    """
+    Function to check a connection out of the pool.
+    Reuses an idle connection, opens a new one if the pool has room, otherwise waits
+    for another thread to return one.
+
+    @params: None
+    @returns: A connection object
+    """
+    def acquire(self):
+        start = time.perf_counter()
+        waited = False
+
+        while True:
+            try:
+                cnx, last_used = self._idle.get_nowait()
+            except Empty:
+                cnx = self._open_if_room()
+                if cnx is not None:
+                    break
+
+                # Pool is exhausted, wait for a connection to come back (or a broken one to
+                #   be thrown away, which makes room for a new one) and try again
+                waited = True
+                remaining = self.timeout - (time.perf_counter() - start)
+                with self._available:
+                    if self._idle.empty() and self._created >= self.size:
+                        if remaining <= 0 or not self._available.wait(remaining):
+                            self._timeouts += 1
+                            raise PoolTimeoutError(f"No connection available after {self.timeout} seconds")
+                continue
+
+            # Make sure connections that sat around for a while are still alive
+            if self._ping is not None and time.monotonic() - last_used > STALE_AFTER_SECONDS:
+                if not self._ping(cnx):
+                    self._discard(cnx)
+                    continue
+            break
+
+        wait_time = time.perf_counter() - start
+        with self._lock:
+            self._checkouts += 1
+            self._total_wait += wait_time
+            self._max_wait = max(self._max_wait, wait_time)
+            if waited:
+                self._waits += 1
+
+        return cnx
+
+    """
+    Function to give a connection back to the pool
+
+    @params: cnx - The connection that was checked out
+             broken (bool, optional) - If True, the connection is closed instead of reused
+    @returns: None
+    """
+    def release(self, cnx, broken=False):
+        if broken or self._closed:
+            self._discard(cnx)
+        else:
+            self._idle.put((cnx, time.monotonic()))
+            with self._available:
+                self._available.notify()
+
+    """
+    Context manager to hold a connection for the duration of a `with` block.
+    Re-entrant per thread: nested blocks reuse the connection the thread already holds.
+
+    @params: None
+    @returns: The checked out connection
+    """
+    @contextmanager
+    def connection(self):
+        held = getattr(self._local, "cnx", None)
+        if held is not None:
+            self._local.depth += 1
+            try:
+                yield held
+            finally:
+                self._local.depth -= 1
+            return
+
+        cnx = self.acquire()
+        self._local.cnx = cnx
+        self._local.depth = 1
+        broken = False
+        try:
+            yield cnx
+        except Exception:
+            # Only throw the connection away if the error killed it
+            broken = self._ping is not None and not self._ping(cnx)
+            raise
+        finally:
+            self._local.cnx = None
+            self._local.depth = 0
+            self.release(cnx, broken)
+
+    """
+    Function to check if the current thread is holding a connection
+
+    @params: None
+    @returns: True if the calling thread has a connection checked out, False otherwise
+    """
+    def is_held(self):
+        return getattr(self._local, "cnx", None) is not None
+
+    """
+    Function to close every idle connection. Checked out connections are closed when returned.
+
+    @params: None
+    @returns: None
+    """
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                cnx, _ = self._idle.get_nowait()
+            except Empty:
+                break
+            self._discard(cnx)
+
+    """
+    Function to get the pool's checkout metrics
+
+    @params: None
+    @returns: A dictionary of pool size, usage and checkout wait times (in milliseconds)
+    """
+    def stats(self):
+        with self._lock:
+            idle = self._idle.qsize()
+            return {
+                "size": self.size,
+                "open": self._created,
+                "idle": idle,
+                "in_use": self._created - idle,
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+                "avg_wait_ms": (self._total_wait / self._checkouts * 1000) if self._checkouts else 0.0,
+                "max_wait_ms": self._max_wait * 1000,
+            }
+
+    """
+    Private function to open a new connection if the pool has not hit its size yet
+
+    @params: None
+    @returns: A new connection, or None if the pool is full
+    """
+    def _open_if_room(self):
+        with self._lock:
+            if self._created >= self.size:
+                return None
+            self._created += 1
+
+        try:
+            return self._connect()
+        except Exception:
+            with self._available:
+                self._created -= 1
+                self._available.notify()
+            raise
+
+    """
+    Private function to close a connection and free its slot in the pool
+
+    @params: cnx - The connection to close
+    @returns: None
+    """
+    def _discard(self, cnx):
+        with self._available:
+            self._created -= 1
+            self._available.notify()
+        try:
+            cnx.close()
+        except Exception:
+            pass
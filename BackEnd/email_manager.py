@@ -9,54 +9,56 @@ ref:
 '''
 
 from db_manager import *
-import smtplib, ssl
+from latest_plan import resolve_plan
+import threading
+from functools import lru_cache
+from os import getenv
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from mail_transport import SMTPTransport
 
-# Gets the most recent workoutlog 
-def most_recent_workout(user_id, columns=["*"]):
-    sql = f"SELECT {','.join(columns)} FROM workoutLogs WHERE user_id={user_id}\
-          ORDER BY time_created DESC LIMIT 1"
+# the account the emails are sent from
+sender_email = getenv("SMTP_USER", "fitnessfiend.dev@gmail.com")
+sender_pass = getenv("SMTP_PASSWORD", "fitnessfiend#1")
 
-    return db_mgr.submit_query(sql)
+# the mail server used when not sending to a local debugging server
+SMTP_HOST = getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(getenv("SMTP_PORT", 465))
 
-def fetch_Workout(workout_id):
-        '''
-        pass id as an int (10)
-        will call for a workout from the database of that id
-        '''
-        exercise = db_mgr.get_all_rows("workouts",["name"],\
-                                      {"workout_id": workout_id})
-        return exercise
+# set to True to send through a local debugging server on localhost:1025
+# instead (no SSL and no login)
+localhost = getenv("SMTP_LOCALHOST", "").lower() in ("1", "true")
 
-def email(user_email, user_plan):
+_transports = {}
+_transports_lock = threading.Lock()
+
+def get_transport():
     '''
-    if using a local debugging server, use localhost as SMTP server and use port 
-    1025 rather than port 465. won’t need to use login() or encrypt the 
-    communication using SSL. SSL (Secure Sockets Layer) is a protocol used to 
-    encrypt an SMTP connection. It’s not necessary to use when using a local 
-    debugging server.
+    returns the shared SMTP transport (a pool of logged in sessions) for the
+    current localhost setting, opening it on first use
     '''
+    with _transports_lock:
+        transport = _transports.get(localhost)
+        if transport is None:
+            if localhost:
+                transport = SMTPTransport.local()
+            else:
+                transport = SMTPTransport(SMTP_HOST, SMTP_PORT, sender_email, sender_pass)
+            _transports[localhost] = transport
+        return transport
 
-    # email contents here
-    sender_email = "fitnessfiend.dev@gmail.com"
-    sender_pass = "fitnessfiend#1"
-    receiver_email = user_email
-    #receiver_email = "fraylookalike@gmail.com" #put mine here to test
-    message = MIMEMultipart("alternative")
-    message["Subject"] = "Workout Plan"
-    message["From"] = sender_email
-    message["To"] = receiver_email
+# how many distinct plans keep their rendered message in memory
+EMAIL_PLAN_CACHE_SIZE = int(getenv("EMAIL_PLAN_CACHE_SIZE", 1024))
 
-    # Create the plain-text and HTML version of your message
-    text = """\
+# the plain-text and HTML versions of the email. {} is where the plan goes
+TEXT_TEMPLATE = """\
     Hi,
     Here is your workout plan for the day!
     {}
     To see your plan in more detail visit:
     http://www.FitnessFiends.com
-    Let us know how the workout goes!""".format(user_plan)
-    html = """\
+    Let us know how the workout goes!"""
+HTML_TEMPLATE = """\
     <html>
     <body>
         <p>Hi!<br>
@@ -72,30 +74,83 @@ def email(user_email, user_plan):
         Let us know how the workout goes!
     </body>
     </html>
-    """.format(user_plan)
+    """
+
+# the templates split once around the plan, so filling one in is two joins
+TEXT_PARTS = TEXT_TEMPLATE.split("{}")
+HTML_PARTS = HTML_TEMPLATE.split("{}")
+
+def plan_key(plan):
+    '''
+    pass a plan from resolve_plan (or None).
+    returns what the plan's email depends on: each exercise's id, name and
+    prescription. users with the same key get the same email body.
+    '''
+    if plan is None:
+        return None
+    return tuple((exercise["workout_id"], exercise["name"], exercise["sets"],\
+                  exercise["reps"]) for exercise in plan)
+
+@lru_cache(maxsize=EMAIL_PLAN_CACHE_SIZE)
+def render_plan(key):
+    '''
+    pass a plan_key.
+    renders the plan into the templates and builds the MIME message once per
+    distinct plan. the result is cached, so the cost of rendering follows the
+    number of distinct plans rather than the number of users.
+    returns the message (everything but the To header) as a string.
+    '''
+    if key is None:
+        text_plan = html_plan = str(["test", "test", "test"])
+    else:
+        text_lines = []
+        html_plan = ""
+        for workout_id, name, sets, reps in key:
+            if name:
+                line = name + ": {} sets of {} reps".format(sets, reps)
+                text_lines.append(line)
+                html_plan += name + "&nbsp&nbsp&nbsp&nbsp" + line[len(name):]
+                html_plan += "<br>" #for html formatting
+            else:
+                text_lines.append("workout not added")
+                html_plan += "workout not added<br>"
+        text_plan = "\n    ".join(text_lines)
+
+    message = MIMEMultipart("alternative")
+    message["Subject"] = "Workout Plan"
+    message["From"] = sender_email
 
     # Turn these into plain/html MIMEText objects
-    part1 = MIMEText(text, "plain")
-    part2 = MIMEText(html, "html")
+    part1 = MIMEText(text_plan.join(TEXT_PARTS), "plain")
+    part2 = MIMEText(html_plan.join(HTML_PARTS), "html")
 
     # Add HTML/plain-text parts to MIMEMultipart message
     # The email client will try to render the last part first
     message.attach(part1)
     message.attach(part2)
-        
-    # Create secure connection with server and send email
-    context = ssl.create_default_context()
-    if localhost == False:
-        port = 465 # For SSL
-        smtp = "smtp.gmail.com"
-        with smtplib.SMTP_SSL(smtp, port, context=context) as server:
-            server.login(sender_email, sender_pass)
-            server.sendmail(sender_email, receiver_email, message.as_string())
-    else:
-        port = 1025 # for localhost
-        smtp = "localhost"
-        with smtplib.SMTP(smtp, port) as server:
-            server.sendmail(sender_email, receiver_email, message.as_string())
+    return message.as_string()
+
+def email(user_email, message):
+    '''
+    pass the user's email address and a message from render_plan.
+    only the To header is added per user, the rest of the message is shared.
+    sends the message over a pooled SMTP session, so the SSL handshake and
+    login happen once per session rather than once per email.
+    if using a local debugging server, set localhost to True (or SMTP_LOCALHOST)
+    to send to localhost on port 1025 rather than port 465, without login() or
+    SSL (Secure Sockets Layer), which is not needed for a local debugging
+    server.
+    '''
+    receiver_email = user_email
+    #receiver_email = "fraylookalike@gmail.com" #put mine here to test
+
+    # A line break in the address would let it add its own headers
+    if "\r" in receiver_email or "\n" in receiver_email:
+        raise Exception('Bad Email')
+
+    # Send the email on one of the transport's open sessions
+    get_transport().send(sender_email, receiver_email,\
+                         "To: " + receiver_email + "\n" + message)
 
 
 def get_user(user_id):
@@ -111,38 +166,12 @@ def get_user(user_id):
     else:
         raise Exception('Bad Email')
         #user_email = "test@gmail.com"
-    # user_plan_raw = db_mgr.get_one_row("workoutLogs",["details"],\
-    #                                   {"user_id": user_id,\
-    #                                    "user_has_completed": 0}, ["and"])
-    user_plan_raw = most_recent_workout(user_id, columns=["details"])
-    if user_plan_raw:
-        user_plan = ""
-        plan_list = user_plan_raw[0][0].strip("[]")
-        plan_list = plan_list.replace("'", "")
-        plan_list = plan_list.replace(" ", "")
-        plan_list = plan_list.split(",")
-        #print("here's the id's for the plan: {}".format(plan_list))
-        for exercise in plan_list:
-            workout_raw = fetch_Workout(int(exercise))
-            # workout_raw = db_mgr.get_one_row("workouts",["name"], \
-            #                             {"workout_id": int(exercise)})
-            if workout_raw:
-                user_plan += workout_raw[0][0]
-                user_plan += "&nbsp&nbsp&nbsp&nbsp"
-                user_plan += ": 3 sets of 8 reps"
-                user_plan += "<br>" #for html formatting
-            else:
-                user_plan.append("workout not added")
-    else:
-        user_plan = ["test", "test", "test"]
-    # print("end of get_email. Here's what I'm sending: ")
-    # print("user_email: {}".format(user_email))
-    # print("user_plan: {}".format(user_plan))
-    email(user_email, user_plan)
+    plan = resolve_plan(user_id)
+    email(user_email, render_plan(plan_key(plan)))
 
 
 if __name__ == "__main__":
     # to test enter in terminal: py -m smtpd -c DebuggingServer -n localhost:1025
-    # then set localhost to True, and run. the output will be in the terminal.
-    localhost = False
+    # then run with SMTP_LOCALHOST=true (or set localhost to True). the output
+    # will be in the terminal.
     get_user("1")
\ No newline at end of file
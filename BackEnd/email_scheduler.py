@@ -13,24 +13,369 @@ This must be run with nohup on the machine which will serve as backend. if the
 machine is reset, this will need to be run again. 
 
 to start enter into terminal: nohup py email_scheduler.py &
+
+each user is emailed on their own schedule: only if wants_emails is not turned
+off, on daysPerWeek days of the week (every day if it is not set) and at their
+email_time (spread across EMAIL_SPREAD_MINUTES after DEFAULT_EMAIL_TIME if it is
+not set).
 '''
 
+import heapq
+import threading
 import time
-import schedule
+import zlib
+from datetime import date, datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from os import getenv
 from email_manager import *
+from Workout_Classes import make_all_plans
+from table_manager import tables
+
+# how many emails are prepared and sent at once
+EMAIL_WORKERS = int(getenv("EMAIL_WORKERS", 4))
+
+# the most emails sent per second across all workers (0 for no limit)
+EMAIL_RATE_PER_SECOND = float(getenv("EMAIL_RATE_PER_SECOND", 10))
+
+# users without an email_time are spread over this many minutes after the
+# default time, so they are not all emailed at the same instant
+DEFAULT_EMAIL_TIME = getenv("DEFAULT_EMAIL_TIME", "08:30")
+EMAIL_SPREAD_MINUTES = int(getenv("EMAIL_SPREAD_MINUTES", 60))
+
+# how often (in seconds) the scheduler re-reads the users' email settings
+SCHEDULE_REFRESH_SECONDS = float(getenv("SCHEDULE_REFRESH_SECONDS", 300))
+
+
+class RateLimiter:
+    '''
+    spaces calls to wait() so no more than `rate` of them return per second,
+    shared by every worker thread
+    '''
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def wait(self):
+        '''
+        blocks until the caller's turn comes up
+        '''
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            turn = max(now, self._next)
+            self._next = turn + self.interval
+        if turn > now:
+            time.sleep(turn - now)
+
+
+def ensure_ledger():
+    '''
+    creates the emailDeliveries table if this database does not have it yet
+    '''
+    if not db_mgr.has_table("emailDeliveries"):
+        db_mgr.create_table("emailDeliveries", tables["emailDeliveries"])
+
+
+def claim(user_id, send_date):
+    '''
+    marks the user's email for send_date as being sent, unless it already was.
+    a new row is inserted, or a failed attempt is taken over. the unique
+    (user_id, send_date) key means only one run can claim each email.
+    returns True if this run should send the email, False otherwise.
+    '''
+    sql = "INSERT INTO emailDeliveries (user_id, send_date, status)\
+           VALUES (%s, %s, 'sending')"
+    if db_mgr.get_one_row("emailDeliveries", ["status"], {"user_id": user_id,\
+                          "send_date": send_date}, ["and"]) is False:
+        return bool(db_mgr.submit_statement(sql, (user_id, send_date)))
+    sql = "UPDATE emailDeliveries SET status='sending', error=NULL\
+           WHERE user_id=%s AND send_date=%s AND status='failed'"
+    return db_mgr.submit_statement(sql, (user_id, send_date)) == 1
+
+
+def record(user_id, send_date, status, error=None):
+    '''
+    writes how the user's email for send_date went ('sent' or 'failed')
+    '''
+    db_mgr.update_rows("emailDeliveries", {"status": status,\
+                       "error": error[:255] if error else None},\
+                       {"user_id": user_id, "send_date": send_date}, ["and"])
+
+
+# returned by send_one for emails the ledger says were already handled
+SKIPPED = "skipped"
+
+
+def send_one(user_id, limiter, send_date=None):
+    '''
+    sends one user their workout email.
+    with a send_date, the email is claimed in the delivery ledger first and
+    skipped if it was already sent (or claimed) for that day, and the result
+    is written to the ledger as soon as the mail server accepts it.
+    returns None if it was sent, SKIPPED if it was skipped, or the error if it
+    could not be sent. errors are caught here so one bad user (ie,
+    'Bad Email') does not stop the run.
+    '''
+    if send_date is not None and not claim(user_id, send_date):
+        return SKIPPED
+    limiter.wait()
+    try:
+        get_user(user_id)
+    except Exception as err:
+        print("Could not email user {}: {!r}".format(user_id, err))
+        if send_date is not None:
+            record(user_id, send_date, "failed", str(err) or type(err).__name__)
+        return err
+    if send_date is not None:
+        record(user_id, send_date, "sent")
+    return None
+
+
+def send_all(user_ids, workers=EMAIL_WORKERS, rate=EMAIL_RATE_PER_SECOND, send_date=None):
+    '''
+    pass a list of user ids, and optionally the date the emails are for.
+    emails every user over a pool of `workers` threads, at most `rate` emails
+    per second. with a send_date, every email goes through the delivery ledger
+    so it is sent at most once for that day.
+    returns a dictionary with the number of emails sent and skipped, the
+    failed user ids and their errors, the seconds taken and emails per second.
+    '''
+    start = time.perf_counter()
+    limiter = RateLimiter(rate)
+    failed = {}
+    skipped = 0
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        results = pool.map(lambda user_id: (user_id, send_one(user_id, limiter, send_date)), user_ids)
+        for user_id, err in results:
+            if err is SKIPPED:
+                skipped += 1
+            elif err is not None:
+                failed[user_id] = str(err) or type(err).__name__
+
+    sent = len(user_ids) - len(failed) - skipped
+    seconds = time.perf_counter() - start
+    emails_per_second = sent / seconds if seconds > 0 else float(sent)
+    print("Sent {} emails ({} failed, {} skipped) in {:.2f}s ({:.1f} emails/s)".format(\
+          sent, len(failed), skipped, seconds, emails_per_second))
+    return {"sent": sent, "skipped": skipped, "failed": failed,\
+            "seconds": seconds, "emails_per_second": emails_per_second}
+
+
+def get_users(send_date=None):
+    '''
+    get every user id and then send each user a workout email using email_mgr.
+    the run is checkpointed in the emailDeliveries ledger, so running it again
+    for the same day (ie, after a crash) only emails the users that were not
+    emailed yet and retries the ones that failed. emails still marked as
+    'sending' were cut off mid send and are not sent again.
+    '''
+    send_date = str(send_date or date.today())
+    ensure_ledger()
+
+    handled = db_mgr.get_all_rows("emailDeliveries", ["user_id", "status"],\
+                                  {"send_date": send_date}) or []
+    done = set(user_id for user_id, status in handled if status != "failed")
+    unconfirmed = sum(1 for _, status in handled if status == "sending")
+    if unconfirmed:
+        print("{} emails for {} were cut off mid send and are skipped".format(\
+              unconfirmed, send_date))
+
+    users = db_mgr.get_all_rows("users", ["user_id"]) or []
+    remaining = [user[0] for user in users if user[0] not in done]
+    print("Emailing {} of {} users for {}".format(len(remaining), len(users), send_date))
+    return send_all(remaining, send_date=send_date)
+
+
+def ensure_email_time():
+    '''
+    adds the users.email_time column if this database does not have it yet
+    '''
+    if "email_time" not in [column[0] for column in db_mgr.get_table_columns("users")]:
+        db_mgr.submit_statement("ALTER TABLE users ADD COLUMN email_time varchar(5)")
+        db_mgr.invalidate_schema()
+
+
+def parse_time(value):
+    '''
+    pass a time of day as "HH:MM".
+    returns the number of seconds after midnight, or None if it isn't a time
+    '''
+    try:
+        hours, minutes = str(value).split(":")
+        hours, minutes = int(hours), int(minutes)
+    except ValueError:
+        return None
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        return None
+    return hours * 3600 + minutes * 60
+
+
+def send_days(user_id, days_per_week):
+    '''
+    returns the weekdays (0 is monday) the user is emailed on: daysPerWeek days
+    spaced evenly through the week, shifted by the user id so not everyone
+    gets mail on the same days. every day if daysPerWeek is not set.
+    '''
+    if not days_per_week or days_per_week >= 7:
+        return frozenset(range(7))
+    days_per_week = max(int(days_per_week), 1)
+    return frozenset((day * 7 // days_per_week + user_id) % 7\
+                     for day in range(days_per_week))
+
+
+def send_second(user_id, email_time):
+    '''
+    returns the second of the day the user is emailed at: their email_time, or
+    a steady spot (from a hash of the user id) in the window after
+    DEFAULT_EMAIL_TIME.
+    '''
+    second = parse_time(email_time) if email_time else None
+    if second is None:
+        window = max(EMAIL_SPREAD_MINUTES, 0) * 60
+        spread = zlib.crc32(str(user_id).encode()) % window if window else 0
+        second = (parse_time(DEFAULT_EMAIL_TIME) or 0) + spread
+    return second % 86400
+
+
+def start_of_day(when):
+    '''
+    returns midnight at the start of the day `when` falls on
+    '''
+    return datetime.combine(when.date(), datetime.min.time())
+
+
+def next_due(days, second, after):
+    '''
+    returns the first send time strictly after `after` that falls on one of the
+    user's send days at their send time
+    '''
+    day = after.date()
+    for _ in range(8):
+        due = datetime.combine(day, datetime.min.time()) + timedelta(seconds=second)
+        if due > after and due.weekday() in days:
+            return due
+        day += timedelta(days=1)
+    return None
+
 
-def get_users():
+class DeliveryScheduler:
     '''
-    get every user id and then send each user a workout email using email_mgr
+    keeps a min-heap of the next time each user is due an email. run() sleeps
+    until exactly the next due time, hands the due emails to the worker pool
+    (through the delivery ledger, so nothing is sent twice in a day) and then
+    schedules each user's next email. the users' settings are re-read every
+    SCHEDULE_REFRESH_SECONDS.
     '''
-    users = db_mgr.get_all_rows("users", ["user_id"])
-    for user in users:
-        get_user(user[0])
-        # print(str(user[0]))
+    def __init__(self, workers=EMAIL_WORKERS, rate=EMAIL_RATE_PER_SECOND):
+        self.workers = workers
+        self.limiter = RateLimiter(rate)
+        self._heap = []
+        # each user's (send days, send second) and the due time of their entry
+        # in the heap. heap entries that don't match _due are stale
+        self._settings = {}
+        self._due = {}
+        # when each user's last email was handed out
+        self._handled = {}
+        # the last day every user's plan was made for
+        self._plans_made = None
+
+    def refresh(self, now=None):
+        '''
+        reads every user's email settings in one query and (re)schedules them.
+        users that turned emails off are dropped from the schedule. new (or
+        returning) users are scheduled from midnight today, so an email due
+        earlier today (ie, before a restart) is still sent but none from
+        earlier days are.
+        '''
+        today = start_of_day(now or datetime.now())
+        users = db_mgr.get_all_rows("users", ["user_id", "wants_emails",\
+                                    "daysPerWeek", "email_time"])
+        if users is False:
+            return
+        self._settings = {}
+        self._due = {}
+        for user_id, wants_emails, days_per_week, email_time in users:
+            # only an explicit "no" opts out, like before every user is emailed
+            if wants_emails is not None and not wants_emails:
+                continue
+            self._settings[user_id] = (send_days(user_id, days_per_week),\
+                                       send_second(user_id, email_time))
+            self._schedule(user_id, max(self._handled.get(user_id, today), today))
+        self._heap = [(when, user_id) for user_id, when in self._due.items()]
+        heapq.heapify(self._heap)
+
+    def pop_due(self, now):
+        '''
+        removes and returns the (due time, user_id) of every email due by now,
+        and schedules each of those users' next email. emails that came due on
+        an earlier day (ie, the process stalled) are skipped, not sent late.
+        '''
+        today = start_of_day(now)
+        ready = []
+        while self._heap and self._heap[0][0] <= now:
+            when, user_id = heapq.heappop(self._heap)
+            if self._due.get(user_id) != when:
+                continue
+            if when >= today:
+                ready.append((when, user_id))
+                self._handled[user_id] = when
+            if self._schedule(user_id, max(when, today)):
+                heapq.heappush(self._heap, (self._due[user_id], user_id))
+        return ready
+
+    def next_wakeup(self):
+        '''
+        returns the time the next email is due, or None if nothing is scheduled
+        '''
+        return self._heap[0][0] if self._heap else None
+
+    def run(self):
+        '''
+        runs forever, making everyone's plan once a day and sending each
+        user's email when it comes due
+        '''
+        ensure_ledger()
+        ensure_email_time()
+        with ThreadPoolExecutor(max_workers=max(self.workers, 1)) as pool:
+            next_refresh = 0
+            while True:
+                if time.monotonic() >= next_refresh:
+                    self.refresh()
+                    next_refresh = time.monotonic() + SCHEDULE_REFRESH_SECONDS
+
+                # the day's plans are made before its first email goes out
+                if self._plans_made != date.today():
+                    make_all_plans(skip_made_today=True)
+                    self._plans_made = date.today()
+
+                for when, user_id in self.pop_due(datetime.now()):
+                    pool.submit(send_one, user_id, self.limiter, str(when.date()))
+
+                # sleep until the next email is due, or the next refresh if
+                # that comes first
+                seconds = next_refresh - time.monotonic()
+                wakeup = self.next_wakeup()
+                if wakeup is not None:
+                    seconds = min(seconds, (wakeup - datetime.now()).total_seconds())
+                if seconds > 0:
+                    time.sleep(seconds)
 
+    def _schedule(self, user_id, after):
+        '''
+        works out the user's next send time after `after` from their settings.
+        returns True if they have one.
+        '''
+        days, second = self._settings[user_id]
+        when = next_due(days, second, after)
+        if when is None:
+            self._due.pop(user_id, None)
+            return False
+        self._due[user_id] = when
+        return True
 
-schedule.every().day.at("8:30").do(get_users) #send the daily email at 830
 
-while True:
-    schedule.run_pending() # do shedule items
-    time.sleep(60) # wait one minute then set schedule again after running.
\ No newline at end of file
+if __name__ == "__main__":
+    DeliveryScheduler().run()
@@ -8,23 +8,111 @@ ref:
 '''
 
 from db_manager import *
+from workout_catalog import workout_catalog
+from Workout_Classes import DEFAULT_SETS, DEFAULT_REPS
 
-# Gets the most recent workoutlog 
+# Gets the most recent workoutlog by following the user's latestWorkoutLogs pointer
+#   (a primary key lookup however long the user's history is). Users without a
+#   pointer (logs saved before it existed) fall back to their newest log; the
+#   pointer itself is only written when a plan is saved.
 def most_recent_workout(user_id, columns=["*"]):
-    sql = f"SELECT {','.join(columns)} FROM workoutLogs WHERE user_id={user_id}\
-          ORDER BY time_created DESC LIMIT 1"
+    select = ",".join("l." + column for column in columns)
+    sql = "SELECT {} FROM latestWorkoutLogs p JOIN workoutLogs l ON l.log_id = p.log_id\
+          WHERE p.user_id=%s".format(select)
 
-    return db_mgr.submit_query(sql)
+    log = db_mgr.submit_query(sql, (user_id,))
+    if log:
+        return log
+
+    return db_mgr.submit_query("SELECT {} FROM workoutLogs l WHERE l.user_id=%s\
+                               ORDER BY l.log_id DESC LIMIT 1".format(select), (user_id,))
 
 def fetch_Workout(workout_id):
         '''
         pass id as an int (10)
-        will call for a workout from the database of that id
+        will look up the workout of that id in the workout catalog
         '''
-        exercise = db_mgr.get_all_rows("workouts",["name"],\
-                                      {"workout_id": workout_id})
+        workout = workout_catalog.get(workout_id)
+        exercise = [(workout.name,)] if workout else []
         return exercise
 
+def parse_plan(details):
+    '''
+    pass the details string of a workout log ("1,2,3" or "['1', '2', '3']")
+    returns the workout ids in the plan as a list of ints, in plan order
+    '''
+    plan_list = details.strip("[]")
+    plan_list = plan_list.replace("'", "")
+    plan_list = plan_list.replace(" ", "")
+    return [int(exercise) for exercise in plan_list.split(",") if exercise]
+
+def fetch_Tips(workout_ids):
+    '''
+    pass a list of workout ids
+    gets the tips for all of the workouts in one query
+    returns a dictionary of workout id to a list of tip strings
+    '''
+    tips = {}
+    if not workout_ids:
+        return tips
+    ids = sorted(set(workout_ids))
+    sql = "SELECT workout_id, tip_str FROM workoutTips WHERE workout_id IN ({})\
+          ORDER BY tip_id".format(",".join(["%s"] * len(ids)))
+    for workout_id, tip in db_mgr.submit_query(sql, tuple(ids)) or []:
+        tips.setdefault(workout_id, []).append(tip)
+    return tips
+
+def fetch_Exercises(log_id):
+    '''
+    pass a log_id as an int
+    gets the log's workoutLogExercises rows joined with their tips in one query
+    returns a list of dictionaries (workout_id, sets, reps, weight, tips) in
+    plan order, empty if the log has no exercise rows
+    '''
+    sql = "SELECT e.position, e.workout_id, e.sets, e.reps, e.weight, t.tip_str\
+          FROM workoutLogExercises e\
+          LEFT JOIN workoutTips t ON t.workout_id = e.workout_id\
+          WHERE e.log_id=%s ORDER BY e.position, t.tip_id"
+    exercises = []
+    last_position = None
+    for position, workout_id, sets, reps, weight, tip in db_mgr.submit_query(sql, (log_id,)) or []:
+        if position != last_position:
+            exercises.append({"workout_id": workout_id, "sets": sets,\
+                              "reps": reps, "weight": weight, "tips": []})
+            last_position = position
+        if tip is not None:
+            exercises[-1]["tips"].append(tip)
+    return exercises
+
+def resolve_plan(user_id):
+    '''
+    pass user_id as a string.
+    resolves the user's latest workout plan in one pass: the log is read once,
+    its exercises and their tips come from one joined query (logs from before
+    workoutLogExercises fall back to the details string and a single IN (...)
+    query for the tips), and names and equipment come from the workout catalog.
+    returns a list of dictionaries (workout_id, name, equipment, sets, reps,
+    weight, tips) in plan order, with None for the name of ids that are no
+    longer in the catalog, or None if the user has no plan yet.
+    '''
+    user_plan_raw = most_recent_workout(user_id, columns=["log_id", "details"])
+    if not user_plan_raw:
+        return None
+    log_id, details = user_plan_raw[0]
+    plan = fetch_Exercises(log_id)
+    if not plan:
+        workout_ids = parse_plan(details)
+        tips = fetch_Tips(workout_ids)
+        plan = [{"workout_id": workout_id, "sets": DEFAULT_SETS,\
+                 "reps": DEFAULT_REPS, "weight": None,\
+                 "tips": tips.get(workout_id, [])}\
+                for workout_id in workout_ids]
+    for exercise in plan:
+        workout = workout_catalog.get(exercise["workout_id"])
+        exercise["name"] = workout.name if workout else None
+        exercise["equipment"] = workout.equipment if workout else None
+    return plan
+
 def get_plan(user_id):
     '''
     Main method. Call this to run.
@@ -32,21 +120,16 @@ def get_plan(user_id):
     Will get user's latest workout plan from database
     returns a string.
     '''
-    user_plan_raw = most_recent_workout(user_id, columns=["details"])
-    if user_plan_raw:
+    plan = resolve_plan(user_id)
+    if plan is not None:
         user_plan = ""
-        plan_list = user_plan_raw[0][0].strip("[]")
-        plan_list = plan_list.replace("'", "")
-        plan_list = plan_list.replace(" ", "")
-        plan_list = plan_list.split(",")
-        for exercise in plan_list:
-            workout_raw = fetch_Workout(int(exercise))
-            if workout_raw:
-                user_plan += workout_raw[0][0]
-                user_plan += ": 3 sets of 8 reps"
+        for exercise in plan:
+            if exercise["name"]:
+                user_plan += exercise["name"]
+                user_plan += ": {} sets of {} reps".format(exercise["sets"], exercise["reps"])
                 user_plan += ","
             else:
-                user_plan.append("workout not added")
+                user_plan += "workout not added,"
     else:
         user_plan = ["test", "test", "test"]
     return user_plan
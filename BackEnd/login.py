@@ -30,6 +30,15 @@ JWT_SECRET = getenv("TOKEN_SECRET")
 JWT_ALGORITHM = 'HS256'
 JWT_EXP_DELTA_SECONDS = (20 * 60)   # Token-timer set to expire in 20 minutes
 
+# Logging in within this many seconds of the last login continues the streak
+LOGIN_STREAK_SECONDS = 24 * 60 * 60
+LOGIN_STREAK_SQL = ("`login_streak` = CASE WHEN `last_logged_in` > {since} THEN `login_streak` + 1 ELSE 1 END, "
+                    "`last_logged_in` = CURRENT_TIMESTAMP")
+
+# Whether users.email has its unique key (see ensure_unique_emails). Databases created before the
+#   key was added get it at startup. Until they do, account creation looks the email up itself.
+unique_emails = False
+
 ###
 #   Helper functions
 ###
@@ -43,13 +52,25 @@ def generate_token(user_id):
 
     return jwt.encode(payload, JWT_SECRET, JWT_ALGORITHM)
 
+# Decodes the provided token, returning its payload if it is valid and has not expired (False otherwise)
+def decode_token(token):
+    try:
+        return jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    except jwt.InvalidTokenError:
+        return False
+
 # Checks if the provided token is valid and has not expired
 def check_token(token):
-    try:
-        payload = jwt.decode(token, JWT_SECRET, JWT_ALGORITHM)
-        return payload['user_id']
-    except (jwt.DecodeError, jwt.ExpiredSignatureError):
+    payload = decode_token(token)
+    if not payload:
         return False
+    return payload['user_id']
+
+# Makes sure users.email is a unique key (adding it to older databases), which account creation relies on
+def ensure_unique_emails():
+    global unique_emails
+    unique_emails = db_mgr.ensure_unique_key('users', 'users_email', ['email'])
+    return unique_emails
 
 # Hashes a given string using sha256 algorithm
 def encrypt_string(string):
@@ -62,28 +83,24 @@ def encrypt_string(string):
 def create_account():
     request_data = json.loads(flask.request.data)
 
-    # Get all rows from the table that have the same email as the given data
-    db_results = db_mgr.get_all_rows('users', 
-                                     ['user_id'], 
-                                     where_options={'email': request_data['email']}
-                                     )
-
-    # If we get one or more result, user account already exists, throw error
-    if len(db_results) > 0:
-        return {'message': 'User with email already exists'}, 409
+    # Without the unique key (a database whose users already share emails) fall back to checking first
+    if not unique_emails and db_mgr.get_one_row('users', ['user_id'], {'email': request_data['email']}):
+        return {'message': 'User with email or username already exists'}, 409
 
-    # Generate the data to be inserted and insert it
+    # Insert the user straight away and let the unique email (and username) keys reject
+    #   duplicates. One statement, and two signups with the same email can't both get through.
     new_user = {
         'email': request_data['email'],
         'username': request_data['username'],
         'password': encrypt_string(request_data['password'])
     }
-    insert_result = db_mgr.add_one_row('users', new_user)
-    if (insert_result == False):
+    user_id = db_mgr.add_unique_row('users', new_user)
+    if user_id is None:
+        return {'message': 'User with email or username already exists'}, 409
+    if user_id is False:
         return {'message': 'Account could not be created'}, 500
 
     # Generate the token and return it
-    user_id = db_mgr.get_last_inserted_id()
     token = generate_token(user_id)
 
     return {'message': 'success', 'token': token}, 201
@@ -92,39 +109,25 @@ def create_account():
 def login():
     request_data = json.loads(flask.request.data)
 
-    # Get all results from the user database where email = request_email AND password = request_password
-    db_results = db_mgr.get_all_rows('users',
-                                     ['user_id', 'last_logged_in', 'login_streak'],
-                                     where_options={'email': request_data['email'],
-                                                    'password': encrypt_string(request_data['password'])},
-                                     where_connectors=['AND'])
-
-    # Something went wrong                     
-    if db_results == False:
+    # Check the credentials and update the login streak in one statement (one round trip, and no
+    #   race between reading and writing the streak). The streak goes up if the user logged in
+    #   within the past 24 hours and starts over otherwise. last_logged_in is set explicitly, so
+    #   it moves even when the streak value itself doesn't change.
+    user_id = db_mgr.update_returning_key('users',
+                                          LOGIN_STREAK_SQL.format(since=db_mgr.backend.time_ago(LOGIN_STREAK_SECONDS)),
+                                          (),
+                                          where_options={'email': request_data['email'],
+                                                         'password': encrypt_string(request_data['password'])},
+                                          where_connectors=['AND'],
+                                          key='user_id')
+
+    # Something went wrong
+    if user_id is False:
         return {'message': 'Something went wrong'}, 500
-    
-    # If we found no results, bad for them
-    # If we found more than one result, bad for us!
-    if len(db_results) == 0:
-        return {'message': 'Incorrect username/password'}, 400
-    elif len(db_results) > 1:
-        return {'message': 'Multiple users exist with those credentials... Uh Oh'}, 500
-
-    db_results = db_results[0]
-
-    # Update the user's login streak if they have logged in within the past 24 hours
-    user_id = db_results[0]
-    last_logged_in = db_results[1]
-    login_streak = int(db_results[2])
-    curr_time = datetime.now()
 
-    if (curr_time - last_logged_in < timedelta(1)):
-        update_res = db_mgr.update_rows("users", {'login_streak': (login_streak + 1)}, where_options={"user_id": int(user_id)})
-    else:
-        update_res = db_mgr.update_rows("users", {'login_streak': 1}, where_options={"user_id": int(user_id)})
-
-    if not update_res:
-        return {"message": "Something went wrong when updating the user's login streak"}, 500
+    # If no user matched, bad for them (emails are unique, so at most one can match)
+    if user_id is None:
+        return {'message': 'Incorrect username/password'}, 400
 
-    token = generate_token(db_results[0])
+    token = generate_token(user_id)
     return  {'token': token}, 200
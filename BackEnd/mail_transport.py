@@ -0,0 +1,167 @@
+"""
+Filename: mail_transport.py
+
+Purpose: Sends email over a small pool of logged in SMTP sessions. Each session is opened
+         (and TLS-handshaked and authenticated) once and then sends many messages, instead of
+         connecting and logging in again for every email. Sessions that dropped are
+         reopened transparently. Also works with a local debugging server (localhost:1025).
+
+Authors: Jordan Smith
+Group: Wholesome as Heck Programmers (WaHP)
+Last modified: 10/18/26
+"""
+import smtplib
+import ssl
+import threading
+from os import getenv
+from db_pool import ConnectionPool
+
+# How many SMTP sessions are kept open, and how long a send waits for a free one (in seconds)
+SMTP_POOL_SIZE = int(getenv("SMTP_POOL_SIZE", 4))
+SMTP_POOL_TIMEOUT = float(getenv("SMTP_POOL_TIMEOUT", 60))
+
+# Seconds before an SMTP connection attempt or command gives up
+SMTP_TIMEOUT = float(getenv("SMTP_TIMEOUT", 30))
+
+# Errors that mean the session itself is gone, so the message is retried on a new session
+SESSION_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+
+"""
+SMTPTransport:
+A pool of persistent SMTP sessions to one server
+"""
+class SMTPTransport:
+    """
+    Initialization function
+
+    @params: host (str) - The SMTP server
+             port (int) - The SMTP server's port (465 uses SSL)
+             username (str, optional) - Who to log in as. No login is done if left empty
+             password (str, optional) - The login password
+             use_ssl (bool, optional) - Whether to connect with SSL. Defaults to True on port 465.
+                                        Without SSL, the session is upgraded with STARTTLS before logging in
+             pool_size (int, optional) - The most sessions open at once
+    """
+    def __init__(self, host, port, username=None, password=None, use_ssl=None, pool_size=SMTP_POOL_SIZE):
+        self.host = host
+        self.port = int(port)
+        self.username = username
+        self.password = password
+        self.use_ssl = (self.port == 465) if use_ssl is None else use_ssl
+
+        # Credentials are never sent over a plain connection
+        self.use_starttls = not self.use_ssl and bool(self.username)
+        self._context = ssl.create_default_context() if self.use_ssl or self.use_starttls else None
+        self._pool = ConnectionPool(self._open, pool_size, SMTP_POOL_TIMEOUT, ping=self._ping)
+
+        self._lock = threading.Lock()
+        self.sessions_opened = 0
+        self.messages_sent = 0
+        self.reconnects = 0
+
+    """
+    Function to make a transport for a local debugging server. No TLS and no login (the only
+    transport that sends in the clear).
+
+    @params: host (str, optional) - The debugging server's host
+             port (int, optional) - The debugging server's port
+    @returns: An SMTPTransport
+    """
+    @classmethod
+    def local(cls, host="localhost", port=1025, pool_size=SMTP_POOL_SIZE):
+        return cls(host, port, use_ssl=False, pool_size=pool_size)
+
+    """
+    Function to send one message on a pooled session.
+    If the session turns out to be dead, the message is sent again on a new one.
+
+    @params: sender (str) - The sender's address
+             recipients (str or str list) - Who to send the message to
+             message (str or bytes) - The full message (headers and body)
+    @returns: A dictionary of refused recipients (empty if everyone accepted it), like smtplib's sendmail
+    """
+    def send(self, sender, recipients, message):
+        try:
+            refused = self._send(sender, recipients, message)
+        except SESSION_ERRORS:
+            # The pool threw the dead session away, so this checks out a fresh one
+            with self._lock:
+                self.reconnects += 1
+            refused = self._send(sender, recipients, message)
+
+        with self._lock:
+            self.messages_sent += 1
+        return refused
+
+    """
+    Function to close every idle session
+
+    @params: None
+    @returns: None
+    """
+    def close(self):
+        self._pool.close()
+
+    """
+    Function to get the transport's session and send counts
+
+    @params: None
+    @returns: A dictionary of sessions opened, messages sent, reconnects and the session pool's metrics
+    """
+    def stats(self):
+        with self._lock:
+            return {
+                "server": f"{self.host}:{self.port}",
+                "sessions_opened": self.sessions_opened,
+                "messages_sent": self.messages_sent,
+                "reconnects": self.reconnects,
+                "pool": self._pool.stats()
+            }
+
+    """
+    Private function to send a message on a session checked out of the pool
+
+    @params: See send()
+    @returns: A dictionary of refused recipients
+    """
+    def _send(self, sender, recipients, message):
+        with self._pool.connection() as server:
+            return server.sendmail(sender, recipients, message)
+
+    """
+    Private function to open and log in a new session (used by the pool)
+
+    @params: None
+    @returns: A connected smtplib.SMTP (or SMTP_SSL) object
+    """
+    def _open(self):
+        if self.use_ssl:
+            server = smtplib.SMTP_SSL(self.host, self.port, context=self._context, timeout=SMTP_TIMEOUT)
+        else:
+            server = smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT)
+
+        try:
+            if self.use_starttls:
+                server.starttls(context=self._context)
+            if self.username and self.password:
+                server.login(self.username, self.password)
+        except Exception:
+            server.close()
+            raise
+
+        with self._lock:
+            self.sessions_opened += 1
+        return server
+
+    """
+    Private function to check that a session is still connected (used by the pool)
+
+    @params: server - The session to check
+    @returns: True if the server answered a NOOP, False otherwise
+    """
+    def _ping(self, server):
+        try:
+            return server.noop()[0] == 250
+        except Exception:
+            return False
@@ -0,0 +1,75 @@
+"""
+Filename: migrate_workout_logs.py
+
+Purpose: Creates the workoutLogExercises table and back-fills it from the comma-joined
+         details strings of the existing workout logs, then creates latestWorkoutLogs and
+         points it at each user's newest log. Logs that already have exercise rows are
+         skipped, so the migration can be run again safely.
+
+Authors: Jordan Smith
+Group: Wholesome as Heck Programmers (WaHP)
+Last modified: 10/18/26
+"""
+from db_manager import db_mgr
+from table_manager import tables
+from workout_catalog import workout_catalog
+from latest_plan import parse_plan
+from Workout_Classes import DEFAULT_SETS, DEFAULT_REPS
+
+# Create the child table (does nothing if it already exists)
+db_mgr.create_table('workoutLogExercises', tables['workoutLogExercises'])
+
+# Logs that were already migrated (or written with their exercises)
+migrated = set(row[0] for row in db_mgr.submit_query("SELECT DISTINCT log_id FROM workoutLogExercises") or [])
+
+# Load the workouts up front, the logs are streamed over this thread's connection
+workout_catalog.refresh()
+
+rows_to_insert = []
+migrated_logs = 0
+skipped_logs = []
+
+for log_id, details, sets, reps, weight in db_mgr.iter_rows('workoutLogs', ['log_id', 'details', 'sets', 'reps', 'weight'], key='log_id'):
+    if log_id in migrated:
+        continue
+
+    try:
+        workout_ids = parse_plan(details or "")
+    except ValueError:
+        skipped_logs.append(log_id)
+        continue
+
+    # Ids that are no longer in the workouts table would break the foreign key
+    if any(workout_catalog.get(workout_id) is None for workout_id in workout_ids):
+        skipped_logs.append(log_id)
+        continue
+
+    for position, workout_id in enumerate(workout_ids):
+        rows_to_insert.append({
+            'log_id': log_id,
+            'position': position,
+            'workout_id': workout_id,
+            'sets': sets if sets is not None else DEFAULT_SETS,
+            'reps': reps if reps is not None else DEFAULT_REPS,
+            'weight': weight
+        })
+    migrated_logs += 1
+
+if rows_to_insert:
+    res = db_mgr.bulk_insert('workoutLogExercises', rows_to_insert)
+    if res:
+        print(f"Migrated {migrated_logs} workout logs ({res['rows']} exercises, {res['rows_per_second']:.0f} rows/s)")
+else:
+    print("No workout logs to migrate")
+
+if skipped_logs:
+    print(f"Skipped {len(skipped_logs)} logs with unreadable or unknown workout ids: {skipped_logs}")
+
+# Create the latest log pointers (does nothing if the table already exists) and set them for
+#   every user that has logs but no pointer yet
+db_mgr.create_table('latestWorkoutLogs', tables['latestWorkoutLogs'])
+
+added = db_mgr.submit_statement("INSERT INTO latestWorkoutLogs (user_id, log_id) SELECT user_id, MAX(log_id) FROM workoutLogs l "
+                                "WHERE NOT EXISTS (SELECT 1 FROM latestWorkoutLogs p WHERE p.user_id = l.user_id) GROUP BY user_id")
+if added is not False:
+    print(f"Set the latest workout log of {added} users")
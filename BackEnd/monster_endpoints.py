@@ -9,7 +9,10 @@ Group: Wholesome as Heck Programmers
 Last modified: 11/16/21
 """
 import flask
+import json
 from db_manager import db_mgr
+from auth import user_route, current_user
+from write_buffer import write_buffer
 from Fiend_Skeleton import * 
 
 ###
@@ -29,14 +32,14 @@ def get_user_monster_info(user_id):
     sql_query = f"""
     SELECT {", ".join(desired_columns)}
     from monsters left join users on monsters.user_id = users.user_id
-    WHERE users.user_id = {int(user_id)};
+    WHERE users.user_id = %s;
     """
-    user_monster_info = db_mgr.submit_query(sql_query)
+    user_monster_info = db_mgr.submit_query(sql_query, (int(user_id),))
 
     # The user doesn't have a monster
     if (user_monster_info == []):
         user_monster_info = [None for _ in range(len(desired_columns) - 1)]
-        user_monster_info += db_mgr.get_one_row('users', 'has_finished_quiz', {'user_id': int(user_id)})
+        user_monster_info.append(current_user()['has_finished_quiz'])
     else:
         user_monster_info = user_monster_info[0]
 
@@ -45,6 +48,11 @@ def get_user_monster_info(user_id):
     for i in range(len(desired_columns)):
         monster_data[desired_columns[i]] = user_monster_info[i]
 
+    # Levels and quiz status may still be waiting in the write buffer
+    if monster_data['name'] is not None:
+        write_buffer.overlay('monsters', 'user_id', int(user_id), monster_data)
+    write_buffer.overlay('users', 'user_id', int(user_id), monster_data)
+
     return monster_data
 
 ###
@@ -55,8 +63,9 @@ Endpoint to get the user's monster info from the database as well as whether or
     the user has finished the initial quiz
 """
 @monster_page.route("/get_user_info", methods=["GET"])
+@user_route
 def user_info():
-    user_id = flask.request.headers.get("user_token")
+    user_id = flask.g.user_id
 
     return get_user_monster_info(user_id), 201
 
@@ -67,8 +76,9 @@ Endpoint to level the user's monster up and return the monster's info and quiz s
             500 if the update fails 
 """
 @monster_page.route("/level_monster_up", methods=["GET"])
+@user_route
 def monster_level_up():
-    user_id = flask.request.headers.get("user_token")
+    user_id = flask.g.user_id
 
     monster_info = get_user_monster_info(user_id)
     
@@ -81,11 +91,9 @@ def monster_level_up():
                       level=monster_info['level'])
     currFiend.level.levelUp()
 
-    # Update the info in the monster database
-    update_res = db_mgr.update_rows("monsters",
-                                   {"level": currFiend.tellLevel()},
-                                   where_options={"user_id": int(user_id)}
-                                   )
+    # Update the info in the monster database (buffered, see write_buffer.py)
+    update_res = write_buffer.set("monsters", "user_id", int(user_id),
+                                  {"level": currFiend.tellLevel()})
     if not update_res:
         return {"message": "Monster could not be leveled up"}, 500
 
@@ -97,12 +105,11 @@ def monster_level_up():
 Endpoint to reset the user's monster level (FOR TESTING)
 """
 @monster_page.route("/reset_monster_level")
+@user_route
 def reset_level():
-    user_id = flask.request.headers.get("user_token")
+    user_id = flask.g.user_id
 
-    update_res = db_mgr.update_rows("monsters", 
-                                    {"level": 1},
-                                    where_options={"user_id": int(user_id)})
+    update_res = write_buffer.set("monsters", "user_id", int(user_id), {"level": 1})
 
     if not update_res:
         return {"message": "Monster level could not be reset"}, 500
@@ -115,10 +122,11 @@ Initializes a monster for a user in the database
             409 if the user already has a monster
 """
 @monster_page.route("/create_monster_for_user", methods=["POST"])
+@user_route
 def create_monster():
     request_data = json.loads(flask.request.data)
 
-    user_id = int(request_data['user_id'])
+    user_id = flask.g.user_id
     monster_data = request_data['monster_info']
 
     # Check if the user already has a monster 
@@ -13,6 +13,9 @@ DROP_ALL = True
 
 tables = {}
 
+# Besides primary, foreign and unique keys, tables declare secondary indexes for their hot lookups
+#   (see DB_Manager.create_table for the format). Index names are unique across the database.
+
 ###
 #   TABLES TO BE ADDED
 ###
@@ -37,13 +40,18 @@ tables['users'] = {
     'fitness_goal_id': 'int',
     'has_finished_quiz': 'boolean DEFAULT false',
     'wants_emails': 'boolean',
+    # Preferred time of day for the workout email ('HH:MM'), spread around the default time if empty
+    'email_time': 'varchar(5)',
     'show_tips': 'boolean DEFAULT true',
     'experience': 'varchar(16)',
     'daysPerWeek': 'int',
     'availableEquipment': 'varchar(255)',
     'constraints': {
-        'UNIQUE': 'email',
-        'UNIQUE': 'username',
+        # The unique email key also serves logins (WHERE email AND password)
+        'UNIQUE KEY': {
+            'users_email': ['email'],
+            'users_username': ['username']
+        },
         'PRIMARY KEY': 'user_id',
         'FOREIGN KEY': ['fitness_goal_id', 'fitnessGoal(fitness_id)']
     }
@@ -59,7 +67,10 @@ tables['monsters'] = {
     'image_name': 'varchar(32)',
     'constraints': {
         'PRIMARY KEY': 'monster_id',
-        'FOREIGN KEY': ['user_id', 'users(user_id)']
+        'FOREIGN KEY': ['user_id', 'users(user_id)'],
+        'INDEX': {
+            'monsters_user': ['user_id']
+        }
     }
 }
 
@@ -71,7 +82,10 @@ tables['workouts'] = {
     'difficulty': 'varchar(16) NOT NULL',
     'is_priority': 'bool NOT NULL',
     'constraints': {
-        'PRIMARY KEY': 'workout_id'
+        'PRIMARY KEY': 'workout_id',
+        'INDEX': {
+            'workouts_type_priority': ['type', 'is_priority']
+        }
     }
 }
 
@@ -79,8 +93,10 @@ tables['workoutConnection'] = {
     'workout_id': 'int NOT NULL',
     'fitness_goal_id': 'int NOT NULL',
     'constraints': {
-        'FOREIGN KEY': ['workout_id', 'workouts(workout_id)'],
-        'FOREIGN KEY': ['fitness_goal_id', 'fitnessGoal(fitness_id)']
+        'FOREIGN KEY': [
+            ['workout_id', 'workouts(workout_id)'],
+            ['fitness_goal_id', 'fitnessGoal(fitness_id)']
+        ]
     }
 }
 
@@ -90,13 +106,18 @@ tables['workoutTips'] = {
     'workout_id': 'int NOT NULL',
     'constraints': {
         'PRIMARY KEY': 'tip_id',
-        'FOREIGN KEY': ['workout_id', 'workouts(workout_id)']
+        'FOREIGN KEY': ['workout_id', 'workouts(workout_id)'],
+        'INDEX': {
+            'workoutTips_workout': ['workout_id']
+        }
     }
 }
 
 tables['workoutLogs'] = {
     'log_id': 'int NOT NULL AUTO_INCREMENT',
     'user_id': 'int NOT NULL',
+    # Deprecated: the plan is in workoutLogExercises. New logs store '' here, the comma-joined
+    #   ids (cut off at 255 characters) are only read from logs saved before that table existed
     'workout_ids': 'varchar(255) NOT NULL',
     'time_created': 'timestamp DEFAULT CURRENT_TIMESTAMP',
     'user_has_completed': 'bool NOT NULL DEFAULT false',
@@ -105,12 +126,74 @@ tables['workoutLogs'] = {
     'weight': 'float',
     'time_duration': 'float',
     'distance_duration': 'float',
+    # Deprecated, like workout_ids
     'details': 'varchar(255) NOT NULL',
     'user_enjoyment': 'int NOT NULL',
     'constraints': {
         'PRIMARY KEY': 'log_id',
-        'FOREIGN KEY': ['user_id', 'users(user_id)']
+        'FOREIGN KEY': ['user_id', 'users(user_id)'],
         # 'FOREIGN KEY': ['workout_type_id', 'workouts(workout_id)']
+        # A user's newest log (WHERE user_id ORDER BY time_created DESC LIMIT 1) is one index seek
+        'INDEX': {
+            'workoutLogs_user_time': ['user_id', 'time_created']
+        }
+    }
+}
+
+# Each user's newest workoutLogs row, kept up to date with each log insert. Kept out of users
+#   so moving it doesn't touch users.last_logged_in (ON UPDATE CURRENT_TIMESTAMP)
+tables['latestWorkoutLogs'] = {
+    'user_id': 'int NOT NULL',
+    'log_id': 'int NOT NULL',
+    'constraints': {
+        'PRIMARY KEY': 'user_id',
+        'FOREIGN KEY': [
+            ['user_id', 'users(user_id)'],
+            ['log_id', 'workoutLogs(log_id)']
+        ]
+    }
+}
+
+# The exercises of each workout log, one row per exercise in plan order
+#   (replaces parsing the comma-joined workoutLogs.details string)
+tables['workoutLogExercises'] = {
+    'log_id': 'int NOT NULL',
+    'position': 'int NOT NULL',
+    'workout_id': 'int NOT NULL',
+    'sets': 'int',
+    'reps': 'int',
+    'weight': 'float',
+    'constraints': {
+        'FOREIGN KEY': [
+            ['log_id', 'workoutLogs(log_id)'],
+            ['workout_id', 'workouts(workout_id)']
+        ],
+        # Reading a log's plan in order, and counting how often an exercise was prescribed
+        'UNIQUE KEY': {
+            'workoutLogExercises_log_position': ['log_id', 'position']
+        },
+        'INDEX': {
+            'workoutLogExercises_workout': ['workout_id', 'log_id']
+        }
+    }
+}
+
+# One row per daily workout email, so a run that died part way can resume without sending twice
+#   status: 'sending' (claimed, not yet accepted by the mail server), 'sent' or 'failed'
+tables['emailDeliveries'] = {
+    'user_id': 'int NOT NULL',
+    'send_date': 'date NOT NULL',
+    'status': 'varchar(16) NOT NULL',
+    'error': 'varchar(255)',
+    'updated_at': 'timestamp DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP',
+    'constraints': {
+        'FOREIGN KEY': ['user_id', 'users(user_id)'],
+        'UNIQUE KEY': {
+            'emailDeliveries_user_date': ['user_id', 'send_date']
+        },
+        'INDEX': {
+            'emailDeliveries_date_status': ['send_date', 'status']
+        }
     }
 }
 
@@ -119,8 +202,10 @@ tables['userRelationship'] = {
     'user_second_id': 'int NOT NULL',
     'relationship_type': 'varchar(64) NOT NULL',
     'constraints': {
-        'FOREIGN KEY': ['user_first_id', 'users(user_id)'],
-        'FOREIGN KEY': ['user_second_id', 'users(user_id)'],
+        'FOREIGN KEY': [
+            ['user_first_id', 'users(user_id)'],
+            ['user_second_id', 'users(user_id)']
+        ]
     }
 }
 
@@ -131,16 +216,19 @@ tables['userPRs'] = {
     'time': 'float',
     'distance': 'float',
     'constraints': {
-        'FOREIGN KEY': ['user_id', 'users(user_id)'],
-        'FOREIGN KEY': ['workout_id', 'workouts(workout_id)']
+        'FOREIGN KEY': [
+            ['user_id', 'users(user_id)'],
+            ['workout_id', 'workouts(workout_id)']
+        ]
     }
 }
 
 
-# Drop all of the tables for debugging and configuration
-if DROP_ALL:
-    db_mgr.drop_tables(list(tables.keys())[::-1])
+if __name__ == "__main__":
+    # Drop all of the tables for debugging and configuration
+    if DROP_ALL:
+        db_mgr.drop_tables(list(tables.keys())[::-1])
 
-# Add the tables into the database
-for table_name, table_description in tables.items():
-    db_mgr.create_table(table_name, table_description)
+    # Add the tables into the database
+    for table_name, table_description in tables.items():
+        db_mgr.create_table(table_name, table_description)
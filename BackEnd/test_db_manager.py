@@ -0,0 +1,107 @@
+"""
+Filename: test_db_manager.py
+
+Purpose: Checks the DB_Manager query builders on an in-memory SQLite database: values only ever
+         travel as parameters, equal statement shapes share one template (and one prepared
+         statement per connection), keyset pages and transactions.
+         Run with: python -m unittest test_db_manager (or pytest) from BackEnd/
+
+Authors: Jordan Smith
+Group: Wholesome as Heck Programmers (WaHP)
+Last modified: 10/18/26
+"""
+import os
+import unittest
+
+# Never touch a real database from the tests
+os.environ["DB_BACKEND"] = "sqlite"
+os.environ["DB_NAME"] = ":memory:"
+
+from db_manager import db_mgr
+from table_manager import tables
+
+
+def setUpModule():
+    db_mgr.drop_tables(list(tables.keys())[::-1])
+    for table_name, table_description in tables.items():
+        db_mgr.create_table(table_name, table_description)
+
+
+# Adds a user and returns its user_id
+def add_user(name):
+    db_mgr.add_one_row("users", {"email": f"{name}@test.com", "username": name, "password": "x"})
+    return db_mgr.get_last_inserted_id()
+
+
+class TestQueryBuilders(unittest.TestCase):
+    def setUp(self):
+        db_mgr.delete_rows("emailDeliveries")
+        db_mgr.delete_rows("users")
+
+    def test_values_are_parameters(self):
+        name = "o'brien\"; DROP TABLE users; --"
+        user_id = add_user(name)
+        self.assertEqual(db_mgr.get_one_row("users", ["username"], {"user_id": user_id}), [name])
+        self.assertEqual(db_mgr.get_one_row("users", ["user_id"], {"username": name}), [user_id])
+        self.assertTrue(db_mgr.has_table("users"))
+
+    def test_equal_shapes_share_a_template(self):
+        first, first_params = db_mgr._generate_query("users", ["email"], {"user_id": 1})
+        second, second_params = db_mgr._generate_query("users", ["email"], {"user_id": 2})
+        self.assertIs(first, second)
+        self.assertNotIn("1", first)
+        self.assertEqual((first_params, second_params), ((1,), (2,)))
+
+    def test_prepared_statement_is_reused(self):
+        ids = [add_user(f"user{n}") for n in range(3)]
+        query, _ = db_mgr._generate_query("users", ["username"], {"user_id": ids[0]})
+
+        with db_mgr.connection() as cnx:
+            cursors = set()
+            for user_id in ids:
+                self.assertEqual(db_mgr.get_one_row("users", ["username"], {"user_id": user_id}),
+                                 [f"user{ids.index(user_id)}"])
+                cursors.add(id(db_mgr._statements[cnx][query]))
+        self.assertEqual(len(cursors), 1)
+
+    def test_keyset_pages(self):
+        ids = [add_user(f"page{n}") for n in range(5)]
+        first = db_mgr.get_all_rows("users", ["user_id"], key="user_id", limit=2)
+        rest = db_mgr.get_all_rows("users", ["user_id"], key="user_id", after=first[-1][0], limit=10)
+        self.assertEqual([row[0] for row in first + rest], ids)
+        self.assertEqual([row[0] for row in db_mgr.iter_rows("users", ["user_id"], key="user_id", after=ids[2])],
+                         ids[3:])
+
+    def test_upsert_updates_the_existing_row(self):
+        user_id = add_user("upsert")
+        key = ["user_id", "send_date"]
+        self.assertTrue(db_mgr.upsert_rows("emailDeliveries", [{"user_id": user_id, "send_date": "2026-10-18",
+                                                                 "status": "sending"}], key))
+        self.assertTrue(db_mgr.upsert_rows("emailDeliveries", [{"user_id": user_id, "send_date": "2026-10-18",
+                                                                 "status": "sent"}], key))
+        self.assertEqual(db_mgr.get_all_rows("emailDeliveries", ["status"], {"user_id": user_id}), [("sent",)])
+
+
+class TestTransactions(unittest.TestCase):
+    def setUp(self):
+        db_mgr.delete_rows("emailDeliveries")
+        db_mgr.delete_rows("users")
+
+    def test_rolls_back_on_error(self):
+        with self.assertRaises(RuntimeError):
+            with db_mgr.transaction():
+                add_user("kept")
+                with db_mgr.transaction():
+                    add_user("nested")
+                raise RuntimeError("undo")
+        self.assertEqual(db_mgr.get_all_rows("users", ["user_id"]), [])
+
+    def test_commits_when_done(self):
+        with db_mgr.transaction():
+            add_user("first")
+            add_user("second")
+        self.assertEqual(len(db_mgr.get_all_rows("users", ["user_id"])), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
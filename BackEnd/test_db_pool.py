@@ -0,0 +1,118 @@
+"""
+Filename: test_db_pool.py
+
+Purpose: Checks the ConnectionPool's checkout rules with stand-in connections: re-entrant
+         checkouts per thread, the size limit and timeout, waking a waiting thread as soon as a
+         connection comes back, and freeing the slot of a broken connection.
+         Run with: python -m unittest test_db_pool (or pytest) from BackEnd/
+
+Authors: Jordan Smith
+Group: Wholesome as Heck Programmers (WaHP)
+Last modified: 10/18/26
+"""
+import threading
+import time
+import unittest
+from db_pool import ConnectionPool, PoolTimeoutError
+
+
+"""
+FakeConnection:
+Stands in for a database connection, remembering if it was closed
+"""
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.alive = True
+
+    def close(self):
+        self.closed = True
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.opened = []
+        self.pool = ConnectionPool(self.connect, size=2, timeout=0.2, ping=lambda cnx: cnx.alive)
+
+    def connect(self):
+        cnx = FakeConnection()
+        self.opened.append(cnx)
+        return cnx
+
+    def test_nested_blocks_reuse_the_connection(self):
+        with self.pool.connection() as outer:
+            self.assertTrue(self.pool.is_held())
+            with self.pool.connection() as inner:
+                self.assertIs(inner, outer)
+            self.assertTrue(self.pool.is_held())
+        self.assertFalse(self.pool.is_held())
+        self.assertEqual(len(self.opened), 1)
+        self.assertEqual(self.pool.stats()["idle"], 1)
+
+    def test_idle_connections_are_reused(self):
+        with self.pool.connection() as first:
+            pass
+        with self.pool.connection() as second:
+            self.assertIs(second, first)
+        self.assertEqual(self.pool.stats()["checkouts"], 2)
+
+    def test_never_opens_more_than_size(self):
+        first = self.pool.acquire()
+        second = self.pool.acquire()
+        start = time.perf_counter()
+        with self.assertRaises(PoolTimeoutError):
+            self.pool.acquire()
+        self.assertGreaterEqual(time.perf_counter() - start, 0.2)
+        self.assertEqual(len(self.opened), 2)
+        self.assertEqual(self.pool.stats()["timeouts"], 1)
+        self.pool.release(first)
+        self.pool.release(second)
+
+    def test_waiting_thread_gets_the_returned_connection(self):
+        self.pool.timeout = 5
+        first = self.pool.acquire()
+        second = self.pool.acquire()
+        got = []
+        waiter = threading.Thread(target=lambda: got.append(self.pool.acquire()))
+        waiter.start()
+
+        time.sleep(0.05)
+        self.pool.release(first)
+        waiter.join(1)
+        self.assertFalse(waiter.is_alive())
+        self.assertEqual(got, [first])
+        self.assertEqual(self.pool.stats()["waits"], 1)
+        self.pool.release(second)
+        self.pool.release(first)
+
+    def test_broken_connection_frees_its_slot(self):
+        with self.assertRaises(RuntimeError):
+            with self.pool.connection() as cnx:
+                cnx.alive = False
+                raise RuntimeError("connection lost")
+        self.assertTrue(cnx.closed)
+        self.assertEqual(self.pool.stats()["open"], 0)
+
+        with self.pool.connection() as replacement:
+            self.assertIsNot(replacement, cnx)
+
+    def test_error_on_a_live_connection_keeps_it(self):
+        with self.assertRaises(RuntimeError):
+            with self.pool.connection() as cnx:
+                raise RuntimeError("bad query")
+        self.assertFalse(cnx.closed)
+        self.assertEqual(self.pool.stats()["idle"], 1)
+
+    def test_failed_connect_frees_its_slot(self):
+        pool = ConnectionPool(self.fail_connect, size=1, timeout=0.1)
+        for _ in range(2):
+            with self.assertRaises(ConnectionError):
+                pool.acquire()
+        self.assertEqual(pool.stats()["open"], 0)
+
+    def fail_connect(self):
+        raise ConnectionError("server is down")
+
+
+if __name__ == "__main__":
+    unittest.main()
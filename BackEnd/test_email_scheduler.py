@@ -0,0 +1,134 @@
+"""
+Filename: test_email_scheduler.py
+
+Purpose: Checks the delivery ledger (each user is emailed at most once a day, failures are
+         retried) and the DeliveryScheduler's heap (send days and times, no burst of past-day
+         emails) on an in-memory SQLite database. No mail is sent, get_user is replaced.
+         Run with: python -m unittest test_email_scheduler (or pytest) from BackEnd/
+
+Authors: Jordan Smith
+Group: Wholesome as Heck Programmers (WaHP)
+Last modified: 10/18/26
+"""
+import os
+import unittest
+from datetime import datetime
+from unittest import mock
+
+# Never touch a real database from the tests
+os.environ["DB_BACKEND"] = "sqlite"
+os.environ["DB_NAME"] = ":memory:"
+
+import email_scheduler
+from db_manager import db_mgr
+from email_scheduler import DeliveryScheduler, claim, next_due, record, send_days
+from table_manager import tables
+
+SEND_DATE = "2026-10-18"
+
+
+def setUpModule():
+    db_mgr.drop_tables(list(tables.keys())[::-1])
+    for table_name, table_description in tables.items():
+        db_mgr.create_table(table_name, table_description)
+
+
+# Clears the users and ledger, then adds users with the given settings and returns their ids
+def reset_users(*settings):
+    db_mgr.delete_rows("emailDeliveries")
+    db_mgr.delete_rows("users")
+    user_ids = []
+    for count, values in enumerate(settings):
+        db_mgr.add_one_row("users", {"email": f"user{count}@test.com", "username": f"user{count}",
+                                     "password": "x", **values})
+        user_ids.append(db_mgr.get_last_inserted_id())
+    return user_ids
+
+
+class TestLedger(unittest.TestCase):
+    def setUp(self):
+        self.user_id, = reset_users({})
+
+    def test_claimed_once(self):
+        self.assertTrue(claim(self.user_id, SEND_DATE))
+        self.assertFalse(claim(self.user_id, SEND_DATE))
+        record(self.user_id, SEND_DATE, "sent")
+        self.assertFalse(claim(self.user_id, SEND_DATE))
+
+    def test_failed_email_is_claimed_again(self):
+        self.assertTrue(claim(self.user_id, SEND_DATE))
+        record(self.user_id, SEND_DATE, "failed", "Bad Email")
+        self.assertTrue(claim(self.user_id, SEND_DATE))
+        self.assertFalse(claim(self.user_id, SEND_DATE))
+
+    def test_other_days_are_separate(self):
+        self.assertTrue(claim(self.user_id, SEND_DATE))
+        self.assertTrue(claim(self.user_id, "2026-10-19"))
+
+    def test_run_again_only_retries_failures(self):
+        good, bad = reset_users({}, {})
+
+        def get_user(user_id):
+            if user_id == bad:
+                raise ValueError("Bad Email")
+
+        with mock.patch.object(email_scheduler, "get_user", side_effect=get_user) as sender:
+            first = email_scheduler.get_users(SEND_DATE)
+            self.assertEqual((first["sent"], list(first["failed"])), (1, [bad]))
+
+            second = email_scheduler.get_users(SEND_DATE)
+            self.assertEqual((second["sent"], second["skipped"], list(second["failed"])), (0, 0, [bad]))
+            self.assertEqual([call.args[0] for call in sender.call_args_list].count(good), 1)
+
+
+class TestSchedule(unittest.TestCase):
+    def test_send_days(self):
+        for days_per_week in range(1, 7):
+            self.assertEqual(len(send_days(5, days_per_week)), days_per_week)
+        self.assertEqual(send_days(5, None), frozenset(range(7)))
+        self.assertEqual(send_days(5, 9), frozenset(range(7)))
+
+    def test_next_due_is_strictly_after(self):
+        every_day = frozenset(range(7))
+        nine = 9 * 3600
+        self.assertEqual(next_due(every_day, nine, datetime(2026, 10, 18, 8, 0)), datetime(2026, 10, 18, 9, 0))
+        self.assertEqual(next_due(every_day, nine, datetime(2026, 10, 18, 9, 0)), datetime(2026, 10, 19, 9, 0))
+        # 2026-10-18 is a sunday, the next monday is the 19th
+        self.assertEqual(next_due(frozenset([0]), nine, datetime(2026, 10, 18, 10, 0)), datetime(2026, 10, 19, 9, 0))
+
+    def test_due_users_in_order(self):
+        early, late, _ = reset_users({"email_time": "07:00"}, {"email_time": "09:30"},
+                                     {"email_time": "08:00", "wants_emails": False})
+        scheduler = DeliveryScheduler(rate=0)
+        scheduler.refresh(now=datetime(2026, 10, 18, 6, 0))
+
+        self.assertEqual(scheduler.next_wakeup(), datetime(2026, 10, 18, 7, 0))
+        self.assertEqual(scheduler.pop_due(datetime(2026, 10, 18, 8, 0)), [(datetime(2026, 10, 18, 7, 0), early)])
+        self.assertEqual(scheduler.pop_due(datetime(2026, 10, 18, 10, 0)), [(datetime(2026, 10, 18, 9, 30), late)])
+        self.assertEqual(scheduler.next_wakeup(), datetime(2026, 10, 19, 7, 0))
+
+    def test_new_user_gets_no_past_days(self):
+        user_id, = reset_users({"email_time": "07:00"})
+        scheduler = DeliveryScheduler(rate=0)
+        now = datetime(2026, 10, 18, 12, 0)
+        scheduler.refresh(now=now)
+        self.assertEqual(scheduler.pop_due(now), [(datetime(2026, 10, 18, 7, 0), user_id)])
+
+        # The process stalls for a few days: only the current day's email goes out
+        later = datetime(2026, 10, 21, 12, 0)
+        self.assertEqual(scheduler.pop_due(later), [(datetime(2026, 10, 21, 7, 0), user_id)])
+
+    def test_refresh_keeps_handled_emails(self):
+        user_id, = reset_users({"email_time": "07:00"})
+        scheduler = DeliveryScheduler(rate=0)
+        now = datetime(2026, 10, 18, 12, 0)
+        scheduler.refresh(now=now)
+        scheduler.pop_due(now)
+
+        scheduler.refresh(now=now)
+        self.assertEqual(scheduler.pop_due(now), [])
+        self.assertEqual(scheduler.next_wakeup(), datetime(2026, 10, 19, 7, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
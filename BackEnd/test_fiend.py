@@ -0,0 +1,86 @@
+"""
+Filename: test_fiend.py
+
+Purpose: Checks the closed form xp math in Fiend_Skeleton against the level-by-level loop it
+         replaced, and that fiends evolve once per evolution level but never past their last form.
+         Run with: python -m unittest test_fiend (or pytest) from BackEnd/
+
+Authors: Jordan Smith
+Group: Wholesome as Heck Programmers (WaHP)
+Last modified: 10/18/26
+"""
+import unittest
+from Fiend_Skeleton import Fiend, Level, bestiary, capFor, evolutionStage, grantXP, totalCap
+
+
+# The original Level.incrementXP loop, without the printing and sleeping
+def loopXP(level, xp, xpCap, value):
+    xp += value
+    while xp >= xpCap:
+        level += 1
+        xp -= xpCap
+        xpCap = (4 * level ** 3) // 5
+    return level, xp, xpCap
+
+
+class TestGrantXP(unittest.TestCase):
+    def test_total_cap_matches_sum(self):
+        for n in range(0, 200):
+            self.assertEqual(totalCap(n), sum(capFor(k) for k in range(1, n + 1)), n)
+
+    def test_matches_loop_from_starting_cap(self):
+        # A new Level has a cap of 3 instead of capFor(1)
+        for value in range(0, 5000, 7):
+            grant = grantXP(1, 0, 3, value)
+            self.assertEqual((grant.level, grant.xp, grant.xpCap), loopXP(1, 0, 3, value), value)
+
+    def test_matches_loop_over_grid(self):
+        values = [0, 1, 2, 3, 10, 99, 100, 101, 1000, 12345, 10 ** 6]
+        for level in range(1, 61):
+            cap = capFor(level)
+            for xp in sorted({0, 1, cap // 2, max(cap - 1, 0)}):
+                for value in values:
+                    grant = grantXP(level, xp, cap, value)
+                    expected = loopXP(level, xp, cap, value)
+                    self.assertEqual((grant.level, grant.xp, grant.xpCap), expected, (level, xp, value))
+                    self.assertEqual(grant.levelsGained, expected[0] - level)
+                    self.assertEqual(grant.evolutions, evolutionStage(expected[0]) - evolutionStage(level))
+
+    def test_level_increment_matches_loop(self):
+        level = Level(3, capFor(3), 5)
+        gained = level.incrementXP(2500)
+        expected = loopXP(3, 5, capFor(3), 2500)
+        self.assertEqual((level.value, level.xp, level.xpCap), expected)
+        self.assertEqual(gained, expected[0] - 3)
+
+
+class TestEvolution(unittest.TestCase):
+    def test_evolves_once_per_evolution_level(self):
+        fiend = Fiend(level=4)
+        fiend.level.xpCap = capFor(4)
+        fiend.updateXP(totalCap(13) - totalCap(3))
+        self.assertEqual(fiend.tellLevel(), 14)
+        self.assertEqual(fiend.id, "KM03")
+
+    def test_stops_at_last_form(self):
+        last = max(bestiary)
+        fiend = Fiend(species_id="KM06", level=29)
+        fiend.level.xpCap = capFor(29)
+        fiend.updateXP(10 ** 7)
+        self.assertGreater(evolutionStage(fiend.tellLevel()), 7)
+        self.assertEqual(fiend.id, "KM" + last)
+
+        fiend.updateXP(10 ** 7)
+        self.assertEqual(fiend.id, "KM" + last)
+        fiend.transform()
+        self.assertEqual(fiend.id, "KM" + last)
+
+    def test_no_evolution_without_passing_a_level(self):
+        fiend = Fiend(level=5)
+        fiend.level.xpCap = capFor(5)
+        fiend.updateXP(1)
+        self.assertEqual(fiend.id, "KM01")
+
+
+if __name__ == "__main__":
+    unittest.main()
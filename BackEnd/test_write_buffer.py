@@ -0,0 +1,135 @@
+"""
+Filename: test_write_buffer.py
+
+Purpose: Checks the write-behind buffer on an in-memory SQLite database: changes to a row are
+         coalesced and read back through overlay() before they are written, a flush writes them
+         with one statement, a thread holding a connection never flushes, and a failed flush keeps
+         the rows without overwriting newer changes.
+         Run with: python -m unittest test_write_buffer (or pytest) from BackEnd/
+
+Authors: Jordan Smith
+Group: Wholesome as Heck Programmers (WaHP)
+Last modified: 10/18/26
+"""
+import os
+import unittest
+from unittest import mock
+
+# Never touch a real database from the tests
+os.environ["DB_BACKEND"] = "sqlite"
+os.environ["DB_NAME"] = ":memory:"
+
+import write_buffer as write_buffer_module
+from db_manager import db_mgr
+from table_manager import tables
+from write_buffer import WriteBuffer, update_case_statement
+
+
+def setUpModule():
+    db_mgr.drop_tables(list(tables.keys())[::-1])
+    for table_name, table_description in tables.items():
+        db_mgr.create_table(table_name, table_description)
+
+
+# Reads a user's login streak and height straight from the database
+def stored(user_id):
+    return db_mgr.get_one_row("users", ["login_streak", "height"], {"user_id": user_id})
+
+
+class TestWriteBuffer(unittest.TestCase):
+    def setUp(self):
+        db_mgr.delete_rows("emailDeliveries")
+        db_mgr.delete_rows("users")
+        self.user_ids = []
+        for count in range(3):
+            db_mgr.add_one_row("users", {"email": f"buffer{count}@test.com", "username": f"buffer{count}",
+                                         "password": "x"})
+            self.user_ids.append(db_mgr.get_last_inserted_id())
+        # A long interval so only the tests flush
+        self.buffer = WriteBuffer(enabled=True, interval=3600, max_rows=1000)
+
+    def tearDown(self):
+        self.buffer.close()
+
+    def test_changes_are_coalesced_until_flushed(self):
+        user_id = self.user_ids[0]
+        self.buffer.set("users", "user_id", user_id, {"login_streak": 2})
+        self.buffer.set("users", "user_id", user_id, {"login_streak": 3, "height": 1.5})
+
+        self.assertEqual(stored(user_id), [1, None])
+        row = self.buffer.overlay("users", "user_id", user_id, {"login_streak": 1, "username": "buffer0"})
+        self.assertEqual(row, {"login_streak": 3, "username": "buffer0"})
+
+        self.assertTrue(self.buffer.flush())
+        self.assertEqual(stored(user_id), [3, 1.5])
+        stats = self.buffer.stats()
+        self.assertEqual((stats["updates"], stats["coalesced"], stats["pending_rows"]), (2, 1, 0))
+
+    def test_one_statement_per_table(self):
+        for count, user_id in enumerate(self.user_ids):
+            self.buffer.set("users", "user_id", user_id, {"login_streak": 10 + count})
+
+        with mock.patch.object(write_buffer_module.db_mgr, "submit_statement",
+                               wraps=db_mgr.submit_statement) as submit:
+            self.assertTrue(self.buffer.flush("users"))
+        self.assertEqual(submit.call_count, 1)
+        self.assertEqual([stored(user_id)[0] for user_id in self.user_ids], [10, 11, 12])
+        self.assertEqual(self.buffer.stats()["rows_written"], 3)
+
+    def test_no_flush_while_holding_a_connection(self):
+        user_id = self.user_ids[0]
+        self.buffer.set("users", "user_id", user_id, {"login_streak": 5})
+        with db_mgr.transaction():
+            self.assertFalse(self.buffer.flush())
+            self.assertEqual(self.buffer.stats()["pending_rows"], 1)
+
+        self.assertTrue(self.buffer.flush())
+        self.assertEqual(stored(user_id)[0], 5)
+
+    def test_empty_flush_does_nothing(self):
+        with mock.patch.object(write_buffer_module.db_mgr, "submit_statement") as submit:
+            with db_mgr.transaction():
+                self.assertTrue(self.buffer.flush())
+        submit.assert_not_called()
+
+    def test_failed_flush_keeps_newer_changes(self):
+        user_id = self.user_ids[0]
+        self.buffer.set("users", "user_id", user_id, {"login_streak": 4, "height": 1.0})
+
+        # A newer change arrives while the failing write is running
+        def fail(sql, params):
+            self.buffer.set("users", "user_id", user_id, {"login_streak": 6})
+            return False
+
+        with mock.patch.object(write_buffer_module.db_mgr, "submit_statement", side_effect=fail):
+            self.assertFalse(self.buffer.flush())
+        self.assertEqual(self.buffer.stats()["failures"], 1)
+        self.assertEqual(self.buffer.overlay("users", "user_id", user_id, {"login_streak": 1, "height": None}),
+                         {"login_streak": 6, "height": 1.0})
+
+        self.assertTrue(self.buffer.flush())
+        self.assertEqual(stored(user_id), [6, 1.0])
+
+    def test_disabled_buffer_writes_straight_away(self):
+        buffer = WriteBuffer(enabled=False)
+        self.assertTrue(buffer.set("users", "user_id", self.user_ids[1], {"login_streak": 9}))
+        self.assertEqual(stored(self.user_ids[1])[0], 9)
+
+    def test_close_writes_what_is_left(self):
+        self.buffer.set("users", "user_id", self.user_ids[2], {"login_streak": 7})
+        self.assertTrue(self.buffer.close())
+        self.assertEqual(stored(self.user_ids[2])[0], 7)
+
+
+class TestUpdateCaseStatement(unittest.TestCase):
+    def test_rows_may_set_different_columns(self):
+        sql, params = update_case_statement("users", "user_id", {1: {"height": 1.5}, 2: {"height": 2.0, "weight": 80}})
+        self.assertEqual(sql, "UPDATE `users` SET "
+                              "`height` = CASE `user_id` WHEN %s THEN %s WHEN %s THEN %s ELSE `height` END, "
+                              "`weight` = CASE `user_id` WHEN %s THEN %s ELSE `weight` END "
+                              "WHERE `user_id` IN (%s,%s)")
+        self.assertEqual(params, [1, 1.5, 2, 2.0, 2, 80, 1, 2])
+
+
+if __name__ == "__main__":
+    unittest.main()
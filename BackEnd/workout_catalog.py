@@ -0,0 +1,164 @@
+"""
+Filename: workout_catalog.py
+
+Purpose: An in-process copy of the workouts table. The table is reference data that only changes
+         when workout_data.py reloads it, so it is read once and kept in memory, indexed by
+         workout_id and by (type, is_priority, difficulty, equipment). Plan building, plan display
+         and the daily email all look workouts up here instead of querying the database.
+
+Authors: Jordan Smith
+Group: Wholesome as Heck Programmers (WaHP)
+Last modified: 10/18/26
+"""
+import threading
+import time
+from collections import namedtuple
+from os import getenv
+from db_manager import db_mgr
+
+# Seconds before the catalog re-reads the workouts table on its own, so a reload done by another
+#   process (workout_data.py) is picked up. 0 keeps the catalog until refresh() is called.
+WORKOUT_CATALOG_TTL = float(getenv("WORKOUT_CATALOG_TTL", 600))
+
+# The workouts columns kept in the catalog, in table order
+WORKOUT_COLUMNS = ("workout_id", "type", "name", "equipment", "difficulty", "is_priority")
+
+# One row of the workouts table. Still a tuple, so row[0] is the workout_id like a database row
+WorkoutRow = namedtuple("WorkoutRow", WORKOUT_COLUMNS)
+
+
+"""
+WorkoutCatalog:
+Thread-safe, lazily loaded copy of the workouts table
+"""
+class WorkoutCatalog:
+    """
+    Initialization function
+
+    @params: db (DB_Manager) - The database manager to load the workouts from
+             max_age (float, optional) - Seconds before the catalog reloads itself (0 to never)
+    """
+    def __init__(self, db, max_age=WORKOUT_CATALOG_TTL):
+        self.db = db
+        self.max_age = max_age
+
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._by_id = None
+        self._by_key = {}
+        self._by_type = {}
+        self._loaded_at = 0.0
+
+        # Bumped on every (re)load so derived caches know when to throw their entries away
+        self.version = 0
+
+    """
+    Function to (re)load the catalog from the database
+
+    @params: None
+    @returns: The number of workouts loaded, or False if the workouts could not be read
+    """
+    def refresh(self):
+        rows = self.db.get_all_rows("workouts", list(WORKOUT_COLUMNS))
+        if rows is False:
+            return False
+
+        by_id = {}
+        by_key = {}
+        by_type = {}
+        # Sorted by id so lookups return workouts in the same order the table scan did
+        for row in sorted(rows, key=lambda row: row[0]):
+            workout = WorkoutRow(row[0], row[1], row[2], row[3], row[4], bool(row[5]))
+            by_id[workout.workout_id] = workout
+            by_key.setdefault(self._key(workout), []).append(workout)
+            by_type.setdefault((workout.type, workout.is_priority), []).append(workout)
+
+        with self._lock:
+            self._by_id = by_id
+            self._by_key = by_key
+            self._by_type = by_type
+            self._loaded_at = time.monotonic()
+            self.version += 1
+
+        return len(by_id)
+
+    """
+    Function to get a workout by its id
+
+    @params: workout_id (int) - The id of the workout
+    @returns: The WorkoutRow, or None if there is no workout with that id
+    """
+    def get(self, workout_id):
+        self._ensure_loaded()
+        try:
+            return (self._by_id or {}).get(int(workout_id))
+        except (TypeError, ValueError):
+            return None
+
+    """
+    Function to find the workouts of a muscle group.
+    Options left as None match any value.
+
+    @params: workout_type (str) - The muscle group (ie, Chest)
+             is_priority (bool, optional) - Only priority (True) or non-priority (False) workouts
+             difficulty (str, optional) - Only workouts of this difficulty (easy, moderate, hard)
+             equipment (str, optional) - Only workouts that need exactly this equipment
+    @returns: A list of WorkoutRows ordered by workout_id
+    """
+    def find(self, workout_type, is_priority=None, difficulty=None, equipment=None):
+        self._ensure_loaded()
+
+        if None not in (is_priority, difficulty, equipment):
+            return list(self._by_key.get((workout_type, bool(is_priority), difficulty, equipment), []))
+
+        priorities = (True, False) if is_priority is None else (bool(is_priority),)
+        workouts = []
+        for priority in priorities:
+            workouts.extend(self._by_type.get((workout_type, priority), []))
+        if is_priority is None:
+            workouts.sort(key=lambda workout: workout.workout_id)
+
+        return [workout for workout in workouts
+                if (difficulty is None or workout.difficulty == difficulty)
+                and (equipment is None or workout.equipment == equipment)]
+
+    """
+    Function to get the number of workouts in the catalog
+
+    @params: None
+    @returns: The number of workouts
+    """
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self._by_id or {})
+
+    """
+    Private function to load the catalog on first use, or reload it once it is too old
+
+    @params: None
+    @returns: None
+    """
+    def _ensure_loaded(self):
+        if not self._is_stale():
+            return
+
+        with self._load_lock:
+            # Another thread may have loaded it while this one waited. If the table can't be
+            #   read the catalog stays empty and the next lookup tries again
+            if self._is_stale():
+                self.refresh()
+
+    # Checks if the catalog has not been loaded yet or has outlived its max age
+    def _is_stale(self):
+        if self._by_id is None:
+            return True
+        return bool(self.max_age) and time.monotonic() - self._loaded_at >= self.max_age
+
+    # Gets the (type, is_priority, difficulty, equipment) index key of a workout
+    @staticmethod
+    def _key(workout):
+        return (workout.type, workout.is_priority, workout.difficulty, workout.equipment)
+
+
+# The catalog used by the rest of the backend
+workout_catalog = WorkoutCatalog(db_mgr)
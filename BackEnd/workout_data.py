@@ -8,7 +8,9 @@ Group: Wholesome as Heck Programmers (WaHP)
 Last modified: 11/13/21
 """
 from db_manager import db_mgr
+from workout_catalog import workout_catalog
 import csv
+import sys
 
 # Boolean to delete data from the workouts table
 # Useful for debugging and initially setting up
@@ -54,10 +56,21 @@ with open("workout_data.csv", newline="") as csv_data:
         print(f"Converted data from row {len(data_to_insert)}")
 
 # For debugging, deletes all rows from the workouts table
-if DELETE_DATA:
-    db_mgr.delete_rows('workouts')
+# Once plans have been made the workout log exercises reference the workouts, so the delete
+#   fails. Stop then, loading the csv again would only add a second copy of every workout.
+if DELETE_DATA and not db_mgr.delete_rows('workouts'):
+    print("Workouts could not be deleted (workout logs still use them), the workout data was not reloaded")
+    sys.exit(1)
 
-# Insert the data into the workouts table 
-res = db_mgr.add_many_rows('workouts', data_to_insert)
+existing = db_mgr.submit_query("SELECT COUNT(*) FROM workouts")
+if existing is False or existing[0][0] > 0:
+    print("The workouts table already has data, the workout data was not loaded again")
+    sys.exit(1)
+
+# Insert the data into the workouts table (in multi-row chunks instead of one row at a time)
+res = db_mgr.bulk_insert('workouts', data_to_insert)
 if res:
-    print("Inserted data into database successfully!")
\ No newline at end of file
+    print(f"Inserted data into database successfully! ({res['rows_per_second']:.0f} rows/s)")
+
+# Reload the in-memory workout catalog so it matches the new data
+workout_catalog.refresh()
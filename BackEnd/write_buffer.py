@@ -0,0 +1,255 @@
+"""
+Filename: write_buffer.py
+
+Purpose: An optional write-behind buffer for small, frequently written columns (monster
+         levels and exp, quiz status). Instead of an UPDATE (and a commit) per change, the
+         newest value of each (table, key) is kept in memory and all of them are written
+         with one UPDATE ... CASE statement per table every few seconds, when enough rows
+         are waiting, and at shutdown. Reads in this process see the buffered values.
+
+Authors: Jordan Smith
+Group: Wholesome as Heck Programmers (WaHP)
+Last modified: 10/18/26
+"""
+import atexit
+import threading
+from os import getenv
+from db_manager import db_mgr
+
+# Whether changes are buffered at all. Off, every set() is written straight away.
+WRITE_BEHIND = getenv("WRITE_BEHIND", "false").lower() in ("1", "true")
+
+# Seconds between flushes, and how many buffered rows trigger a flush early
+WRITE_BEHIND_INTERVAL = float(getenv("WRITE_BEHIND_INTERVAL", 2))
+WRITE_BEHIND_MAX_ROWS = int(getenv("WRITE_BEHIND_MAX_ROWS", 500))
+
+
+"""
+WriteBuffer:
+Coalesces column updates per (table, key) and writes them in bulk from a background thread
+"""
+class WriteBuffer:
+    """
+    Initialization function
+
+    @params: enabled (bool, optional) - Whether to buffer changes or write them straight away
+             interval (float, optional) - The most seconds a change waits before it is written
+             max_rows (int, optional) - How many buffered rows start a flush before the interval is up
+    """
+    def __init__(self, enabled=WRITE_BEHIND, interval=WRITE_BEHIND_INTERVAL, max_rows=WRITE_BEHIND_MAX_ROWS):
+        self.enabled = enabled
+        self.interval = interval
+        self.max_rows = max_rows
+
+        # (table, key column) -> {key: {column: value}}
+        self._pending = {}
+        # The rows of the flush that is running, still read until they are written
+        self._flushing = {}
+        self._rows = 0
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._closed = False
+
+        self.updates = 0
+        self.coalesced = 0
+        self.flushes = 0
+        self.rows_written = 0
+        self.failures = 0
+
+        atexit.register(self.close)
+
+    """
+    Function to set columns of one row, buffered if the buffer is enabled
+
+    @params: table_name (str) - The table the row is in
+             key_column (str) - The column that identifies the row, ie "user_id"
+             key - The row's value in the key column
+             values (dict) - The columns to set and their new values
+    @returns: True if the change was buffered or written, false otherwise
+    """
+    def set(self, table_name, key_column, key, values):
+        if not self.enabled or self._closed:
+            return db_mgr.update_rows(table_name, values, where_options={key_column: key})
+
+        with self._lock:
+            rows = self._pending.setdefault((table_name, key_column), {})
+            row = rows.get(key)
+            if row is None:
+                row = rows[key] = {}
+                self._rows += 1
+            else:
+                self.coalesced += 1
+            row.update(values)
+            self.updates += 1
+            full = self._rows >= self.max_rows
+
+        self._start()
+        if full:
+            self._wake.set()
+        return True
+
+    """
+    Function to apply the buffered changes of a row to a row read from the database
+    (only the columns the row has are changed)
+
+    @params: table_name (str) - The table the row is from
+             key_column (str) - The column that identifies the row
+             key - The row's value in the key column
+             row (dict) - The row as read from the database
+    @returns: The row with the buffered values in it
+    """
+    def overlay(self, table_name, key_column, key, row):
+        with self._lock:
+            changes = {**self._flushing.get((table_name, key_column), {}).get(key, {}),
+                       **self._pending.get((table_name, key_column), {}).get(key, {})}
+
+        for column, value in changes.items():
+            if column in row:
+                row[column] = value
+        return row
+
+    """
+    Function to write the buffered changes to the database
+    A table's rows are written with one statement. If it fails they are buffered again,
+    under any newer changes to them.
+    A thread that holds a connection can't flush: the connection may be in a transaction that
+    is rolled back later (taking the written rows with it), and waiting on a second connection
+    could deadlock. Its changes stay buffered for the flushing thread.
+
+    @params: table_name (str, optional) - Only write this table's changes
+    @returns: True if every change was written, false otherwise
+    """
+    def flush(self, table_name=None):
+        if not self._has_pending(table_name):
+            return True
+        if db_mgr.pool is not None and db_mgr.pool.is_held():
+            return False
+
+        with self._flush_lock:
+            with self._lock:
+                for table_key in list(self._pending):
+                    if table_name is None or table_key[0] == table_name:
+                        rows = self._pending.pop(table_key)
+                        self._rows -= len(rows)
+                        self._flushing[table_key] = rows
+                batches = list(self._flushing.items())
+
+            if not batches:
+                return True
+
+            success = True
+            for (table, key_column), rows in batches:
+                sql, params = update_case_statement(table, key_column, rows)
+                written = db_mgr.submit_statement(sql, params)
+
+                with self._lock:
+                    del self._flushing[(table, key_column)]
+                    if written is False:
+                        success = False
+                        self.failures += 1
+                        pending = self._pending.setdefault((table, key_column), {})
+                        for key, values in rows.items():
+                            if key not in pending:
+                                self._rows += 1
+                            pending[key] = {**values, **pending.get(key, {})}
+                    else:
+                        self.flushes += 1
+                        self.rows_written += len(rows)
+            return success
+
+    """
+    Function to stop the background thread and write everything that is still buffered
+    (run automatically when the process exits)
+
+    @params: None
+    @returns: True if every change was written, false otherwise
+    """
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(self.interval + 5)
+        return self.flush()
+
+    """
+    Function to get the buffer's counts
+
+    @params: None
+    @returns: A dictionary of whether the buffer is on, buffered rows, updates, coalesced updates, flushes, rows written and failed flushes
+    """
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "pending_rows": self._rows,
+                "updates": self.updates,
+                "coalesced": self.coalesced,
+                "flushes": self.flushes,
+                "rows_written": self.rows_written,
+                "failures": self.failures
+            }
+
+    """
+    Private function to check if there is anything to flush (without waiting on a running flush)
+
+    @params: table_name (str, optional) - Only check this table's changes
+    @returns: True if changes are buffered or being written, false otherwise
+    """
+    def _has_pending(self, table_name=None):
+        with self._lock:
+            return any(table_name is None or table_key[0] == table_name
+                       for table_key in list(self._pending) + list(self._flushing))
+
+    """
+    Private function to start the flushing thread the first time something is buffered
+
+    @params: None
+    @returns: None
+    """
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="write-buffer", daemon=True)
+                self._thread.start()
+
+    """
+    Private function run by the flushing thread: flush every interval, or sooner when woken up
+
+    @params: None
+    @returns: None
+    """
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if not self._closed:
+                self.flush()
+
+"""
+Function to build one UPDATE that sets the given columns of many rows
+
+@params: table_name (str) - The table to update
+         key_column (str) - The column that identifies the rows
+         rows (dict) - {key: {column: value}}, rows don't need to set the same columns
+@returns: A tuple of the statement and its params
+"""
+def update_case_statement(table_name, key_column, rows):
+    columns = sorted(set(column for values in rows.values() for column in values))
+
+    assignments = []
+    params = []
+    for column in columns:
+        keys = [key for key, values in rows.items() if column in values]
+        assignments.append(f"`{column}` = CASE `{key_column}` {' '.join(['WHEN %s THEN %s'] * len(keys))} ELSE `{column}` END")
+        for key in keys:
+            params += [key, rows[key][column]]
+
+    sql = f"UPDATE `{table_name}` SET {', '.join(assignments)} WHERE `{key_column}` IN ({','.join(['%s'] * len(rows))})"
+    return sql, params + list(rows)
+
+write_buffer = WriteBuffer()
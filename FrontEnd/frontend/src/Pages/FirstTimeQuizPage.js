@@ -18,11 +18,11 @@ function FirstTimeQuizPage() {
   // used to forcefully navigate the user between pages
   const navigate = useNavigate();
   // the user token, used to determine valid login. Decoding is gated behind vaidation of the token existance, so that the website navigates cleanly if they attempt to illegally access the page.
-  let usertoken = localStorage.getItem("id_token");
-  let user_id;
+  // the raw token is sent to the backend, which verifies it and gets the user id from it
+  const rawToken = localStorage.getItem("id_token");
+  let usertoken = rawToken;
   if (usertoken) {
     usertoken = jwtDecode(usertoken);
-    user_id = usertoken.user_id;
   }
 
   // these states are used to track the choices the user makes, and send them to the backend
@@ -53,10 +53,13 @@ function FirstTimeQuizPage() {
   function SubmitResults() {
     const quizResults = {
       method: "POST",
-      headers: { "Content-Type": "application/json", Contents: "request" },
-      // packages the user results. Include user_id;
+      headers: {
+        "Content-Type": "application/json",
+        Contents: "request",
+        user_token: rawToken,
+      },
+      // packages the user results. The user comes from the token
       body: JSON.stringify({
-        user_id: user_id,
         quiz_results: { species, experience, daysPerWeek, availableEquipment },
       }),
     };
@@ -80,7 +83,7 @@ function FirstTimeQuizPage() {
           method: "GET",
           headers: {
             "Content-Type": "application/json",
-            user_token: user_id,
+            user_token: rawToken,
           },
         };
 
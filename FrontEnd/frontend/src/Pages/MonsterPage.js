@@ -65,12 +65,12 @@ function MonsterPage() {
       if (userToken.exp * 1000 < Date.now()) {
         navigate("/SignIn");
       } else {
-        let user_id = userToken.user_id;
+        // the backend verifies the raw token and gets the user id from it
         const monsterFetch = {
           method: "GET",
           headers: {
             "Content-Type": "application/json",
-            user_token: user_id,
+            user_token: localStorage.getItem("id_token"),
           },
         };
         fetch("/get_user_info", monsterFetch)